@@ -0,0 +1,353 @@
+from __future__ import annotations
+
+import asyncio
+import datetime
+import json
+import logging
+import os
+import re
+import time
+from pathlib import Path
+from typing import Awaitable, Callable, Optional
+
+import aiohttp
+from google.auth.transport.requests import Request
+
+from .drive import (BATCH_LIMIT, DEFAULT_UPLOAD_THREADS, GENERATE_IDS_LIMIT, INITIAL_CHUNK_SIZE,
+                    ChunkTuner, Drive, FileUpload, StreamUpload)
+from .drivepool import DEFAULT_DAILY_QUOTA, DriveIdentity, quota_reason
+from .metrics import track
+from .pipe import StreamPipe
+
+DEFAULT_API_ENDPOINT = "https://www.googleapis.com/"
+FOLDER_MIME_TYPE = "application/vnd.google-apps.folder"
+RANGE_REGEX = re.compile(r"bytes=(\d+)-(\d+)")
+DEFAULT_POOL_SIZE = 64
+UPLOAD_RETRIES = 5
+
+logger = logging.getLogger(__name__)
+
+
+class DriveError(Exception):
+    def __init__(self, status: int, message: str) -> None:
+        super().__init__(f"{status}: {message}")
+        self.status = status
+        self.message = message
+
+
+class AioFileUpload(FileUpload):
+    """
+    File upload that runs on the event loop through `AioDrive` instead of an executor thread.
+    """
+
+    async def _source(self) -> tuple[int, Callable[[int, int], Awaitable[bytes]]]:
+        """
+        Return the size of the upload and a function that reads a chunk of it.
+        """
+        loop = asyncio.get_event_loop()
+        fd = os.open(self.local_path, os.O_RDONLY)
+        self._fd = fd
+
+        async def read(begin: int, length: int) -> bytes:
+            return await loop.run_in_executor(self._manager.upload_executor, os.pread, fd, length, begin)
+
+        return os.fstat(fd).st_size, read
+
+    def _close(self) -> None:
+        fd = getattr(self, "_fd", None)
+        if fd is not None:
+            os.close(fd)
+            self._fd = None
+
+    async def _upload(self) -> Optional[str]:
+        logger.debug(f"start uploading {self.local_path}")
+        try:
+            size, read = await self._source()
+            self.total_size = size
+            self.drive_id, md5 = await self._manager.resumable_upload(self, size, read)
+        finally:
+            self._close()
+        self.set_uploaded(self.total_size)
+        return md5
+
+
+class AioStreamUpload(AioFileUpload, StreamUpload):
+    async def _source(self) -> tuple[int, Callable[[int, int], Awaitable[bytes]]]:
+        await self._pipe.ready.wait()
+        if self._pipe.size is None:
+            raise RuntimeError(f"stream for {self.local_path} was aborted")
+        loop = asyncio.get_event_loop()
+        pipe = self._pipe
+
+        async def read(begin: int, length: int) -> bytes:
+            # blocks until the download caught up
+            return await loop.run_in_executor(self._manager.upload_executor, pipe.read, begin, length)
+
+        return pipe.size, read
+
+
+class AioDrive(Drive):
+    """
+    Drive backend that talks to the REST API with aiohttp over a pooled keep-alive connector
+    instead of googleapiclient and httplib2 on executor threads.
+    """
+
+    def __init__(
+            self,
+            upload_concurrency: int = 1,
+            upload_order: Optional[str] = None,
+            adaptive_chunks: bool = False,
+            identities: Optional[list[DriveIdentity]] = None,
+            daily_quota: int = DEFAULT_DAILY_QUOTA,
+            api_endpoint: Optional[str] = None,
+            pool_size: int = DEFAULT_POOL_SIZE,
+            upload_threads: int = DEFAULT_UPLOAD_THREADS):
+        self._setup(upload_concurrency, upload_order, adaptive_chunks, identities, daily_quota,
+                    upload_threads)
+        endpoint = (api_endpoint or DEFAULT_API_ENDPOINT).rstrip("/") + "/"
+        self.api_url = endpoint + "drive/v3/"
+        self.upload_url = endpoint + "upload/drive/v3/files"
+        self._refresh_lock = asyncio.Lock()
+        self._http = aiohttp.ClientSession(connector=aiohttp.TCPConnector(
+            limit=pool_size, keepalive_timeout=60, ttl_dns_cache=300))
+
+    async def close(self) -> None:
+        await self._http.close()
+        await super().close()
+
+    async def _refresh_token(self, creds) -> None:
+        async with self._refresh_lock:
+            if creds.token and not creds.expired:
+                return
+            if getattr(creds, "refresh_token", None) is None:
+                # service accounts sign a token request, google-auth does that for us
+                await self.loop.run_in_executor(None, creds.refresh, Request())
+                return
+            payload = {
+                "grant_type": "refresh_token",
+                "client_id": creds.client_id,
+                "client_secret": creds.client_secret,
+                "refresh_token": creds.refresh_token,
+            }
+            async with self._http.post(creds.token_uri, data=payload) as resp:
+                data = await resp.json()
+                if resp.status != 200:
+                    raise DriveError(resp.status, json.dumps(data))
+            creds.token = data["access_token"]
+            creds.expiry = datetime.datetime.utcnow() + \
+                datetime.timedelta(seconds=int(data.get("expires_in", 3600)))
+            logger.debug("refreshed drive access token")
+
+    async def _headers(self, identity: DriveIdentity = None) -> dict[str, str]:
+        creds = identity.creds if identity is not None else self._creds
+        if not creds.token or creds.expired:
+            await self._refresh_token(creds)
+        return {"Authorization": f"Bearer {creds.token}"}
+
+    def quota_reason(self, error: Exception) -> Optional[str]:
+        if isinstance(error, DriveError):
+            return quota_reason(error.status, error.message)
+        return None
+
+    async def api_call(self, method: str, url: str, params: dict = None, body: dict = None) -> dict:
+        for attempt in range(2):
+            with track("drive"):
+                async with self._http.request(method, url, params=params, json=body, headers=await self._headers()) as resp:
+                    if resp.status == 401 and attempt == 0:
+                        self._creds.token = None
+                        continue
+                    if resp.status == 204:
+                        return {}
+                    data = await resp.json()
+                    if resp.status >= 400:
+                        raise DriveError(resp.status, json.dumps(data))
+                    return data
+        raise DriveError(401, "unauthorized")
+
+    def upload_file(self, local_path: Path, drive_parent: str = None):
+        if drive_parent is None:
+            drive_parent = self.root
+        return AioFileUpload(self, local_path, drive_parent)
+
+    def upload_stream(self, local_path: Path, pipe: StreamPipe, drive_parent: str = None):
+        if drive_parent is None:
+            drive_parent = self.root
+        return AioStreamUpload(self, local_path, drive_parent, pipe)
+
+    async def _start_session(self, upload: FileUpload, size: int) -> str:
+        metadata = {"name": upload.local_path.name,
+                    "parents": [upload.drive_parent]}
+        params = {"uploadType": "resumable",
+                  "supportsAllDrives": "true", "fields": "id,md5Checksum"}
+        headers = await self._headers(upload.identity)
+        headers["X-Upload-Content-Length"] = str(size)
+        headers["X-Upload-Content-Type"] = "application/octet-stream"
+        async with self._http.post(self.upload_url, params=params, json=metadata, headers=headers) as resp:
+            if resp.status != 200:
+                raise DriveError(resp.status, await resp.text())
+            return resp.headers["Location"]
+
+    async def _session_offset(self, upload: FileUpload, session_url: str, size: int) -> Optional[int]:
+        """
+        Ask how much of the session arrived, returns None if the session is gone.
+        """
+        headers = await self._headers(upload.identity)
+        headers["Content-Range"] = f"bytes */{size}"
+        async with self._http.put(session_url, headers=headers) as resp:
+            if resp.status == 308:
+                return self._range_end(resp)
+            if resp.status in (404, 410):
+                return None
+            raise DriveError(resp.status, await resp.text())
+
+    @staticmethod
+    def _range_end(resp: aiohttp.ClientResponse) -> int:
+        m = RANGE_REGEX.match(resp.headers.get("Range", ""))
+        if m is None:
+            return 0
+        return int(m.group(2)) + 1
+
+    async def resumable_upload(
+            self,
+            upload: FileUpload,
+            size: int,
+            read: Callable[[int, int], Awaitable[bytes]]) -> tuple[str, Optional[str]]:
+        """
+        Upload `size` bytes produced by `read` into a new file, returns the drive id and the
+        MD5 drive computed for it.
+        """
+        session_url = await self._start_session(upload, size)
+        tuner = ChunkTuner() if self.adaptive_chunks else None
+        chunksize = INITIAL_CHUNK_SIZE
+        offset = 0
+        attempt = 0
+        while True:
+            data = await read(offset, chunksize) if size else b""
+            if data:
+                content_range = f"bytes {offset}-{offset + len(data) - 1}/{size}"
+            else:
+                content_range = f"bytes */{size}"
+            headers = await self._headers(upload.identity)
+            headers["Content-Range"] = content_range
+            chunk_start = time.time()
+            try:
+                with track("drive"):
+                    async with self._http.put(session_url, data=data, headers=headers) as resp:
+                        if resp.status in (200, 201):
+                            upload.set_uploaded(size)
+                            response = await resp.json()
+                            return response["id"], response.get("md5Checksum")
+                        if resp.status != 308:
+                            if resp.status == 401:
+                                upload.identity.creds.token = None
+                            raise DriveError(resp.status, await resp.text())
+                        new_offset = self._range_end(resp)
+            except (aiohttp.ClientError, asyncio.TimeoutError, DriveError) as e:
+                if isinstance(e, DriveError) and e.status not in (401, 429) and e.status < 500:
+                    raise
+                attempt += 1
+                if attempt > UPLOAD_RETRIES:
+                    raise
+                logger.warning(
+                    f"uploading {upload.local_path} failed ({e}), retry {attempt}")
+                await asyncio.sleep(min(2 ** attempt, 30))
+                session_offset = await self._session_offset(upload, session_url, size)
+                if session_offset is None:
+                    session_url = await self._start_session(upload, size)
+                    session_offset = 0
+                offset = session_offset
+                upload.set_uploaded(offset)
+                continue
+
+            attempt = 0
+            if tuner:
+                tuner.record(new_offset - offset, time.time() - chunk_start)
+                chunksize = tuner.next_size()
+            offset = new_offset
+            upload.set_uploaded(offset)
+            logger.debug(
+                f"uploading {upload.local_path}: {offset} of {size}")
+
+    async def generate_ids(self, count: int) -> list[str]:
+        ids: list[str] = []
+        while len(ids) < count:
+            response = await self.api_call("GET", self.api_url + "files/generateIds", params={
+                "count": min(count - len(ids), GENERATE_IDS_LIMIT), "space": "drive"})
+            ids.extend(response["ids"])
+        return ids
+
+    async def create_folders(self, folders: list[tuple[str, str, str]]) -> None:
+        """
+        Create folders with pre-generated ids from (id, name, parent) tuples. Requests share the
+        pooled connections, so they are sent concurrently instead of as a multipart batch.
+        """
+        semaphore = asyncio.Semaphore(BATCH_LIMIT)
+
+        async def create(folder_id: str, name: str, parent: str) -> None:
+            async with semaphore:
+                await self.api_call("POST", self.api_url + "files", params={
+                    "fields": "id", "supportsAllDrives": "true"}, body={
+                    "id": folder_id, "name": name, "mimeType": FOLDER_MIME_TYPE, "parents": [parent]})
+
+        await asyncio.gather(*(create(*folder) for folder in folders))
+
+    async def create_folder(self, name: str, root: str = None, app_properties: dict[str, str] = None) -> str:
+        if not root:
+            root = self.root
+
+        logger.debug(f"create folder {name}")
+
+        file_metadata = {
+            "name": name,
+            "mimeType": FOLDER_MIME_TYPE,
+            "parents": [root],
+        }
+
+        if app_properties:
+            file_metadata["appProperties"] = app_properties
+
+        response = await self.api_call("POST", self.api_url + "files", params={
+            "fields": "id", "supportsAllDrives": "true"}, body=file_metadata)
+        return response["id"]
+
+    async def check_folder(self, name: str, drive_parent: str = None) -> Optional[tuple[str, Optional[str]]]:
+        if drive_parent is None:
+            drive_parent = self.root
+        params = {
+            "q": f"'{drive_parent}' in parents and mimeType='{FOLDER_MIME_TYPE}' and name = '{name}' and trashed = false",
+            "spaces": "drive",
+            "fields": "files(id, appProperties)",
+            "includeItemsFromAllDrives": "true",
+            "supportsAllDrives": "true",
+        }
+        response = await self.api_call("GET", self.api_url + "files", params=params)
+        results = response.get("files")
+        if not results:
+            return None
+        torrent_name = results[0].get("appProperties", {}).get("torrent_name")
+        return (results[0]["id"], torrent_name)
+
+    async def delete_file(self, file_id: str) -> None:
+        await self.api_call("DELETE", self.api_url + f"files/{file_id}", params={
+            "supportsAllDrives": "true"})
+
+    async def copy_file(self, file_id: str, name: str, drive_parent: str) -> Optional[str]:
+        try:
+            response = await self.api_call("POST", self.api_url + f"files/{file_id}/copy", params={
+                "fields": "id", "supportsAllDrives": "true"}, body={
+                "name": name, "parents": [drive_parent]})
+        except DriveError as e:
+            if e.status == 404:
+                return None
+            raise
+        return response["id"]
+
+    async def folder_exists(self, folder_id: str) -> bool:
+        try:
+            response = await self.api_call("GET", self.api_url + f"files/{folder_id}", params={
+                "fields": "id, trashed", "supportsAllDrives": "true"})
+        except DriveError as e:
+            if e.status == 404:
+                return False
+            raise
+        return not response.get("trashed", False)
@@ -1,13 +1,15 @@
 from __future__ import annotations
-import aiohttp
 
-import asyncio
 import re
 from pathlib import Path
-import time
 from typing import Any, Optional
 import logging
 
+from .download import DEFAULT_SEGMENT_SIZE, DEFAULT_SEGMENTS, DEFAULT_WRITE_BUFFERS, HttpFileDownload
+from .http_methods import HttpMethods
+from .metrics import track
+from .pipe import StreamPipe
+
 logger = logging.getLogger(__name__)
 
 
@@ -18,34 +20,28 @@ DDOWNLOAD_API_URL = "https://api-v2.ddownload.com/api/"
 DDOWNLOAD_URL = "https://ddownload.com"
 
 
-class DDLFileDownload:
+class DDLFileDownload(HttpFileDownload):
     """
     Represents a file download.
     """
+    source = "ddownload"
 
-    def __init__(self, client: Ddownload, file_id: str, save_path: Path):
+    def __init__(
+            self,
+            client: Ddownload,
+            file_id: str,
+            save_path: Path,
+            segments: int = DEFAULT_SEGMENTS,
+            segment_size: int = DEFAULT_SEGMENT_SIZE,
+            pipe: StreamPipe = None,
+            write_buffers: int = DEFAULT_WRITE_BUFFERS):
+        super().__init__(save_path, segments, segment_size, pipe=pipe, write_buffers=write_buffers)
         self.file_id = file_id
-        self.save_path = save_path
-        self.downloaded_bytes = 0
-        self.total_bytes = 0
-        self.is_started = False
-        self.is_finished = False
-        self.start_time = 0.0
         self._client = client
-        self._task = None
-
-    def start(self):
-        self._task = asyncio.create_task(self.download())
+        self._url: Optional[str] = None
 
-    def cancel(self):
-        if self._task:
-            self._task.cancel()
-
-    async def download(self) -> None:
-        self.start_time = time.time()
-        self.is_started = True
-
-        payload = {
+    def _payload(self) -> dict:
+        return {
             "op": "download2",
             "id": self.file_id,
             "rand": "",
@@ -55,36 +51,48 @@ class DDLFileDownload:
             "adblock_detected": "0"
         }
 
-        with open(self.save_path, "wb") as f:
-            async with self._client._http.post(f"{DDOWNLOAD_URL}/{self.file_id}", data=payload, proxy=self._client._proxy) as resp:
-                if not resp.content_length:
-                    raise Exception("Empty response")
-                self.total_bytes = resp.content_length
-                while True:
-                    chunk = await resp.content.read(1024)
-                    self.downloaded_bytes += len(chunk)
-                    if not chunk:
-                        break
-                    f.write(chunk)
-        self.is_finished = True
-
-
-class Ddownload:
+    async def _prepare(self) -> bool:
+        # premium downloads redirect to the file server, ranges are requested from there
+        self._url = None
+        for attempt in range(2):
+            await self._client.token()
+            with track(self._client.name):
+                async with self._client.request("POST", f"{DDOWNLOAD_URL}/{self.file_id}", data=self._payload(), allow_redirects=False) as resp:
+                    if resp.status in (301, 302, 303, 307, 308):
+                        self._url = resp.headers.get("Location")
+            if self._url or attempt:
+                break
+            # without a redirect the login cookie most likely expired
+            self._client.invalidate_token()
+        return True
+
+    def _request(self, headers: dict):
+        if self._url:
+            return self._client.request("GET", self._url, headers=headers)
+        return self._client.request("POST", f"{DDOWNLOAD_URL}/{self.file_id}", data=self._payload(), headers=headers)
+
+
+class Ddownload(HttpMethods):
+    name = "ddownload"
+    # the login cookie lasts much longer than an hour, re-login is driven by failed downloads
+    token_ttl = 12 * 60 * 60
+
     def __init__(
             self,
             username: str,
             password: str,
             api_key: str,
-            proxy: str = None) -> None:
+            proxy: str = None,
+            segments: int = DEFAULT_SEGMENTS,
+            segment_size: int = DEFAULT_SEGMENT_SIZE,
+            write_buffers: int = DEFAULT_WRITE_BUFFERS) -> None:
+        super().__init__(proxy, ssl=False)
         self._username = username
         self._password = password
-        self._proxy = proxy
+        self._segments = segments
+        self._segment_size = segment_size
+        self._write_buffers = write_buffers
         self._api_key = api_key
-        self._http = aiohttp.ClientSession(
-            connector=aiohttp.TCPConnector(verify_ssl=False), trust_env=True)
-
-    async def close(self) -> None:
-        await self._http.close()
 
     def get_file_id(self, url: str) -> Optional[str]:
         m = re.match(DDOWNLOAD_DL_URL_REGEX, url)
@@ -100,24 +108,30 @@ class Ddownload:
             return None
         return data[0]
 
-    async def api_get(self, url: str, params: dict = {}) -> Optional[Any]:
-        params["key"] = self._api_key
-        async with self._http.get(DDOWNLOAD_API_URL + url, params=params, proxy=self._proxy) as resp:
-            data = await resp.json()
-            if data["status"] != 200:
-                return None
-            return data["result"]
+    async def api_get(self, url: str, params: dict = None) -> Optional[Any]:
+        data = await self.request_json("GET", DDOWNLOAD_API_URL + url, params={
+            **(params or {}), "key": self._api_key})
+        if data["status"] != 200:
+            return None
+        return data["result"]
 
-    async def setup(self) -> None:
+    async def _login(self) -> str:
         payload = {
             "op": "login",
             "login": self._username,
             "password": self._password
         }
-        await self._http.post(DDOWNLOAD_URL, data=payload, proxy=self._proxy)
+        with track(self.name):
+            async with self.request("POST", DDOWNLOAD_URL, data=payload):
+                pass
         cookies = self._http.cookie_jar.filter_cookies(DDOWNLOAD_URL)
         if not "xfss" in cookies:
             raise Exception("Login failed")
+        return cookies["xfss"].value
+
+    async def setup(self) -> None:
+        await self.token()
 
-    async def create_download(self, file_id: str, save_path: Path) -> DDLFileDownload:
-        return DDLFileDownload(self, file_id, save_path)
+    async def create_download(self, file_id: str, save_path: Path, pipe: StreamPipe = None) -> DDLFileDownload:
+        return DDLFileDownload(self, file_id, save_path, self._segments, self._segment_size, pipe,
+            self._write_buffers)
@@ -0,0 +1,115 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import shutil
+from typing import Callable, Optional
+
+DEFAULT_LOW_WATERMARK = 1024 * 1024 * 1024
+RECHECK_INTERVAL = 5.0
+
+logger = logging.getLogger(__name__)
+
+
+class DiskSpaceError(Exception):
+    pass
+
+
+class DiskSpace:
+    """
+    Reserves disk space for downloads before they start. A reservation is the size of the
+    download minus what `written` reports as already on disk, so space is not counted twice
+    while the download fills it.
+
+    `low_watermark` bytes are always kept free, below it `is_low` is set until the free space
+    is back above twice the watermark.
+
+    A reservation that wouldn't fit even once every other reservation is released fails
+    right away instead of waiting.
+    """
+
+    def __init__(self, path: str = ".", low_watermark: int = DEFAULT_LOW_WATERMARK) -> None:
+        self.path = path
+        self.low_watermark = low_watermark
+        self.is_low = False
+        # id -> (size, written)
+        self._reservations: dict[str, tuple[int, Optional[Callable[[], int]]]] = {}
+        self.waiting: dict[str, int] = {}
+        self._changed = asyncio.Event()
+
+    def free(self) -> int:
+        return shutil.disk_usage(self.path).free
+
+    def reserved(self) -> int:
+        total = 0
+        for size, written in self._reservations.values():
+            total += max(0, size - (written() if written else 0))
+        return total
+
+    def reserved_by_others(self, id: str) -> int:
+        """
+        Bytes reserved by every reservation but `id`, whether already written or not.
+        """
+        return sum(size for other, (size, _) in self._reservations.items() if other != id)
+
+    def available(self) -> int:
+        return self.free() - self.reserved() - self.low_watermark
+
+    def try_reserve(self, id: str, size: int, written: Callable[[], int] = None) -> bool:
+        if size > self.available():
+            return False
+        self._reservations[id] = (size, written)
+        return True
+
+    async def reserve(self, id: str, size: int, written: Callable[[], int] = None) -> None:
+        """
+        Wait until `size` bytes are available and reserve them, raises `DiskSpaceError` if they
+        never can be.
+        """
+        needed = size - (written() if written else 0)
+        possible = self.free() + self.reserved_by_others(id) - self.low_watermark
+        if needed > possible:
+            raise DiskSpaceError(
+                f"needs {needed} bytes of disk space, at most {max(0, possible)} can be free")
+        self.waiting[id] = size
+        try:
+            while not self.try_reserve(id, size, written):
+                self._changed.clear()
+                try:
+                    await asyncio.wait_for(self._changed.wait(), RECHECK_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            self.waiting.pop(id, None)
+
+    def resize(self, id: str, size: int) -> None:
+        """
+        Change the size of an existing reservation, e.g. when the wanted part of a torrent
+        changed.
+        """
+        reservation = self._reservations.get(id)
+        if reservation is not None:
+            self._reservations[id] = (size, reservation[1])
+            self.changed()
+
+    def release(self, id: str) -> None:
+        self._reservations.pop(id, None)
+        self.changed()
+
+    def changed(self) -> None:
+        """
+        Wake up the waiting reservations, e.g. after files were deleted.
+        """
+        self._changed.set()
+
+    def check(self) -> bool:
+        """
+        Update and return `is_low` from the current free space.
+        """
+        free = self.free()
+        if not self.is_low and free < self.low_watermark:
+            logger.warning(f"only {free} bytes of disk space left")
+            self.is_low = True
+        elif self.is_low and free > 2 * self.low_watermark:
+            self.is_low = False
+        return self.is_low
@@ -0,0 +1,369 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import os
+import re
+import time
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Optional
+
+import aiohttp
+
+from .metrics import BYTES_DOWNLOADED
+from .pipe import StreamPipe
+from .sink import FileSink, file_md5
+from .throughput import ThroughputTracker
+
+logger = logging.getLogger(__name__)
+
+CONTENT_RANGE_REGEX = re.compile(r"bytes (\d+)-(\d+)/(\d+)")
+
+DEFAULT_SEGMENTS = 4
+DEFAULT_SEGMENT_SIZE = 32 * 1024 * 1024
+READ_SIZE = 65536
+# write buffers of 4 MiB per connection
+DEFAULT_WRITE_BUFFERS = 2
+DEFAULT_RETRIES = 5
+JOURNAL_SAVE_INTERVAL = 2.0
+# statuses that mean the direct link expired or was revoked
+REFRESH_STATUSES = (401, 403, 404, 410)
+
+
+class DownloadError(Exception):
+    pass
+
+
+class DownloadJournal:
+    """
+    Sidecar file that records the completed byte ranges of a download, so it can be continued
+    after a dropped connection or a restart.
+    """
+
+    def __init__(self, path: Path, total: int, done: list[list[int]] = None) -> None:
+        self.path = path
+        self.total = total
+        self.done = done or []
+        self._last_save = 0.0
+
+    @classmethod
+    def load(cls, path: Path, total: int) -> DownloadJournal:
+        try:
+            with open(path) as f:
+                data = json.load(f)
+            if data["total"] == total:
+                return cls(path, total, [list(r) for r in data["done"]])
+        except (OSError, ValueError, KeyError):
+            pass
+        return cls(path, total)
+
+    def done_bytes(self) -> int:
+        return sum(end - start for start, end in self.done)
+
+    def add(self, start: int, end: int) -> None:
+        for r in self.done:
+            if r[0] <= start <= r[1]:
+                r[1] = max(r[1], end)
+                break
+        else:
+            self.done.append([start, end])
+        self.done.sort()
+        merged = [self.done[0]]
+        for r in self.done[1:]:
+            if r[0] <= merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], r[1])
+            else:
+                merged.append(r)
+        self.done = merged
+
+    def missing(self) -> list[tuple[int, int]]:
+        missing = []
+        offset = 0
+        for start, end in self.done:
+            if start > offset:
+                missing.append((offset, start))
+            offset = max(offset, end)
+        if offset < self.total:
+            missing.append((offset, self.total))
+        return missing
+
+    def save(self, force: bool = False) -> None:
+        now = time.time()
+        if not force and now - self._last_save < JOURNAL_SAVE_INTERVAL:
+            return
+        self._last_save = now
+        tmp = self.path.with_name(self.path.name + ".tmp")
+        with open(tmp, "w") as f:
+            json.dump({"total": self.total, "done": self.done}, f)
+        os.replace(tmp, self.path)
+
+    def delete(self) -> None:
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+class HttpFileDownload(ABC):
+    """
+    Represents a file download from a hoster.
+
+    If the server supports HTTP range requests the file is preallocated and fetched as
+    `segment_size` byte ranges over up to `segments` connections at once, otherwise it falls
+    back to a single stream. Completed ranges are recorded in a journal next to the file, so a
+    failed range is retried from where it stopped and a restarted download skips the bytes it
+    already has. Writes go through a `FileSink`, off the event loop, into a preallocated file.
+    The MD5 of the file is computed on the way and is available as `md5` once it is finished.
+
+    With a `pipe` the file is not written to disk, it is streamed in order into the pipe for
+    an upload to consume.
+    """
+    # name of the hoster, for the download metrics
+    source = "http"
+    # drive folder the file is uploaded into, created when the upload starts
+    drive_folder: Optional[str] = None
+
+    def __init__(
+            self,
+            save_path: Path,
+            segments: int = DEFAULT_SEGMENTS,
+            segment_size: int = DEFAULT_SEGMENT_SIZE,
+            retries: int = DEFAULT_RETRIES,
+            pipe: StreamPipe = None,
+            write_buffers: int = DEFAULT_WRITE_BUFFERS):
+        self.save_path = save_path
+        self.pipe = pipe
+        self.journal_path = save_path.with_name(save_path.name + ".journal")
+        self.segments = max(1, segments)
+        self.segment_size = max(READ_SIZE, segment_size)
+        self.retries = retries
+        self.write_buffers = max(1, write_buffers)
+        self.downloaded_bytes = 0
+        self.total_bytes = 0
+        self.is_started = False
+        self.is_finished = False
+        self.start_time = 0.0
+        self.throughput = ThroughputTracker(lambda: self.downloaded_bytes)
+        self._task = None
+        self._journal: Optional[DownloadJournal] = None
+        self._sink: Optional[FileSink] = None
+        self.md5: Optional[str] = None
+        self._refresh_lock = asyncio.Lock()
+        self._generation = 0
+        self._downloaded_metric = BYTES_DOWNLOADED.labels(self.source)
+
+    def start(self) -> asyncio.Task:
+        self._task = asyncio.create_task(self.download())
+        return self._task
+
+    def cancel(self):
+        if self._task:
+            self._task.cancel()
+
+    def disk_usage(self) -> int:
+        """
+        Bytes of the file that take up disk space, the whole file once it is preallocated.
+        """
+        if self._sink is not None:
+            return max(self._sink.allocated, self.downloaded_bytes)
+        return self.downloaded_bytes
+
+    async def _prepare(self) -> bool:
+        """
+        Resolve whatever `_request` needs, returns False if the file is not available.
+        """
+        return True
+
+    @abstractmethod
+    def _request(self, headers: dict):
+        """
+        Return the request context manager for the file with the given extra headers.
+        """
+        pass
+
+    async def _refresh(self, generation: int) -> None:
+        """
+        Resolve the file again after the link failed, once for all segments that saw it fail.
+        """
+        async with self._refresh_lock:
+            if generation != self._generation:
+                return
+            logger.info(f"refreshing download link for {self.save_path}")
+            if not await self._prepare():
+                raise DownloadError(f"{self.save_path} is no longer available")
+            self._generation += 1
+
+    async def download(self) -> None:
+        self.start_time = time.time()
+        self.is_started = True
+        # samples taken while the job was queued don't count towards a stall
+        self.throughput.reset()
+        if self.pipe is not None:
+            try:
+                if not await self._prepare():
+                    raise DownloadError(f"{self.save_path} is not available")
+                await self._download_stream()
+            except BaseException as e:
+                self.pipe.abort(e)
+                raise
+            self.md5 = self.pipe.md5
+            self.is_finished = True
+            return
+
+        if not await self._prepare():
+            return
+
+        total_bytes = await self._probe()
+        if total_bytes:
+            self.total_bytes = total_bytes
+            logger.debug(
+                f"downloading {self.save_path} in {self.segments} segments")
+            await self._download_segmented()
+        else:
+            DownloadJournal(self.journal_path, 0).delete()
+            await self._download_single()
+        self.md5 = self._sink.md5
+        if self.md5 is None:
+            # the sink gave up on the checksum, without it the upload could not be verified
+            logger.info(f"hashing {self.save_path} after the download")
+            loop = asyncio.get_event_loop()
+            self.md5 = await loop.run_in_executor(None, file_md5, self.save_path)
+        self.is_finished = True
+
+    async def _probe(self) -> Optional[int]:
+        """
+        Check if the server supports range requests, returns the total size if it does.
+        """
+        async with self._request({"Range": "bytes=0-0"}) as resp:
+            if resp.status != 206:
+                return None
+            m = CONTENT_RANGE_REGEX.match(resp.headers.get("Content-Range", ""))
+            if m is None:
+                return None
+            return int(m.group(3))
+
+    async def _download_single(self) -> None:
+        self.downloaded_bytes = 0
+        async with self._request({}) as resp:
+            if not resp.content_length:
+                raise DownloadError("Empty response")
+            self.total_bytes = resp.content_length
+            self._sink = FileSink(self.save_path, buffers=self.write_buffers, checksum=True)
+            await self._sink.open(self.total_bytes)
+            try:
+                stream = self._sink.stream(0)
+                async for chunk in resp.content.iter_any():
+                    self.downloaded_bytes += len(chunk)
+                    self._downloaded_metric.inc(len(chunk))
+                    await stream.write(chunk)
+                stream.flush()
+            finally:
+                await self._sink.close()
+
+    async def _download_stream(self) -> None:
+        async with self._request({}) as resp:
+            if not resp.content_length:
+                raise DownloadError("Empty response")
+            self.total_bytes = resp.content_length
+            self.pipe.set_size(self.total_bytes)
+            while True:
+                chunk = await resp.content.read(READ_SIZE)
+                if not chunk:
+                    break
+                self.downloaded_bytes += len(chunk)
+                self._downloaded_metric.inc(len(chunk))
+                await self.pipe.write(chunk)
+        self.pipe.close()
+
+    async def _download_segmented(self) -> None:
+        journal = DownloadJournal.load(self.journal_path, self.total_bytes)
+        if journal.done and self.save_path.exists() \
+                and self.save_path.stat().st_size == self.total_bytes:
+            logger.info(
+                f"resuming {self.save_path} at {journal.done_bytes()} of {self.total_bytes} bytes")
+        else:
+            journal = DownloadJournal(self.journal_path, self.total_bytes)
+        self._journal = journal
+        self.downloaded_bytes = journal.done_bytes()
+        self._sink = FileSink(self.save_path, self._on_written,
+                              buffers=self.write_buffers * self.segments, checksum=True,
+                              # a segment can run ahead of the hashed prefix by the others in flight
+                              hold_back=self.segments * self.segment_size)
+        await self._sink.open(self.total_bytes, keep=bool(journal.done),
+                        existing=journal.done)
+
+        queue: asyncio.Queue[tuple[int, int]] = asyncio.Queue()
+        for missing_start, missing_end in journal.missing():
+            for start in range(missing_start, missing_end, self.segment_size):
+                queue.put_nowait(
+                    (start, min(start + self.segment_size, missing_end)))
+
+        try:
+            workers = [asyncio.create_task(self._segment_worker(queue))
+                       for _ in range(min(self.segments, queue.qsize()))]
+            try:
+                await asyncio.gather(*workers)
+            except BaseException:
+                for worker in workers:
+                    worker.cancel()
+                raise
+        finally:
+            await self._sink.close()
+            journal.save(force=True)
+        journal.delete()
+
+    def _on_written(self, start: int, end: int) -> None:
+        self._journal.add(start, end)
+        self._journal.save()
+
+    async def _segment_worker(self, queue: asyncio.Queue[tuple[int, int]]) -> None:
+        while not queue.empty():
+            start, end = queue.get_nowait()
+            # offset reached and end of the segment, a retry continues from the offset
+            segment = [start, end]
+            attempt = 0
+            while True:
+                generation = self._generation
+                try:
+                    await self._fetch_range(segment)
+                    break
+                except (aiohttp.ClientError, asyncio.TimeoutError, DownloadError) as e:
+                    attempt += 1
+                    if attempt > self.retries:
+                        raise
+                    logger.warning(
+                        f"segment {segment[0]}-{end} of {self.save_path} failed ({e}), retry {attempt}")
+                    await asyncio.sleep(min(2 ** attempt, 30))
+                    if isinstance(e, aiohttp.ClientResponseError) and e.status in REFRESH_STATUSES:
+                        await self._refresh(generation)
+
+    async def _fetch_range(self, segment: list[int]) -> None:
+        """
+        Fetch the rest of a segment into the file, `segment[0]` follows the offset reached.
+        """
+        start, end = segment
+        offset = start
+        async with self._request({"Range": f"bytes={start}-{end - 1}"}) as resp:
+            if resp.status != 206:
+                raise aiohttp.ClientResponseError(
+                    resp.request_info, resp.history, status=resp.status,
+                    message=f"range request for {self.save_path} returned {resp.status}")
+            stream = self._sink.stream(start)
+            try:
+                while offset < end:
+                    chunk = await resp.content.readany()
+                    if not chunk:
+                        break
+                    chunk = chunk[:end - offset]
+                    await stream.write(chunk)
+                    offset += len(chunk)
+                    segment[0] = offset
+                    self.downloaded_bytes += len(chunk)
+                    self._downloaded_metric.inc(len(chunk))
+            finally:
+                stream.flush()
+        if offset != end:
+            raise DownloadError(
+                f"segment {start}-{end} of {self.save_path} ended at {offset}")
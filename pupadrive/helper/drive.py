@@ -2,24 +2,185 @@ from __future__ import annotations
 
 import asyncio
 import logging
+import mmap
 import os
 import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Optional
+from typing import TYPE_CHECKING, Optional
 
+import httplib2
 from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
+from google_auth_httplib2 import AuthorizedHttp
 from google_auth_oauthlib.flow import InstalledAppFlow
 from googleapiclient.discovery import MediaFileUpload, build
-from googleapiclient.http import HttpRequest
-
+from googleapiclient.errors import HttpError
+from googleapiclient.http import HttpRequest, MediaUpload
+
+from .drivepool import DEFAULT_DAILY_QUOTA, DriveIdentity, DrivePool, quota_reason
+from .metrics import BYTES_DEDUPLICATED, BYTES_UPLOADED, track
+from .pipe import StreamPipe
+from .sink import file_md5
+from .throughput import ThroughputTracker
 from .utils import try_get_env
 
+if TYPE_CHECKING:
+    from .index import MirrorIndex
+
 SCOPES = ["https://www.googleapis.com/auth/drive"]
+UPLOAD_ORDERS = ("largest", "smallest")
+# resumable chunks have to be a multiple of 256 KiB
+CHUNK_GRANULARITY = 256 * 1024
+MIN_CHUNK_SIZE = 4 * CHUNK_GRANULARITY
+MAX_CHUNK_SIZE = 1024 * CHUNK_GRANULARITY
+INITIAL_CHUNK_SIZE = 32 * CHUNK_GRANULARITY
+STREAM_CHUNK_SIZE = 32 * CHUNK_GRANULARITY
+GENERATE_IDS_LIMIT = 1000
+BATCH_LIMIT = 100
+TARGET_CHUNK_SECONDS = 5.0
+VERIFY_RETRIES = 2
+# smaller files are uploaded again, a copy would not save much
+DEDUP_MIN_SIZE = 1024 * 1024
+DEFAULT_UPLOAD_THREADS = 8
 
 logger = logging.getLogger(__name__)
 
 
+class ChecksumMismatch(Exception):
+    pass
+
+
+def load_credentials() -> Credentials:
+    creds = None
+
+    if os.path.exists('token.json'):
+        creds = Credentials.from_authorized_user_file('token.json', SCOPES)
+    if not creds or not creds.valid:
+        if creds and creds.expired and creds.refresh_token:
+            creds.refresh(Request())
+        else:
+            flow = InstalledAppFlow.from_client_secrets_file(
+                'credentials.json', SCOPES)
+            creds = flow.run_console()
+        # Save the credentials for the next run
+        with open('token.json', 'w') as token:
+            token.write(creds.to_json())
+    return creds
+
+
+class MmapMediaUpload(MediaUpload):
+    """
+    Resumable media source that hands out chunks as views into a memory map of the file
+    instead of reading them into new buffers. The chunk size can change between chunks.
+    """
+
+    def __init__(self, path: Path, chunksize: int = INITIAL_CHUNK_SIZE,
+                 mimetype: str = "application/octet-stream") -> None:
+        self._file = open(path, "rb")
+        self._size = os.fstat(self._file.fileno()).st_size
+        self._mmap = None
+        self._view = None
+        if self._size:
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            self._mmap.madvise(mmap.MADV_SEQUENTIAL)
+            self._view = memoryview(self._mmap)
+        self._chunksize = chunksize
+        self._mimetype = mimetype
+
+    def chunksize(self) -> int:
+        return self._chunksize
+
+    def set_chunksize(self, chunksize: int) -> None:
+        self._chunksize = chunksize
+
+    def mimetype(self) -> str:
+        return self._mimetype
+
+    def size(self) -> int:
+        return self._size
+
+    def resumable(self) -> bool:
+        return True
+
+    def has_stream(self) -> bool:
+        return False
+
+    def getbytes(self, begin: int, length: int):
+        if self._view is None:
+            return b""
+        return self._view[begin:begin + length]
+
+    def close(self) -> None:
+        if self._view is not None:
+            self._view.release()
+        if self._mmap is not None:
+            try:
+                self._mmap.close()
+            except BufferError:
+                # a chunk view is still referenced, the map goes away with it
+                pass
+        self._file.close()
+
+
+class StreamMediaUpload(MediaUpload):
+    """
+    Resumable media source that reads from a `StreamPipe` as the data arrives.
+    """
+
+    def __init__(self, pipe: StreamPipe, mimetype: str = "application/octet-stream") -> None:
+        self._pipe = pipe
+        self._mimetype = mimetype
+        # a whole chunk has to fit in the pipe next to the data being written
+        self._chunksize = max(CHUNK_GRANULARITY, min(
+            STREAM_CHUNK_SIZE, pipe.capacity // 2 // CHUNK_GRANULARITY * CHUNK_GRANULARITY))
+
+    def chunksize(self) -> int:
+        return self._chunksize
+
+    def mimetype(self) -> str:
+        return self._mimetype
+
+    def size(self) -> Optional[int]:
+        return self._pipe.size
+
+    def resumable(self) -> bool:
+        return True
+
+    def has_stream(self) -> bool:
+        return False
+
+    def getbytes(self, begin: int, length: int) -> bytes:
+        return self._pipe.read(begin, length)
+
+
+class ChunkTuner:
+    """
+    Picks resumable chunk sizes from the measured throughput and round-trip time, so each
+    chunk takes about `TARGET_CHUNK_SECONDS` and the round-trip stays a small share of it.
+    """
+
+    def __init__(self) -> None:
+        self.rate = 0.0
+        self.rtt: Optional[float] = None
+
+    def record(self, sent: int, elapsed: float) -> None:
+        if sent <= 0 or elapsed <= 0:
+            return
+        rate = sent / elapsed
+        self.rate = rate if not self.rate else 0.7 * self.rate + 0.3 * rate
+        # whatever the chunk took beyond its transfer time is the round-trip
+        rtt = max(0.0, elapsed - sent / max(self.rate, rate))
+        self.rtt = rtt if self.rtt is None else min(self.rtt, rtt) * 0.9 + rtt * 0.1
+
+    def next_size(self) -> int:
+        if not self.rate:
+            return INITIAL_CHUNK_SIZE
+        target = max(TARGET_CHUNK_SECONDS, (self.rtt or 0.0) * 20)
+        size = int(self.rate * target) // CHUNK_GRANULARITY * CHUNK_GRANULARITY
+        return max(MIN_CHUNK_SIZE, min(MAX_CHUNK_SIZE, size))
+
+
 class FileUpload:
     local_path: Path
     total_size: int
@@ -28,6 +189,14 @@ class FileUpload:
     drive_id: str
     is_uploading = False
     is_finished = False
+    # where the file came from, for the upload metrics
+    source = "unknown"
+    # MD5 the file on drive has to match, if known
+    expected_md5: Optional[str] = None
+    # whether the data can be read again for another attempt
+    retryable = True
+    # the pool identity the upload goes through
+    identity: Optional[DriveIdentity] = None
     _manager: Drive
 
     def __init__(self, manager: Drive, local_path: Path, drive_parent: str) -> None:
@@ -37,6 +206,12 @@ class FileUpload:
         self.drive_parent = drive_parent
         self._manager = manager
         self.start_time = 0.0
+        self.throughput = ThroughputTracker(self.total_uploaded)
+
+    async def _media(self) -> MediaUpload:
+        if self._manager.adaptive_chunks:
+            return MmapMediaUpload(self.local_path)
+        return MediaFileUpload(self.local_path, resumable=True)
 
     def uploaded(self) -> bool:
         return self.drive_id is not None
@@ -44,41 +219,134 @@ class FileUpload:
     def total_uploaded(self) -> int:
         return self.uploaded_size
 
+    def set_uploaded(self, uploaded: int) -> None:
+        BYTES_UPLOADED.labels(self.source).inc(max(0, uploaded - self.uploaded_size))
+        self.uploaded_size = uploaded
+
     async def upload(self):
         self.is_uploading = True
         self.start_time = time.time()
+        if not await self._copy_duplicate():
+            for attempt in range(VERIFY_RETRIES + 1):
+                md5 = await self._pooled_upload()
+                expected = self._expected_md5()
+                if expected is None or md5 is None or md5 == expected:
+                    break
+                logger.warning(
+                    f"{self.local_path} arrived on drive as {md5} instead of {expected}")
+                await self._manager.delete_file(self.drive_id)
+                if not self.retryable or attempt == VERIFY_RETRIES:
+                    raise ChecksumMismatch(f"{self.local_path} is corrupt on drive")
+                self.uploaded_size = 0
+            if md5 is not None and self._manager.index is not None:
+                await self._manager.index.put_content(self.total_size, md5, self.drive_id)
+        self.is_uploading = False
+        self.is_finished = True
+
+    async def _copy_duplicate(self) -> bool:
+        """
+        Copy a file with the same size and MD5 that is already on drive instead of uploading
+        this one, returns whether it did.
+        """
+        index = self._manager.index
+        # streams can't be hashed before they are uploaded
+        if index is None or not self.retryable or self.total_size < DEDUP_MIN_SIZE:
+            return False
+        if self.expected_md5 is None:
+            # only hash the file if something of its size was uploaded before
+            if not await index.has_size(self.total_size):
+                return False
+            loop = asyncio.get_event_loop()
+            self.expected_md5 = await loop.run_in_executor(None, file_md5, self.local_path)
+        file_id = await index.get_content(self.total_size, self.expected_md5)
+        if file_id is None:
+            return False
+        drive_id = await self._manager.copy_file(file_id, self.local_path.name, self.drive_parent)
+        if drive_id is None:
+            logger.info(f"{file_id} is no longer on drive, removing it from the index")
+            await index.remove_content(self.total_size, self.expected_md5)
+            return False
+        logger.info(f"{self.local_path} is already on drive as {file_id}, copied it")
+        self.drive_id = drive_id
+        self.uploaded_size = self.total_size
+        BYTES_DEDUPLICATED.labels(self.source).inc(self.total_size)
+        return True
+
+    async def _pooled_upload(self) -> Optional[str]:
+        """
+        Upload the file through an identity of the pool, moving on to another one when it
+        runs into its quota.
+        """
+        pool = self._manager.pool
+        while True:
+            size = self.total_size
+            identity = pool.acquire(size)
+            self.identity = identity
+            try:
+                return await self._upload()
+            except Exception as e:
+                reason = self._manager.quota_reason(e)
+                if reason is not None:
+                    pool.block(identity, reason)
+                if reason is None or not self.retryable:
+                    raise
+            finally:
+                pool.release(identity, size, self.uploaded_size)
+            self.uploaded_size = 0
+
+    def _expected_md5(self) -> Optional[str]:
+        return self.expected_md5
+
+    async def _upload(self) -> Optional[str]:
+        """
+        Upload the file once, returns the MD5 drive computed for it.
+        """
         file_name = self.local_path.name
         file_metadata = {
             "name": file_name,
             "parents": [self.drive_parent]
         }
-        media = MediaFileUpload(self.local_path, resumable=True)
-        request = self._manager.service.files().create(body=file_metadata,
+        media = await self._media()
+        tuner = ChunkTuner() if isinstance(media, MmapMediaUpload) else None
+        request = self.identity.service.files().create(body=file_metadata,
                                                        media_body=media,
-                                                       fields='id',
+                                                       fields='id, md5Checksum',
                                                        supportsAllDrives=True)  # type: HttpRequest
 
         loop = asyncio.get_event_loop()
         logger.debug(f"start uploading {self.local_path}")
+        # httplib2 is not thread-safe, every upload gets its own connection
+        http = self._manager.new_http(self.identity)
 
         def upload_file():
             response = None
             while response is None:
-                status, response = request.next_chunk(num_retries=3)
+                sent_before = self.uploaded_size
+                chunk_start = time.time()
+                with track("drive"):
+                    status, response = request.next_chunk(http=http, num_retries=3)
                 if status:
-                    self.uploaded_size = status.resumable_progress
+                    self.set_uploaded(status.resumable_progress)
+                if tuner:
+                    tuner.record(self.uploaded_size - sent_before,
+                                 time.time() - chunk_start)
+                    media.set_chunksize(tuner.next_size())
                 logger.debug(
                     f"uploading {self.local_path}: {self.uploaded_size} of {self.total_size}")
 
-            self.uploaded_size = self.total_size
+            self.set_uploaded(self.total_size)
             self.drive_id = response["id"]
+            return response.get("md5Checksum")
 
-        await loop.run_in_executor(None, upload_file)
-        self.is_uploading = False
-        self.is_finished = True
+        try:
+            return await loop.run_in_executor(self._manager.upload_executor, upload_file)
+        finally:
+            if isinstance(media, MmapMediaUpload):
+                media.close()
 
-    def start(self):
+    def start(self) -> asyncio.Task:
         self._task = asyncio.create_task(self.upload())
+        return self._task
 
     async def wait_until_finished(self):
         await self._task
@@ -88,20 +356,73 @@ class FileUpload:
             self._task.cancel()
 
 
+class StreamUpload(FileUpload):
+    """
+    Uploads a file while it is still being downloaded, reading it from a `StreamPipe` instead
+    of the disk. `local_path` is only used for the file name.
+    """
+    retryable = False
+
+    def __init__(self, manager: Drive, local_path: Path, drive_parent: str, pipe: StreamPipe) -> None:
+        self.total_size = 0
+        self.local_path = local_path
+        self.drive_parent = drive_parent
+        self._manager = manager
+        self._pipe = pipe
+        self.start_time = 0.0
+        self.throughput = ThroughputTracker(self.total_uploaded)
+
+    async def _media(self) -> MediaUpload:
+        # the session needs the size, which is known once the download got its response
+        await self._pipe.ready.wait()
+        if self._pipe.size is None:
+            raise RuntimeError(f"stream for {self.local_path} was aborted")
+        self.total_size = self._pipe.size
+        return StreamMediaUpload(self._pipe)
+
+    def _expected_md5(self) -> Optional[str]:
+        # hashed by the pipe while the download went through it
+        return self._pipe.md5
+
+
 class FolderUpload:
-    files: list[FileUpload] = []
-    total_size: int = 0
+    """
+    Uploads a directory tree, with up to `concurrency` files in flight at once. `order` picks
+    which files go first, "largest" or "smallest", otherwise they go in directory order.
+    With `selected` only those files and the folders leading to them are uploaded.
+
+    The folder tree is created with pre-generated ids one depth level per batch, and a file
+    starts uploading as soon as its parent folder exists.
+    """
+    files: list[FileUpload]
+    total_size: int
     drive_parent: str
     local_path: Path
     is_uploading = False
     is_finished = False
     start_time: float = 0.0
+    source = "unknown"
     _manager: Drive
 
-    def __init__(self, manager: Drive, path: Path, drive_parent: str) -> None:
+    def __init__(
+            self,
+            manager: Drive,
+            path: Path,
+            drive_parent: str,
+            concurrency: int = 1,
+            order: Optional[str] = None,
+            selected: Optional[list[Path]] = None) -> None:
         self.local_path = path
         self.drive_parent = drive_parent
+        # only these files are uploaded if it is set
+        self.selected = selected
+        self.concurrency = max(1, concurrency)
+        self.order = order
+        self.files = []
+        self.total_size = 0
         self._manager = manager
+        self._folder_ready: dict[str, asyncio.Event] = {}
+        self.throughput = ThroughputTracker(self.total_uploaded)
 
     def total_uploaded(self) -> int:
         total = 0
@@ -109,69 +430,282 @@ class FolderUpload:
             total += file.uploaded_size
         return total
 
-    async def _setup(self, path: Path = None, drive_parent: str = None):
-        if path is None:
-            path = self.local_path
-        if drive_parent is None:
-            drive_parent = self.drive_parent
-
-        for p in path.iterdir():
-            if p.is_dir():
-                sub_folder = await self._manager.create_folder(p.name, drive_parent)
-                await self._setup(p, sub_folder)
-            elif p.is_file():
-                file = self._manager.upload_file(p, drive_parent)
-                self.total_size += file.total_size
-                self.files.append(file)
+    def _setup(self) -> tuple[list[Path], list[Path]]:
+        """
+        Walk the tree, returns all sub folders (parents before children) and all files.
+        """
+        if self.selected is not None:
+            paths = [p for p in self.selected if p.is_file()]
+            parents = {self.local_path / parent for p in paths
+                       for parent in p.relative_to(self.local_path).parents if parent.parts}
+            return sorted(parents, key=lambda d: len(d.parts)), paths
+        dirs: list[Path] = []
+        paths: list[Path] = []
+        for root, dirnames, filenames in os.walk(self.local_path):
+            dirs.extend(Path(root) / d for d in dirnames)
+            paths.extend(Path(root) / f for f in filenames)
+        return dirs, paths
+
+    async def _create_folders(self, levels: list[list[tuple[str, str, str]]]) -> None:
+        for level in levels:
+            await self._manager.create_folders(level)
+            for folder_id, _, _ in level:
+                self._folder_ready[folder_id].set()
+
+    def _ordered(self) -> list[FileUpload]:
+        if self.order == "largest":
+            return sorted(self.files, key=lambda f: f.total_size, reverse=True)
+        if self.order == "smallest":
+            return sorted(self.files, key=lambda f: f.total_size)
+        return list(self.files)
+
+    async def _upload_worker(self, queue: asyncio.Queue[FileUpload]) -> None:
+        while not queue.empty():
+            file = queue.get_nowait()
+            await self._folder_ready[file.drive_parent].wait()
+            await file.upload()
 
     async def upload(self):
-        await self._setup()
+        dirs, paths = await asyncio.get_event_loop().run_in_executor(None, self._setup)
+        ids = await self._manager.generate_ids(len(dirs))
+        folder_ids = {self.local_path: self.drive_parent}
+        self._folder_ready = {self.drive_parent: asyncio.Event()}
+        self._folder_ready[self.drive_parent].set()
+        levels: list[list[tuple[str, str, str]]] = []
+        for d, folder_id in zip(dirs, ids):
+            folder_ids[d] = folder_id
+            self._folder_ready[folder_id] = asyncio.Event()
+            depth = len(d.relative_to(self.local_path).parts) - 1
+            while len(levels) <= depth:
+                levels.append([])
+            levels[depth].append((folder_id, d.name, folder_ids[d.parent]))
+        for p in paths:
+            file = self._manager.upload_file(p, folder_ids[p.parent])
+            file.source = self.source
+            self.total_size += file.total_size
+            self.files.append(file)
+
         self.start_time = time.time()
         self.is_uploading = True
-        for file in self.files:
-            await file.upload()
+
+        queue: asyncio.Queue[FileUpload] = asyncio.Queue()
+        for file in self._ordered():
+            queue.put_nowait(file)
+        # files start as soon as the level of their parent folder exists
+        workers = [asyncio.create_task(self._create_folders(levels))]
+        workers += [asyncio.create_task(self._upload_worker(queue))
+                    for _ in range(min(self.concurrency, max(1, queue.qsize())))]
+        try:
+            await asyncio.gather(*workers)
+        except BaseException:
+            for worker in workers:
+                worker.cancel()
+            raise
 
         self.is_uploading = False
         self.is_finished = True
 
-    def start(self):
+    def start(self) -> asyncio.Task:
         self._task = asyncio.create_task(self.upload())
+        return self._task
 
     def cancel(self):
         if self._task:
             self._task.cancel()
 
 
+class IncrementalUpload(FolderUpload):
+    """
+    Uploads files of a directory as they are added with `add_file`, e.g. the files of a torrent
+    as soon as each of them completed. Sub folders are created on first use, `finish` marks
+    that no more files will be added.
+    """
+
+    def __init__(
+            self,
+            manager: Drive,
+            path: Path,
+            drive_parent: str,
+            total_size: int,
+            concurrency: int = 1) -> None:
+        super().__init__(manager, path, drive_parent, concurrency)
+        self.total_size = total_size
+        self._queue: asyncio.Queue[Optional[Path]] = asyncio.Queue()
+        self._added: set[Path] = set()
+        self._folders: dict[Path, str] = {Path("."): drive_parent}
+        self._folders_lock = asyncio.Lock()
+
+    def add_file(self, path: Path) -> None:
+        if path in self._added:
+            return
+        self._added.add(path)
+        self._queue.put_nowait(path)
+
+    def finish(self) -> None:
+        for _ in range(self.concurrency):
+            self._queue.put_nowait(None)
+
+    async def _folder(self, relative: Path) -> str:
+        async with self._folders_lock:
+            return await self._create_folders(relative)
+
+    async def _create_folders(self, relative: Path) -> str:
+        if relative not in self._folders:
+            parent = await self._create_folders(relative.parent)
+            self._folders[relative] = await self._manager.create_folder(relative.name, parent)
+        return self._folders[relative]
+
+    async def _upload_worker(self, queue: asyncio.Queue[Optional[Path]]) -> None:
+        while True:
+            path = await queue.get()
+            if path is None:
+                return
+            parent = await self._folder(path.parent.relative_to(self.local_path))
+            file = self._manager.upload_file(path, parent)
+            file.source = self.source
+            self.files.append(file)
+            await file.upload()
+
+    async def upload(self):
+        self.start_time = time.time()
+        self.is_uploading = True
+
+        workers = [asyncio.create_task(self._upload_worker(self._queue))
+                   for _ in range(self.concurrency)]
+        try:
+            await asyncio.gather(*workers)
+        except BaseException:
+            for worker in workers:
+                worker.cancel()
+            raise
+
+        self.is_uploading = False
+        self.is_finished = True
+
+
 class Drive:
-    def __init__(self):
+    # uploads look up and record their content here if it is set
+    index: Optional[MirrorIndex] = None
+
+    def __init__(
+            self,
+            upload_concurrency: int = 1,
+            upload_order: Optional[str] = None,
+            adaptive_chunks: bool = False,
+            identities: Optional[list[DriveIdentity]] = None,
+            daily_quota: int = DEFAULT_DAILY_QUOTA,
+            api_endpoint: Optional[str] = None,
+            upload_threads: int = DEFAULT_UPLOAD_THREADS):
+        self._setup(upload_concurrency, upload_order, adaptive_chunks, identities, daily_quota,
+                    upload_threads)
+        client_options = {"api_endpoint": api_endpoint} if api_endpoint else None
+        for identity in self.pool.identities:
+            identity.service = build(
+                'drive', 'v3', credentials=identity.creds, client_options=client_options)
+        self.service = self.pool.primary.service
+
+    def _setup(
+            self,
+            upload_concurrency: int,
+            upload_order: Optional[str],
+            adaptive_chunks: bool,
+            identities: Optional[list[DriveIdentity]],
+            daily_quota: int,
+            upload_threads: int) -> None:
+        """
+        Settings and identity pool shared by the drive backends.
+
+        Uploads block a thread for as long as they run, so they get `upload_threads` threads of
+        their own instead of holding up the default executor.
+        """
         self.root = try_get_env("DRIVE_ROOT")
-        creds = None
-
-        if os.path.exists('token.json'):
-            creds = Credentials.from_authorized_user_file('token.json', SCOPES)
-        if not creds or not creds.valid:
-            if creds and creds.expired and creds.refresh_token:
-                creds.refresh(Request())
-            else:
-                flow = InstalledAppFlow.from_client_secrets_file(
-                    'credentials.json', SCOPES)
-                creds = flow.run_console()
-            # Save the credentials for the next run
-            with open('token.json', 'w') as token:
-                token.write(creds.to_json())
-
-        self.service = build('drive', 'v3', credentials=creds)
+        self.adaptive_chunks = adaptive_chunks
+        self.upload_concurrency = upload_concurrency
+        self.upload_order = upload_order if upload_order in UPLOAD_ORDERS else None
+        if identities is None:
+            identities = [DriveIdentity("default", load_credentials())]
+        self.pool = DrivePool(identities, daily_quota)
+        self._creds = self.pool.primary.creds
         self.loop = asyncio.get_event_loop()
+        self.upload_executor = ThreadPoolExecutor(
+            max_workers=max(1, upload_threads), thread_name_prefix="upload")
+
+    async def close(self) -> None:
+        """
+        Release what the backend holds on to, called on shutdown.
+        """
+        self.upload_executor.shutdown(wait=False)
+
+    def new_http(self, identity: DriveIdentity = None) -> AuthorizedHttp:
+        creds = identity.creds if identity is not None else self._creds
+        return AuthorizedHttp(creds, http=httplib2.Http())
+
+    def quota_reason(self, error: Exception) -> Optional[str]:
+        """
+        Return the reason if `error` is a quota or rate limit error of drive.
+        """
+        if isinstance(error, HttpError):
+            return quota_reason(error.resp.status, error.content)
+        return None
 
     def upload_file(self, local_path: Path, drive_parent: str = None):
         if drive_parent is None:
             drive_parent = self.root
         return FileUpload(self, local_path, drive_parent)
 
-    def upload_folder(self, path: Path, drive_parent: str):
-        up = FolderUpload(self, path, drive_parent)
+    def upload_stream(self, local_path: Path, pipe: StreamPipe, drive_parent: str = None):
+        if drive_parent is None:
+            drive_parent = self.root
+        return StreamUpload(self, local_path, drive_parent, pipe)
+
+    def upload_folder(self, path: Path, drive_parent: str, selected: Optional[list[Path]] = None):
+        up = FolderUpload(self, path, drive_parent,
+                          self.upload_concurrency, self.upload_order, selected)
         return up
 
+    def upload_incremental(self, path: Path, drive_parent: str, total_size: int):
+        return IncrementalUpload(self, path, drive_parent, total_size, self.upload_concurrency)
+
+    async def generate_ids(self, count: int) -> list[str]:
+        ids: list[str] = []
+        while len(ids) < count:
+            request = self.service.files().generateIds(
+                count=min(count - len(ids), GENERATE_IDS_LIMIT), space='drive')
+            with track("drive"):
+                response = await self.loop.run_in_executor(None, request.execute, self.new_http())
+            ids.extend(response["ids"])
+        return ids
+
+    async def create_folders(self, folders: list[tuple[str, str, str]]) -> None:
+        """
+        Create folders with pre-generated ids from (id, name, parent) tuples, batching up to
+        `BATCH_LIMIT` requests per http call.
+        """
+        errors: list[Exception] = []
+
+        def callback(request_id, response, exception):
+            if exception is not None:
+                errors.append(exception)
+
+        for i in range(0, len(folders), BATCH_LIMIT):
+            chunk = folders[i:i + BATCH_LIMIT]
+            batch = self.service.new_batch_http_request(callback=callback)
+            for folder_id, name, parent in chunk:
+                batch.add(self.service.files().create(
+                    body={
+                        "id": folder_id,
+                        "name": name,
+                        "mimeType": "application/vnd.google-apps.folder",
+                        "parents": [parent],
+                    },
+                    fields="id",
+                    supportsAllDrives=True))
+            logger.debug(f"create {len(chunk)} folders")
+            with track("drive"):
+                await self.loop.run_in_executor(None, batch.execute, self.new_http())
+            if errors:
+                raise errors[0]
+
     async def create_folder(self, name: str, root: str = None, app_properties: dict[str, str] = None) -> str:
         if not root:
             root = self.root
@@ -192,7 +726,8 @@ class Drive:
             fields="id",
             supportsTeamDrives=True)
 
-        response = await self.loop.run_in_executor(None, request.execute)
+        with track("drive"):
+            response = await self.loop.run_in_executor(None, request.execute, self.new_http())
         return response["id"]
 
     async def check_folder(self, name: str, drive_parent: str = None) -> Optional[tuple[str, Optional[str]]]:
@@ -204,7 +739,8 @@ class Drive:
                                             includeItemsFromAllDrives=True,
                                             supportsAllDrives=True)
 
-        response = await self.loop.run_in_executor(None, request.execute)
+        with track("drive"):
+            response = await self.loop.run_in_executor(None, request.execute, self.new_http())
         results = response.get("files")
         if results is None or len(results) == 0:
             return None
@@ -217,3 +753,40 @@ class Drive:
             id = results[0].get("id")  # type: str
 
             return (id, torrent_name)
+
+    async def delete_file(self, file_id: str) -> None:
+        request = self.service.files().delete(fileId=file_id, supportsAllDrives=True)
+        with track("drive"):
+            await self.loop.run_in_executor(None, request.execute, self.new_http())
+
+    async def copy_file(self, file_id: str, name: str, drive_parent: str) -> Optional[str]:
+        """
+        Copy a file on drive into `drive_parent`, returns the id of the copy or None if the
+        file doesn't exist anymore.
+        """
+        request = self.service.files().copy(
+            fileId=file_id,
+            body={"name": name, "parents": [drive_parent]},
+            fields="id",
+            supportsAllDrives=True)
+        try:
+            with track("drive"):
+                response = await self.loop.run_in_executor(None, request.execute, self.new_http())
+        except HttpError as e:
+            if e.resp.status == 404:
+                return None
+            raise
+        return response["id"]
+
+    async def folder_exists(self, folder_id: str) -> bool:
+        request = self.service.files().get(fileId=folder_id,
+                                           fields='id, trashed',
+                                           supportsAllDrives=True)
+        try:
+            with track("drive"):
+                response = await self.loop.run_in_executor(None, request.execute, self.new_http())
+        except HttpError as e:
+            if e.resp.status == 404:
+                return False
+            raise
+        return not response.get("trashed", False)
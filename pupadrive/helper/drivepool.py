@@ -0,0 +1,167 @@
+from __future__ import annotations
+
+import datetime
+import json
+import logging
+import time
+from pathlib import Path
+from typing import Any, Optional
+
+from google.oauth2 import service_account
+from google.oauth2.credentials import Credentials
+
+from .metrics import IDENTITY_UPLOADED
+
+# google caps uploads at 750 GB per user and day
+DEFAULT_DAILY_QUOTA = 750 * 1000 ** 3
+RATE_LIMIT_COOLDOWN = 15 * 60
+# reasons that last until the quota resets
+DAILY_QUOTA_REASONS = ("dailyLimitExceeded", "quotaExceeded",
+                       "storageQuotaExceeded", "uploadLimitExceeded")
+# reasons that pass after a while
+RATE_LIMIT_REASONS = ("userRateLimitExceeded", "rateLimitExceeded")
+
+logger = logging.getLogger(__name__)
+
+
+class QuotaExhausted(Exception):
+    pass
+
+
+def quota_reason(status: int, content: Any) -> Optional[str]:
+    """
+    Return the reason of a drive error response if it is a quota or rate limit error.
+    """
+    if status not in (403, 429):
+        return None
+    try:
+        errors = json.loads(content)["error"].get("errors", [])
+    except (ValueError, TypeError, KeyError, AttributeError):
+        return None
+    for error in errors:
+        reason = error.get("reason")
+        if reason in DAILY_QUOTA_REASONS or reason in RATE_LIMIT_REASONS:
+            return reason
+    return None
+
+
+def _today() -> datetime.date:
+    return datetime.datetime.utcnow().date()
+
+
+def _next_day() -> float:
+    tomorrow = datetime.datetime.combine(_today() + datetime.timedelta(days=1), datetime.time())
+    return tomorrow.replace(tzinfo=datetime.timezone.utc).timestamp()
+
+
+class DriveIdentity:
+    """
+    One account that uploads to drive, either an OAuth token or a service account.
+    """
+
+    def __init__(self, name: str, creds: Credentials) -> None:
+        self.name = name
+        self.creds = creds
+        # set by the drive backend
+        self.service: Any = None
+        self.uploaded_today = 0
+        self.pending = 0
+        self.blocked_until = 0.0
+        self.strikes = 0
+
+    def available(self) -> bool:
+        return time.time() >= self.blocked_until
+
+    def load(self) -> int:
+        return self.uploaded_today + self.pending
+
+
+class DrivePool:
+    """
+    Spreads uploads over several drive identities.
+
+    Each upload goes to the available identity with the fewest bytes uploaded today, counting
+    the uploads it has in flight. Identities that hit a quota error are skipped until the
+    quota resets at midnight UTC. Ones that hit a rate limit are skipped for
+    `RATE_LIMIT_COOLDOWN`, doubling with each hit on the same day.
+
+    The identities have to share the drive root, e.g. as members of a shared drive.
+    """
+
+    def __init__(self, identities: list[DriveIdentity], daily_quota: int = DEFAULT_DAILY_QUOTA) -> None:
+        if not identities:
+            raise ValueError("the drive pool needs at least one identity")
+        self.identities = identities
+        self.daily_quota = daily_quota
+        self._day = _today()
+
+    @property
+    def primary(self) -> DriveIdentity:
+        """
+        The identity for folder and metadata calls.
+        """
+        return self.identities[0]
+
+    def _roll_over(self) -> None:
+        today = _today()
+        if today == self._day:
+            return
+        self._day = today
+        for identity in self.identities:
+            identity.uploaded_today = 0
+            identity.strikes = 0
+            IDENTITY_UPLOADED.labels(identity.name).set(0)
+
+    def acquire(self, size: int) -> DriveIdentity:
+        """
+        Pick an identity for an upload of `size` bytes, release it with `release`.
+        """
+        self._roll_over()
+        available = [i for i in self.identities if i.available()]
+        if not available:
+            raise QuotaExhausted("all drive identities are over their quota")
+        with_room = [i for i in available if i.load() + size <= self.daily_quota]
+        identity = min(with_room or available, key=DriveIdentity.load)
+        identity.pending += size
+        return identity
+
+    def release(self, identity: DriveIdentity, size: int, uploaded: int) -> None:
+        """
+        Finish an upload on `identity` that sent `uploaded` of its `size` bytes.
+        """
+        self._roll_over()
+        identity.pending -= size
+        identity.uploaded_today += uploaded
+        IDENTITY_UPLOADED.labels(identity.name).set(identity.uploaded_today)
+
+    def block(self, identity: DriveIdentity, reason: str) -> None:
+        if reason in DAILY_QUOTA_REASONS:
+            identity.blocked_until = _next_day()
+        else:
+            identity.blocked_until = min(
+                _next_day(), time.time() + RATE_LIMIT_COOLDOWN * 2 ** identity.strikes)
+            identity.strikes += 1
+        logger.warning(
+            f"drive identity {identity.name} hit {reason}, skipping it until "
+            f"{datetime.datetime.fromtimestamp(identity.blocked_until)}")
+
+
+def load_identities(path: Optional[str], scopes: list[str]) -> Optional[list[DriveIdentity]]:
+    """
+    Load every OAuth token and service account key in the directory `path`, sorted by file
+    name. Returns None if `path` is not set.
+    """
+    if not path:
+        return None
+    identities: list[DriveIdentity] = []
+    for file in sorted(Path(path).glob("*.json")):
+        with open(file) as f:
+            info = json.load(f)
+        if info.get("type") == "service_account":
+            creds = service_account.Credentials.from_service_account_info(info, scopes=scopes)
+        else:
+            creds = Credentials.from_authorized_user_info(info, scopes)
+        identities.append(DriveIdentity(file.stem, creds))
+    if not identities:
+        raise ValueError(f"no drive credentials found in {path}")
+    return identities
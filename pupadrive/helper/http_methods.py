@@ -1,50 +1,119 @@
-from aiohttp import ClientSession
-
-
-class HttpMethods:
-    def __init__(
-            self,
-            client: ClientSession,
-            headers: dict = None,
-            proxy: dict = None) -> None:
-        self.__session = client
-        self.__HEADERS = headers
-        self.__PROXY = proxy
-
-    async def get_download_file(self, url: str, file_name: str, payload: dict = None, params: dict = None) -> None:
-        async with self.__session.get(url, headers=self.__HEADERS, proxy=self.__PROXY, data=payload, params=params) as resp:
-            with open(file_name, 'wb') as fd:
-                while True:
-                    chunk = await resp.content.read(1024)
-                    if not chunk:
-                        break
-                    fd.write(chunk)
-
-    async def post_download_file(self, url: str, file_name: str, payload: dict = None, params: dict = None) -> None:
-        async with self.__session.post(url, headers=self.__HEADERS, proxy=self.__PROXY, data=payload, params=params, ssl=False) as resp:
-            with open(file_name, 'wb') as fd:
-                while True:
-                    chunk = await resp.content.read(1024)
-                    if not chunk:
-                        break
-                    fd.write(chunk)
-
-    async def api_call_get(self, url: str, params: dict = None, payload: dict = None):
-        async with self.__session.get(url, params=params, proxy=self.__PROXY, headers=self.__HEADERS, data=payload) as resp:
-            return await resp.json()
-
-    async def api_call_post(self, url: str, params: dict = None, payload: dict = None):
-        async with self.__session.post(url, params=params, proxy=self.__PROXY, headers=self.__HEADERS, data=payload) as resp:
-            return await resp.json()
-
-    async def api_call_get_text(self, url: str, params: dict = None, payload: dict = None) -> str:
-        async with self.__session.get(url, params=params, proxy=self.__PROXY, headers=self.__HEADERS, data=payload) as resp:
-            return await resp.text()
-
-    async def get_cookie(self, url: str, payload: dict) -> dict:
-        async with self.__session.post(url, data=payload) as r:
-            cookies = self.__session.cookie_jar.filter_cookies(url)
-            return tuple([value.value for key, value in cookies.items()])
-
-    async def close(self):
-        await self.__session.close()
+from __future__ import annotations
+
+import asyncio
+import logging
+import random
+import time
+from abc import ABC, abstractmethod
+from typing import Any, Optional
+
+import aiohttp
+
+from .metrics import track
+
+DEFAULT_RETRIES = 4
+DEFAULT_TOKEN_TTL = 60 * 60
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 30.0
+CONNECTION_LIMIT = 100
+CONNECTION_LIMIT_PER_HOST = 16
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+logger = logging.getLogger(__name__)
+
+
+class HttpMethods(ABC):
+    """
+    Base of the hoster clients.
+
+    All hosters share one pooled keep-alive connector. The session token or cookie of a hoster
+    is cached until `token_ttl` passes or `invalidate_token` is called, and the next call
+    logs in again. API calls are retried with exponential backoff and jitter on connection
+    errors and 5xx responses.
+    """
+    name = "hoster"
+    token_ttl: float = DEFAULT_TOKEN_TTL
+    _connector: Optional[aiohttp.TCPConnector] = None
+
+    def __init__(self, proxy: str = None, ssl: bool = True, retries: int = DEFAULT_RETRIES) -> None:
+        self._proxy = proxy
+        self._ssl = ssl
+        self.retries = retries
+        self._http = aiohttp.ClientSession(
+            connector=self.shared_connector(), connector_owner=False, trust_env=True)
+        self._token: Optional[str] = None
+        self._token_expiry = 0.0
+        self._login_lock = asyncio.Lock()
+
+    @classmethod
+    def shared_connector(cls) -> aiohttp.TCPConnector:
+        if HttpMethods._connector is None or HttpMethods._connector.closed:
+            HttpMethods._connector = aiohttp.TCPConnector(
+                limit=CONNECTION_LIMIT,
+                limit_per_host=CONNECTION_LIMIT_PER_HOST,
+                ttl_dns_cache=300,
+                keepalive_timeout=60,
+                enable_cleanup_closed=True)
+        return HttpMethods._connector
+
+    @classmethod
+    async def close_shared_connector(cls) -> None:
+        """
+        Close the connector shared by all hosters, once their sessions are closed.
+        """
+        if HttpMethods._connector is not None:
+            await HttpMethods._connector.close()
+            HttpMethods._connector = None
+
+    @abstractmethod
+    async def _login(self) -> str:
+        """
+        Log in and return the session token.
+        """
+        pass
+
+    async def token(self) -> str:
+        async with self._login_lock:
+            if self._token is None or time.monotonic() >= self._token_expiry:
+                logger.debug(f"logging in to {self.name}")
+                self._token = await self._login()
+                self._token_expiry = time.monotonic() + self.token_ttl
+            return self._token
+
+    def invalidate_token(self) -> None:
+        self._token = None
+
+    def request(self, method: str, url: str, **kwargs):
+        """
+        Return the request context manager, through the proxy of the hoster.
+        """
+        return self._http.request(method, url, proxy=self._proxy, ssl=self._ssl, **kwargs)
+
+    @staticmethod
+    def backoff(attempt: int) -> float:
+        return min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt) * random.uniform(0.5, 1.5)
+
+    async def request_json(self, method: str, url: str, **kwargs) -> Any:
+        attempt = 0
+        while True:
+            try:
+                with track(self.name):
+                    async with self.request(method, url, **kwargs) as resp:
+                        if resp.status in RETRY_STATUSES:
+                            raise aiohttp.ClientResponseError(
+                                resp.request_info, resp.history, status=resp.status,
+                                message=f"{self.name} returned {resp.status}")
+                        return await resp.json(content_type=None)
+            except (aiohttp.ClientConnectionError, aiohttp.ClientResponseError, asyncio.TimeoutError) as e:
+                if isinstance(e, aiohttp.ClientResponseError) and e.status not in RETRY_STATUSES:
+                    raise
+                if attempt >= self.retries:
+                    raise
+                delay = self.backoff(attempt)
+                attempt += 1
+                logger.warning(
+                    f"{self.name} {url} failed ({e}), retry {attempt} in {delay:.1f}s")
+                await asyncio.sleep(delay)
+
+    async def close(self) -> None:
+        await self._http.close()
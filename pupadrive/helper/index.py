@@ -0,0 +1,115 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Optional
+
+if TYPE_CHECKING:
+    from .drive import Drive
+
+DEFAULT_INDEX_TTL = 24 * 60 * 60
+DEFAULT_RECONCILE_INTERVAL = 60 * 60
+RECONCILE_BATCH = 100
+
+logger = logging.getLogger(__name__)
+
+
+class MirrorIndex:
+    """
+    Local SQLite index of what was already mirrored, keyed by info hash, hoster file hash or
+    Telegram file name, so repeated requests don't need a drive lookup. A mirror is the drive
+    folder of a torrent or Telegram file, or the drive file of a hoster download.
+
+    Entries younger than `ttl` are trusted as is. Older ones are checked against drive by the
+    reconciliation worker, which refreshes them or drops them if the folder is gone.
+
+    Uploaded files are also indexed by size and MD5, so a file that is already on drive can be
+    copied there instead of uploaded again. These entries are dropped when the copy finds the
+    file gone.
+
+    The database is only used from one worker thread, so the event loop never waits for a
+    commit.
+    """
+
+    def __init__(self, path: str, ttl: float = DEFAULT_INDEX_TTL) -> None:
+        self.ttl = ttl
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="index")
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS mirrors ("
+            "key TEXT PRIMARY KEY, folder_id TEXT NOT NULL, name TEXT, updated REAL NOT NULL)")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS contents ("
+            "size INTEGER NOT NULL, md5 TEXT NOT NULL, file_id TEXT NOT NULL, updated REAL NOT NULL, "
+            "PRIMARY KEY (size, md5))")
+        self._db.commit()
+
+    def _query(self, sql: str, params: tuple, commit: bool) -> list[tuple]:
+        rows = self._db.execute(sql, params).fetchall()
+        if commit:
+            self._db.commit()
+        return rows
+
+    async def _run(self, sql: str, params: tuple = (), commit: bool = False) -> list[tuple]:
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(self._executor, self._query, sql, params, commit)
+
+    async def get(self, key: str) -> Optional[tuple[str, Optional[str]]]:
+        rows = await self._run(
+            "SELECT folder_id, name FROM mirrors WHERE key = ? AND updated > ?",
+            (key, time.time() - self.ttl))
+        if not rows:
+            return None
+        return (rows[0][0], rows[0][1])
+
+    async def put(self, key: str, folder_id: str, name: Optional[str]) -> None:
+        await self._run(
+            "INSERT OR REPLACE INTO mirrors (key, folder_id, name, updated) VALUES (?, ?, ?, ?)",
+            (key, folder_id, name, time.time()), commit=True)
+
+    async def remove(self, key: str) -> None:
+        await self._run("DELETE FROM mirrors WHERE key = ?", (key,), commit=True)
+
+    async def has_size(self, size: int) -> bool:
+        return bool(await self._run("SELECT 1 FROM contents WHERE size = ? LIMIT 1", (size,)))
+
+    async def get_content(self, size: int, md5: str) -> Optional[str]:
+        rows = await self._run(
+            "SELECT file_id FROM contents WHERE size = ? AND md5 = ?", (size, md5))
+        return rows[0][0] if rows else None
+
+    async def put_content(self, size: int, md5: str, file_id: str) -> None:
+        await self._run(
+            "INSERT OR REPLACE INTO contents (size, md5, file_id, updated) VALUES (?, ?, ?, ?)",
+            (size, md5, file_id, time.time()), commit=True)
+
+    async def remove_content(self, size: int, md5: str) -> None:
+        await self._run(
+            "DELETE FROM contents WHERE size = ? AND md5 = ?", (size, md5), commit=True)
+
+    def start_worker(self, drive: Drive, interval: float = DEFAULT_RECONCILE_INTERVAL) -> None:
+        asyncio.create_task(self.worker(drive, interval))
+
+    async def reconcile(self, drive: Drive) -> None:
+        rows = await self._run(
+            "SELECT key, folder_id FROM mirrors WHERE updated <= ? LIMIT ?",
+            (time.time() - self.ttl, RECONCILE_BATCH))
+        for key, folder_id in rows:
+            if await drive.folder_exists(folder_id):
+                await self._run(
+                    "UPDATE mirrors SET updated = ? WHERE key = ?", (time.time(), key))
+            else:
+                logger.info(f"{key} is no longer on drive, removing it from the index")
+                await self._run("DELETE FROM mirrors WHERE key = ?", (key,))
+        await asyncio.get_event_loop().run_in_executor(self._executor, self._db.commit)
+
+    async def worker(self, drive: Drive, interval: float) -> None:
+        while True:
+            try:
+                await self.reconcile(drive)
+            except Exception:
+                logger.exception("index reconciliation failed")
+            await asyncio.sleep(interval)
@@ -0,0 +1,208 @@
+from __future__ import annotations
+
+import logging
+import re
+import threading
+import time
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from typing import Iterator
+
+from aiohttp import web
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+logger = logging.getLogger(__name__)
+
+
+def _format_labels(names: tuple[str, ...], values: tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(pairs) + "}"
+
+
+class Metric(ABC):
+    type = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._children: dict[tuple[str, ...], Metric] = {}
+        self._lock = threading.Lock()
+        REGISTRY.register(self)
+
+    def labels(self, *values: str):
+        values = tuple(str(v) for v in values)
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    @abstractmethod
+    def _new_child(self):
+        pass
+
+    def _samples(self) -> Iterator[tuple[str, tuple[str, ...], str, float]]:
+        for values, child in list(self._children.items()):
+            for suffix, extra, value in child._child_samples():
+                yield suffix, values, extra, value
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}",
+                 f"# TYPE {self.name} {self.type}"]
+        for suffix, values, extra, value in self._samples():
+            lines.append(
+                f"{self.name}{suffix}{_format_labels(self.labelnames, values, extra)} {value}")
+        return "\n".join(lines)
+
+
+class _Value:
+    def __init__(self) -> None:
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0) -> None:
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount: float = 1.0) -> None:
+        self.inc(-amount)
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+    def _child_samples(self):
+        yield "", "", self.value
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.labels().inc(amount)
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def _new_child(self):
+        return _Value()
+
+    def set(self, value: float) -> None:
+        self.labels().set(value)
+
+
+class _HistogramValue:
+    def __init__(self, buckets: tuple[float, ...]) -> None:
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        with self._lock:
+            self.count += 1
+            self.sum += value
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    self.counts[i] += 1
+
+    def _child_samples(self):
+        for bound, count in zip(self.buckets, self.counts):
+            yield "_bucket", f'le="{bound}"', count
+        yield "_bucket", 'le="+Inf"', self.count
+        yield "_count", "", self.count
+        yield "_sum", "", self.sum
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = (),
+                 buckets: tuple[float, ...] = DEFAULT_BUCKETS) -> None:
+        self.buckets = buckets
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return _HistogramValue(self.buckets)
+
+    def observe(self, value: float) -> None:
+        self.labels().observe(value)
+
+
+class Registry:
+    def __init__(self) -> None:
+        self._metrics: list[Metric] = []
+
+    def register(self, metric: Metric) -> None:
+        self._metrics.append(metric)
+
+    def render(self) -> str:
+        return "\n".join(metric.render() for metric in self._metrics) + "\n"
+
+
+REGISTRY = Registry()
+
+BYTES_DOWNLOADED = Counter(
+    "pupadrive_downloaded_bytes_total", "Bytes downloaded per source", ("source",))
+BYTES_UPLOADED = Counter(
+    "pupadrive_uploaded_bytes_total", "Bytes uploaded to drive per source", ("source",))
+BYTES_DEDUPLICATED = Counter(
+    "pupadrive_deduplicated_bytes_total", "Bytes copied on drive instead of uploaded", ("source",))
+IDENTITY_UPLOADED = Gauge(
+    "pupadrive_identity_uploaded_bytes", "Bytes uploaded today per drive identity", ("identity",))
+ACTIVE_JOBS = Gauge(
+    "pupadrive_active_jobs", "Jobs in progress per stage", ("stage",))
+WORKER_LOOP_SECONDS = Histogram(
+    "pupadrive_worker_loop_seconds", "Time the file manager spends handling a batch of alerts")
+API_LATENCY = Histogram(
+    "pupadrive_api_request_seconds", "Latency of external API calls", ("api",))
+API_ERRORS = Counter(
+    "pupadrive_api_errors_total", "Failed external API calls", ("api",))
+LIBTORRENT_STATS = Gauge(
+    "pupadrive_libtorrent_stat", "libtorrent session statistics", ("name",))
+
+_METRIC_NAME_REGEX = re.compile(r"[^a-zA-Z0-9_.]")
+
+
+@contextmanager
+def track(api: str):
+    """
+    Measure the latency of an API call and count it as failed if it raises.
+    """
+    start = time.monotonic()
+    try:
+        yield
+    except Exception:
+        API_ERRORS.labels(api).inc()
+        raise
+    finally:
+        API_LATENCY.labels(api).observe(time.monotonic() - start)
+
+
+def update_libtorrent_stats(values: dict[str, int]) -> None:
+    for name, value in values.items():
+        LIBTORRENT_STATS.labels(_METRIC_NAME_REGEX.sub("_", name)).set(value)
+
+
+async def start_metrics_server(port: int, host: str = "127.0.0.1") -> web.AppRunner:
+    async def metrics(_: web.Request) -> web.Response:
+        return web.Response(text=REGISTRY.render(), content_type="text/plain")
+
+    app = web.Application()
+    app.router.add_get("/metrics", metrics)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info(f"metrics available on http://{host}:{port}/metrics")
+    return runner
@@ -0,0 +1,88 @@
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import threading
+from typing import Optional
+
+DEFAULT_PIPE_CAPACITY = 64 * 1024 * 1024
+
+
+class PipeError(Exception):
+    pass
+
+
+class StreamPipe:
+    """
+    Bounded in-memory buffer between a producer on the event loop and a consumer thread.
+
+    The producer awaits `write`, which blocks while the buffer is full. The consumer reads
+    absolute byte ranges with `read`; everything before the last requested offset is dropped,
+    so a range can be read again (e.g. when an upload chunk is retried) until the consumer
+    moves past it.
+
+    The MD5 of everything written is available as `md5` once `size` bytes went through.
+    """
+
+    def __init__(self, capacity: int = DEFAULT_PIPE_CAPACITY) -> None:
+        self.capacity = capacity
+        self.size: Optional[int] = None
+        self.ready = asyncio.Event()
+        self._buf = bytearray()
+        self._offset = 0
+        self._written = 0
+        self._closed = False
+        self._error: Optional[BaseException] = None
+        self._cond = threading.Condition()
+        self._space = asyncio.Event()
+        self._loop = asyncio.get_event_loop()
+        self._md5 = hashlib.md5()
+        self.md5: Optional[str] = None
+
+    def set_size(self, size: int) -> None:
+        self.size = size
+        self.ready.set()
+
+    async def write(self, data: bytes) -> None:
+        while True:
+            with self._cond:
+                if self._error is not None:
+                    raise PipeError("pipe aborted") from self._error
+                if not self._buf or len(self._buf) + len(data) <= self.capacity:
+                    self._md5.update(data)
+                    self._buf += data
+                    self._written += len(data)
+                    if self._written == self.size:
+                        self.md5 = self._md5.hexdigest()
+                    self._cond.notify_all()
+                    return
+                self._space.clear()
+            await self._space.wait()
+
+    def close(self) -> None:
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def abort(self, error: BaseException) -> None:
+        with self._cond:
+            self._error = error
+            self._cond.notify_all()
+        self._loop.call_soon_threadsafe(self._space.set)
+        self._loop.call_soon_threadsafe(self.ready.set)
+
+    def read(self, begin: int, length: int) -> bytes:
+        with self._cond:
+            if begin < self._offset:
+                raise PipeError(
+                    f"offset {begin} was already dropped from the pipe (at {self._offset})")
+            if begin > self._offset:
+                del self._buf[:begin - self._offset]
+                self._offset = begin
+                self._loop.call_soon_threadsafe(self._space.set)
+
+            self._cond.wait_for(lambda: self._error is not None or self._closed
+                                or self._written >= begin + length)
+            if self._error is not None:
+                raise PipeError("pipe aborted") from self._error
+            return bytes(self._buf[:length])
@@ -1,89 +1,85 @@
 from __future__ import annotations
 
-import asyncio
 import re
-import time
 from pathlib import Path
 from typing import Optional
 
-import aiohttp
+from .download import DEFAULT_SEGMENT_SIZE, DEFAULT_SEGMENTS, DEFAULT_WRITE_BUFFERS, HttpFileDownload
+from .http_methods import HttpMethods
+from .pipe import StreamPipe
 
 RAPIDGATOR_DL_URL_REGEX = re.compile(
     r"https?://(?:www\.)?rapidgator\.net/file/(\w+)(?:/\w+)?")
 RAPIDGATOR_API_URL = "https://rapidgator.net/api/v2/"
 
 
-class RapidFileDownload:
+class RapidFileDownload(HttpFileDownload):
     """
     Represents a file download.
     """
+    source = "rapidgator"
 
-    def __init__(self, client: Rapidgator, file_id: str, save_path: Path):
+    def __init__(
+            self,
+            client: Rapidgator,
+            file_id: str,
+            save_path: Path,
+            segments: int = DEFAULT_SEGMENTS,
+            segment_size: int = DEFAULT_SEGMENT_SIZE,
+            pipe: StreamPipe = None,
+            write_buffers: int = DEFAULT_WRITE_BUFFERS):
+        super().__init__(save_path, segments, segment_size, pipe=pipe, write_buffers=write_buffers)
         self.file_id = file_id
-        self.save_path = save_path
-        self.downloaded_bytes = 0
-        self.total_bytes = 0
-        self.is_started = False
-        self.is_finished = False
-        self.start_time = 0.0
         self._client = client
-        self._task = None
-
-    def start(self):
-        self._task = asyncio.create_task(self.download())
-
-    def cancel(self):
-        if self._task:
-            self._task.cancel()
-
-    async def download(self) -> None:
-        self.start_time = time.time()
-        self.is_started = True
-        download_url = await self._client.get_direct_link(self.file_id)
-        if download_url is None:
-            return
-
-        with open(self.save_path, "wb") as f:
-            async with self._client._http.get(download_url, proxy=self._client._proxy) as response:
-                if not response.content_length:
-                    return
-                self.total_bytes = response.content_length
-                while True:
-                    chunk = await response.content.read(16384)
-                    self.downloaded_bytes += len(chunk)
-                    if not chunk:
-                        break
-                    f.write(chunk)
-        self.is_finished = True
-
-
-class Rapidgator:
+        self._url: Optional[str] = None
+
+    async def _prepare(self) -> bool:
+        self._url = await self._client.get_direct_link(self.file_id)
+        return self._url is not None
+
+    def _request(self, headers: dict):
+        return self._client.request("GET", self._url, headers=headers)
+
+
+class Rapidgator(HttpMethods):
+    name = "rapidgator"
+
     def __init__(
             self,
             username: str,
             password: str,
-            proxy: str = None) -> None:
+            proxy: str = None,
+            segments: int = DEFAULT_SEGMENTS,
+            segment_size: int = DEFAULT_SEGMENT_SIZE,
+            write_buffers: int = DEFAULT_WRITE_BUFFERS) -> None:
+        super().__init__(proxy)
         self._username = username
         self._password = password
-        self._http = aiohttp.ClientSession(trust_env=True)
-        self._proxy = proxy
-
-    async def api_get(self, url: str, params: dict = None) -> Optional[dict]:
-        async with self._http.get(RAPIDGATOR_API_URL + url, params=params, proxy=self._proxy) as response:
-            data = await response.json()
-            if data["status"] != 200:
-                return None
-            return data["response"]
+        self._segments = segments
+        self._segment_size = segment_size
+        self._write_buffers = write_buffers
 
-    async def get_token(self) -> Optional[str]:
+    async def _login(self) -> str:
         params = {
             "login": self._username,
             "password": self._password
         }
-        response = await self.api_get("user/login", params=params)
-        if response is None:
-            return None
-        return response["token"]
+        data = await self.request_json("GET", RAPIDGATOR_API_URL + "user/login", params=params)
+        if data["status"] != 200:
+            raise Exception(f"Rapidgator login failed: {data.get('details')}")
+        return data["response"]["token"]
+
+    async def api_get(self, url: str, params: dict = None) -> Optional[dict]:
+        for attempt in range(2):
+            data = await self.request_json("GET", RAPIDGATOR_API_URL + url, params={
+                **(params or {}), "token": await self.token()})
+            # the cached token expired early, log in again once
+            if data["status"] == 401 and attempt == 0:
+                self.invalidate_token()
+                continue
+            if data["status"] != 200:
+                return None
+            return data["response"]
 
     def get_file_id(self, url: str) -> Optional[str]:
         m = RAPIDGATOR_DL_URL_REGEX.match(url)
@@ -92,23 +88,19 @@ class Rapidgator:
         return m.group(1)
 
     async def get_file_info(self, file_id: str) -> Optional[dict]:
-        token = await self.get_token()
-        params = {"file_id": file_id, "token": token}
+        params = {"file_id": file_id}
         response = await self.api_get("file/info", params=params)
         if response is None:
             return None
         return response["file"]
 
     async def get_direct_link(self, file_id: str) -> Optional[str]:
-        token = await self.get_token()
-        params = {"file_id": file_id, "token": token}
+        params = {"file_id": file_id}
         response = await self.api_get("file/download", params=params)
         if response is None:
             return None
         return response["download_url"]
 
-    def create_download(self, file_id: str, path: Path) -> RapidFileDownload:
-        return RapidFileDownload(self, file_id, path)
-
-    async def close(self) -> None:
-        await self._http.close()
+    def create_download(self, file_id: str, path: Path, pipe: StreamPipe = None) -> RapidFileDownload:
+        return RapidFileDownload(self, file_id, path, self._segments, self._segment_size, pipe,
+            self._write_buffers)
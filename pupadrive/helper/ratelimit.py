@@ -0,0 +1,48 @@
+from __future__ import annotations
+
+import asyncio
+import time
+
+
+class TokenBucket:
+    """
+    Allows `rate` actions per second on average, with bursts of up to `capacity`.
+    """
+
+    def __init__(self, rate: float, capacity: float = 1.0) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens +
+                           (now - self._updated) * self.rate)
+        self._updated = now
+
+    def delay(self) -> float:
+        """
+        Seconds until the next action is allowed.
+        """
+        self._refill()
+        wait = max(0.0, self._blocked_until - time.monotonic())
+        if self._tokens < 1:
+            wait = max(wait, (1 - self._tokens) / self.rate)
+        return wait
+
+    async def acquire(self) -> None:
+        while True:
+            wait = self.delay()
+            if wait <= 0:
+                self._tokens -= 1
+                return
+            await asyncio.sleep(wait)
+
+    def block(self, seconds: float) -> None:
+        """
+        Allow nothing for the next `seconds`, e.g. after a FloodWait.
+        """
+        self._blocked_until = max(
+            self._blocked_until, time.monotonic() + seconds)
@@ -0,0 +1,85 @@
+from __future__ import annotations
+
+import json
+import logging
+import os
+from pathlib import Path
+from typing import Iterator, Optional
+
+DEFAULT_RESUME_DIR = "./resume"
+SESSION_STATE_FILE = "session.state"
+
+logger = logging.getLogger(__name__)
+
+
+def _write(path: Path, data: bytes) -> None:
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+class ResumeStore:
+    """
+    Keeps libtorrent resume data and the session state on disk, so torrents continue after a
+    restart without rechecking their files.
+
+    Every torrent job has `<id>.json` with the chats following it, its priority and its file
+    selection, and `<id>.fastresume` with its bencoded resume data while it downloads. Once
+    the torrent finished the job info also holds the files to upload, and both are kept until
+    the upload is done.
+    """
+
+    def __init__(self, path: str = DEFAULT_RESUME_DIR) -> None:
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+
+    def load_session(self) -> Optional[bytes]:
+        try:
+            with open(self.path / SESSION_STATE_FILE, "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def save_session(self, data: bytes) -> None:
+        _write(self.path / SESSION_STATE_FILE, data)
+
+    def save(self, id: str, data: bytes) -> None:
+        _write(self.path / f"{id}.fastresume", data)
+
+    def save_job(
+            self,
+            id: str,
+            chats: list[int],
+            priority: int,
+            selection: Optional[list[str]],
+            upload: Optional[dict] = None) -> None:
+        _write(self.path / f"{id}.json", json.dumps(
+            {"chats": chats, "priority": priority, "selection": selection, "upload": upload}).encode())
+
+    def remove(self, id: str) -> None:
+        for name in (f"{id}.fastresume", f"{id}.json"):
+            try:
+                os.remove(self.path / name)
+            except FileNotFoundError:
+                pass
+
+    def jobs(self) -> Iterator[tuple[str, Optional[bytes], dict]]:
+        """
+        Yield the id, resume data and job info of every saved torrent, the resume data is None
+        if the torrent has none.
+        """
+        for path in sorted(self.path.glob("*.json")):
+            id = path.stem
+            try:
+                with open(path) as f:
+                    job = json.load(f)
+                try:
+                    with open(self.path / f"{id}.fastresume", "rb") as f:
+                        data = f.read()
+                except FileNotFoundError:
+                    data = None
+            except (OSError, ValueError) as e:
+                logger.warning(f"skipping resume data of {id}: {e}")
+                continue
+            yield id, data, job
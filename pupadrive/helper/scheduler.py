@@ -0,0 +1,129 @@
+from __future__ import annotations
+
+import asyncio
+import itertools
+from dataclasses import dataclass, field
+from typing import Optional
+
+DEFAULT_STAGE_LIMITS = {"metadata": 10, "download": 3, "upload": 2}
+
+
+def parse_limits(value: Optional[str]) -> dict[str, int]:
+    """
+    Parse limits like "rapidgator=2,ddownload=1".
+    """
+    limits: dict[str, int] = {}
+    if not value:
+        return limits
+    for part in value.split(","):
+        name, _, limit = part.partition("=")
+        if name.strip() and limit.strip():
+            limits[name.strip()] = int(limit)
+    return limits
+
+
+@dataclass(order=True)
+class _Waiter:
+    priority: int
+    seq: int
+    id: str = field(compare=False)
+    stage: str = field(compare=False)
+    source: str = field(compare=False)
+    future: asyncio.Future = field(compare=False)
+
+
+class JobScheduler:
+    """
+    Admits jobs into stages with limited concurrency. A stage runs at most `limits[stage]`
+    jobs at once and, within a stage, a source at most `source_limits[source]`. Waiting jobs
+    are admitted by priority, higher first, then in the order they arrived.
+
+    A job holds at most one slot, being admitted to a stage gives up the slot of its previous
+    stage.
+    """
+
+    def __init__(self, limits: dict[str, int] = None, source_limits: dict[str, int] = None) -> None:
+        self.limits = dict(DEFAULT_STAGE_LIMITS)
+        self.limits.update(limits or {})
+        self.source_limits = source_limits or {}
+        # id -> (stage, source) of the jobs that hold a slot
+        self._slots: dict[str, tuple[str, str]] = {}
+        self._waiting: list[_Waiter] = []
+        self._seq = itertools.count()
+
+    def _running(self, stage: str, source: str = None) -> int:
+        return sum(1 for s, src in self._slots.values()
+                   if s == stage and (source is None or src == source))
+
+    def _has_room(self, stage: str, source: str) -> bool:
+        if self._running(stage) >= self.limits.get(stage, 1):
+            return False
+        source_limit = self.source_limits.get(source)
+        return source_limit is None or self._running(stage, source) < source_limit
+
+    def _dispatch(self) -> None:
+        for waiter in list(self._waiting):
+            if waiter.future.done():
+                self._waiting.remove(waiter)
+            elif self._has_room(waiter.stage, waiter.source):
+                self._waiting.remove(waiter)
+                self._slots[waiter.id] = (waiter.stage, waiter.source)
+                waiter.future.set_result(None)
+
+    def try_admit(self, id: str, stage: str, source: str, priority: int = 0) -> bool:
+        """
+        Admit the job right away if it would not have to wait.
+        """
+        self._slots.pop(id, None)
+        if any(w.stage == stage and w.priority <= -priority for w in self._waiting) \
+                or not self._has_room(stage, source):
+            self._dispatch()
+            return False
+        self._slots[id] = (stage, source)
+        return True
+
+    async def admit(self, id: str, stage: str, source: str, priority: int = 0) -> None:
+        """
+        Wait until the job may run in `stage`.
+        """
+        if self.try_admit(id, stage, source, priority):
+            return
+        waiter = _Waiter(-priority, next(self._seq), id, stage, source,
+                         asyncio.get_event_loop().create_future())
+        self._waiting.append(waiter)
+        self._waiting.sort()
+        self._dispatch()
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            if waiter in self._waiting:
+                self._waiting.remove(waiter)
+            raise
+
+    def occupy(self, id: str, stage: str, source: str) -> None:
+        """
+        Count a job that is already running in `stage`, even past the limit.
+        """
+        self._slots[id] = (stage, source)
+        self._dispatch()
+
+    def release(self, id: str) -> None:
+        """
+        Give up the slot of a job and stop waiting for one.
+        """
+        self._slots.pop(id, None)
+        for waiter in [w for w in self._waiting if w.id == id]:
+            self._waiting.remove(waiter)
+            waiter.future.cancel()
+        self._dispatch()
+
+    def position(self, id: str) -> Optional[tuple[str, int]]:
+        """
+        Stage a waiting job waits for and its position in that queue, None if it is not waiting.
+        """
+        stages: dict[str, int] = {}
+        for waiter in self._waiting:
+            stages[waiter.stage] = stages.get(waiter.stage, 0) + 1
+            if waiter.id == id:
+                return waiter.stage, stages[waiter.stage]
+        return None
@@ -0,0 +1,36 @@
+from __future__ import annotations
+
+import fnmatch
+import posixpath
+import re
+
+# libtorrent's default file priority, 0 skips a file
+DEFAULT_FILE_PRIORITY = 4
+RANGE_REGEX = re.compile(r"^(\d+)(?:-(\d+))?$")
+
+
+def select_files(patterns: list[str], paths: list[str]) -> set[int]:
+    """
+    Return the indices of the files matched by `patterns`. A pattern is a file number
+    starting at 1, a range of them like `3-7`, or a glob that is matched case-insensitively
+    against the path and the name of every file. Patterns can also be separated by commas.
+    """
+    selected: set[int] = set()
+    for pattern in (p for arg in patterns for p in arg.split(",") if p):
+        m = RANGE_REGEX.match(pattern)
+        if m is not None:
+            first = int(m.group(1))
+            last = int(m.group(2) or first)
+            selected.update(i for i in range(first - 1, last) if 0 <= i < len(paths))
+            continue
+        pattern = pattern.lower()
+        for i, path in enumerate(paths):
+            path = path.lower()
+            if fnmatch.fnmatchcase(path, pattern) \
+                    or fnmatch.fnmatchcase(posixpath.basename(path), pattern):
+                selected.add(i)
+    return selected
+
+
+def file_priorities(selected: set[int], count: int) -> list[int]:
+    return [DEFAULT_FILE_PRIORITY if i in selected else 0 for i in range(count)]
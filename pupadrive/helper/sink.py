@@ -0,0 +1,275 @@
+from __future__ import annotations
+
+import asyncio
+import bisect
+import errno
+import hashlib
+import logging
+import os
+import queue
+import threading
+from pathlib import Path
+from typing import Callable, Optional
+
+WRITE_BUFFER_SIZE = 4 * 1024 * 1024
+# buffers per writer, one is filled while the other is written
+WRITE_BUFFERS = 2
+HASH_READ_SIZE = 1024 * 1024
+
+logger = logging.getLogger(__name__)
+
+
+class SinkError(Exception):
+    pass
+
+
+def file_md5(path: Path) -> str:
+    md5 = hashlib.md5()
+    with open(path, "rb") as f:
+        while data := f.read(HASH_READ_SIZE):
+            md5.update(data)
+    return md5.hexdigest()
+
+
+class FileSink:
+    """
+    Writes a download to disk on a dedicated thread, so the event loop never blocks on the
+    file system.
+
+    Data is copied into one of `buffers` reusable buffers of `buffer_size` bytes and a full
+    buffer is handed to the writer thread. When all buffers are in flight, writers wait for
+    the disk. `on_written(start, end)` is called on the event loop for each range that
+    reached the file.
+
+    With `checksum` the writer thread also computes the MD5 of the file in the same pass.
+    Data that arrives in order is hashed straight from the buffers. Data written ahead of the
+    hashed prefix, e.g. by a later segment, is held back in memory and hashed once the prefix
+    reaches it, up to `hold_back` bytes. Past that the checksum is given up and `md5` stays
+    None, the complete file has to be hashed with `file_md5` instead. Only the ranges that were already on disk when a download resumes are read back.
+    """
+
+    def __init__(
+            self,
+            path: Path,
+            on_written: Callable[[int, int], None] = None,
+            buffer_size: int = WRITE_BUFFER_SIZE,
+            buffers: int = WRITE_BUFFERS,
+            checksum: bool = False,
+            hold_back: int = 0) -> None:
+        self.path = path
+        self.on_written = on_written
+        self.buffer_size = buffer_size
+        self.allocated = 0
+        self._buffer_count = buffers
+        self._fd: Optional[int] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._pool: asyncio.Queue[bytearray] = asyncio.Queue()
+        self._queue: queue.Queue = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._pending = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._error: Optional[BaseException] = None
+        self.size: Optional[int] = None
+        self.md5: Optional[str] = None
+        self._md5 = hashlib.md5() if checksum else None
+        self._hashed = 0
+        self._hold_back = hold_back
+        # data written past the hashed prefix, sorted by offset
+        self._held: list[tuple[int, bytes]] = []
+        self._held_bytes = 0
+        # ranges already on disk when the file was opened, sorted by start
+        self._existing: list[tuple[int, int]] = []
+
+    async def open(self, size: Optional[int] = None, keep: bool = False, existing: list[list[int]] = None) -> None:
+        """
+        Open the file and preallocate `size` bytes, `keep` continues an existing file whose
+        `existing` ranges are already written.
+        """
+        flags = (os.O_RDWR if self._md5 is not None else os.O_WRONLY) | os.O_CREAT
+        if not keep:
+            flags |= os.O_TRUNC
+        self._fd = os.open(self.path, flags, 0o644)
+        self.size = size
+        for start, end in existing or []:
+            bisect.insort(self._existing, (start, end))
+        self._loop = asyncio.get_event_loop()
+        if size:
+            try:
+                # without native support glibc writes every block, that can take a while
+                await self._loop.run_in_executor(None, self._preallocate, size)
+            except BaseException:
+                os.close(self._fd)
+                self._fd = None
+                raise
+        for _ in range(self._buffer_count):
+            self._pool.put_nowait(bytearray(self.buffer_size))
+        self._thread = threading.Thread(
+            target=self._writer, name=f"sink-{self.path.name}", daemon=True)
+        self._thread.start()
+
+    def _preallocate(self, size: int) -> None:
+        try:
+            os.posix_fallocate(self._fd, 0, size)
+            self.allocated = size
+        except (AttributeError, OSError) as e:
+            if isinstance(e, OSError) and e.errno == errno.ENOSPC:
+                raise
+            # not supported by the platform or file system, the file stays sparse
+            os.ftruncate(self._fd, size)
+
+    def _writer(self) -> None:
+        while True:
+            item = self._queue.get()
+            if item is None:
+                self._finish_checksum()
+                return
+            buffer, length, offset = item
+            try:
+                if self._error is None:
+                    view = memoryview(buffer)[:length]
+                    written = 0
+                    while written < length:
+                        written += os.pwrite(self._fd, view[written:], offset + written)
+                    if self._md5 is not None:
+                        self._hash(view, offset)
+                    view.release()
+            except BaseException as e:
+                self._error = e
+            self._loop.call_soon_threadsafe(self._written, buffer, length, offset)
+
+    def _hash(self, data: memoryview, offset: int) -> None:
+        if self._md5 is None:
+            return
+        end = offset + len(data)
+        if offset <= self._hashed < end:
+            self._md5.update(data[self._hashed - offset:])
+            self._hashed = end
+        elif offset > self._hashed:
+            if self._held_bytes + len(data) > self._hold_back:
+                logger.warning(
+                    f"{self.path} is written more than {self._hold_back} bytes out of order, "
+                    "not computing its MD5 on the way")
+                self._md5 = None
+                self._held = []
+                self._held_bytes = 0
+                return
+            bisect.insort(self._held, (offset, bytes(data)))
+            self._held_bytes += len(data)
+        self._catch_up()
+
+    def _catch_up(self) -> None:
+        while True:
+            if self._held and self._held[0][0] <= self._hashed:
+                offset, data = self._held.pop(0)
+                self._held_bytes -= len(data)
+                end = offset + len(data)
+                if end > self._hashed:
+                    self._md5.update(memoryview(data)[self._hashed - offset:])
+                    self._hashed = end
+            elif self._existing and self._existing[0][0] <= self._hashed:
+                _, end = self._existing.pop(0)
+                while self._hashed < end:
+                    data = os.pread(self._fd, min(HASH_READ_SIZE, end - self._hashed), self._hashed)
+                    if not data:
+                        return
+                    self._md5.update(data)
+                    self._hashed += len(data)
+            else:
+                return
+
+    def _finish_checksum(self) -> None:
+        if self._md5 is None or self._error is not None:
+            return
+        try:
+            self._catch_up()
+        except OSError as e:
+            self._error = e
+            return
+        if self.size is not None and self._hashed == self.size:
+            self.md5 = self._md5.hexdigest()
+
+    def _written(self, buffer: bytearray, length: int, offset: int) -> None:
+        self._pool.put_nowait(buffer)
+        self._pending -= 1
+        if self._pending == 0:
+            self._idle.set()
+        if self._error is None and self.on_written is not None:
+            self.on_written(offset, offset + length)
+
+    def _check(self) -> None:
+        if self._error is not None:
+            raise SinkError(f"writing {self.path} failed: {self._error}") from self._error
+
+    async def _buffer(self) -> bytearray:
+        self._check()
+        return await self._pool.get()
+
+    def _submit(self, buffer: bytearray, length: int, offset: int) -> None:
+        self._pending += 1
+        self._idle.clear()
+        self._queue.put((buffer, length, offset))
+
+    def stream(self, offset: int) -> SinkStream:
+        return SinkStream(self, offset)
+
+    async def flush(self) -> None:
+        """
+        Wait until everything submitted reached the file.
+        """
+        await self._idle.wait()
+        self._check()
+
+    async def close(self) -> None:
+        if self._fd is None:
+            return
+        try:
+            await self._idle.wait()
+        finally:
+            self._queue.put(None)
+            await self._loop.run_in_executor(None, self._thread.join)
+            os.close(self._fd)
+            self._fd = None
+        self._check()
+
+
+class SinkStream:
+    """
+    Sequential writer into a `FileSink` starting at `offset`, e.g. one segment of a download.
+    """
+
+    def __init__(self, sink: FileSink, offset: int) -> None:
+        self._sink = sink
+        self.offset = offset
+        self._buffer: Optional[bytearray] = None
+        self._length = 0
+
+    async def write(self, data: bytes) -> None:
+        view = memoryview(data)
+        while view:
+            if self._buffer is None:
+                self._buffer = await self._sink._buffer()
+                self._length = 0
+            n = min(len(view), len(self._buffer) - self._length)
+            self._buffer[self._length:self._length + n] = view[:n]
+            self._length += n
+            view = view[n:]
+            if self._length == len(self._buffer):
+                self._submit()
+
+    def _submit(self) -> None:
+        if self._buffer is None:
+            return
+        if self._length:
+            self._sink._submit(self._buffer, self._length, self.offset)
+            self.offset += self._length
+        else:
+            self._sink._pool.put_nowait(self._buffer)
+        self._buffer = None
+        self._length = 0
+
+    def flush(self) -> None:
+        """
+        Hand the partly filled buffer to the writer.
+        """
+        self._submit()
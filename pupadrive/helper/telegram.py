@@ -0,0 +1,143 @@
+from __future__ import annotations
+
+import asyncio
+import time
+from pathlib import Path
+from typing import TYPE_CHECKING, Optional
+
+from pyrogram import raw
+from pyrogram.errors import AuthBytesInvalid, FileReferenceExpired
+from pyrogram.file_id import FileId
+from pyrogram.session import Auth, Session
+
+from .download import DownloadError
+from .metrics import BYTES_DOWNLOADED
+from .pipe import StreamPipe
+from .throughput import ThroughputTracker
+
+if TYPE_CHECKING:
+    from pyrogram import Client
+    from pyrogram.types import Message
+
+# the largest chunk upload.GetFile returns, offsets have to be multiples of it
+CHUNK_SIZE = 1024 * 1024
+EXPORT_AUTH_RETRIES = 3
+
+
+class TelegramFileDownload:
+    """
+    Download of a Telegram document, with the same interface as `HttpFileDownload`.
+
+    The document is fetched chunk by chunk with upload.GetFile through a media session of the
+    data center that stores it, the same way Pyrogram's own downloads do, and written into
+    `pipe`, so it is never written to disk. An expired file reference is renewed by fetching
+    the message again.
+    """
+    source = "telegram"
+
+    def __init__(self, client: Client, message: Message, save_path: Path, pipe: StreamPipe) -> None:
+        self.client = client
+        self.message = message
+        self.save_path = save_path
+        self.pipe = pipe
+        self.drive_folder = save_path.name
+        self.downloaded_bytes = 0
+        self.total_bytes = message.document.file_size
+        self.is_started = False
+        self.is_finished = False
+        self.start_time = 0.0
+        self.md5: Optional[str] = None
+        self.throughput = ThroughputTracker(lambda: self.downloaded_bytes)
+        self._task = None
+        self._downloaded_metric = BYTES_DOWNLOADED.labels(self.source)
+
+    def start(self) -> asyncio.Task:
+        self._task = asyncio.create_task(self.download())
+        return self._task
+
+    def cancel(self):
+        if self._task:
+            self._task.cancel()
+
+    async def download(self) -> None:
+        self.start_time = time.time()
+        self.is_started = True
+        # samples taken while the job was queued don't count towards a stall
+        self.throughput.reset()
+        try:
+            await self._download_stream()
+        except BaseException as e:
+            self.pipe.abort(e)
+            raise
+        self.md5 = self.pipe.md5
+        self.is_finished = True
+
+    async def _session(self, dc_id: int) -> Session:
+        """
+        Return the media session of `dc_id`, shared with Pyrogram's downloads.
+        """
+        client = self.client
+        async with client.media_sessions_lock:
+            session = client.media_sessions.get(dc_id)
+            if session is not None:
+                return session
+            test_mode = await client.storage.test_mode()
+            if dc_id == await client.storage.dc_id():
+                session = Session(client, dc_id, await client.storage.auth_key(), test_mode, is_media=True)
+                await session.start()
+            else:
+                session = Session(client, dc_id, await Auth(client, dc_id, test_mode).create(), test_mode, is_media=True)
+                await session.start()
+                for _ in range(EXPORT_AUTH_RETRIES):
+                    exported = await client.send(raw.functions.auth.ExportAuthorization(dc_id=dc_id))
+                    try:
+                        await session.send(raw.functions.auth.ImportAuthorization(
+                            id=exported.id, bytes=exported.bytes))
+                    except AuthBytesInvalid:
+                        continue
+                    break
+                else:
+                    await session.stop()
+                    raise AuthBytesInvalid
+            client.media_sessions[dc_id] = session
+            return session
+
+    async def _refresh_file_id(self) -> FileId:
+        self.message = await self.client.get_messages(self.message.chat.id, self.message.message_id)
+        if self.message is None or self.message.document is None:
+            raise DownloadError(f"{self.save_path.name} is no longer available")
+        return FileId.decode(self.message.document.file_id)
+
+    async def _download_stream(self) -> None:
+        self.pipe.set_size(self.total_bytes)
+        file_id = FileId.decode(self.message.document.file_id)
+        session = await self._session(file_id.dc_id)
+        refreshed = False
+        while self.downloaded_bytes < self.total_bytes:
+            location = raw.types.InputDocumentFileLocation(
+                id=file_id.media_id,
+                access_hash=file_id.access_hash,
+                file_reference=file_id.file_reference,
+                thumb_size=file_id.thumbnail_size)
+            try:
+                r = await session.send(
+                    raw.functions.upload.GetFile(
+                        location=location, offset=self.downloaded_bytes, limit=CHUNK_SIZE),
+                    sleep_threshold=30)
+            except FileReferenceExpired:
+                if refreshed:
+                    raise
+                file_id = await self._refresh_file_id()
+                refreshed = True
+                continue
+            refreshed = False
+            chunk = r.bytes
+            if not chunk:
+                break
+            await self.pipe.write(chunk)
+            self.downloaded_bytes += len(chunk)
+            self._downloaded_metric.inc(len(chunk))
+        if self.downloaded_bytes != self.total_bytes:
+            raise DownloadError(
+                f"{self.save_path.name} ended after {self.downloaded_bytes} of {self.total_bytes} bytes")
+        self.pipe.close()
@@ -0,0 +1,82 @@
+from __future__ import annotations
+
+import math
+import time
+from collections import deque
+from typing import Callable, Optional
+
+DEFAULT_WINDOW = 30
+DEFAULT_TIME_CONSTANT = 10.0
+
+
+class ThroughputTracker:
+    """
+    Tracks the speed of a transfer from periodic samples of its byte counter.
+
+    The last `window` samples are kept in a ring buffer. `speed` is an exponentially weighted
+    average with a `time_constant` in seconds, `rate` the speed over the last sample interval.
+    """
+
+    def __init__(
+            self,
+            source: Callable[[], int],
+            window: int = DEFAULT_WINDOW,
+            time_constant: float = DEFAULT_TIME_CONSTANT) -> None:
+        self._source = source
+        self._samples: deque[tuple[float, int]] = deque(maxlen=window)
+        self.time_constant = time_constant
+        self.speed = 0.0
+        self.rate = 0.0
+        self.last_progress = time.monotonic()
+
+    def reset(self) -> None:
+        self._samples.clear()
+        self.speed = self.rate = 0.0
+        self.last_progress = time.monotonic()
+
+    def sample(self, now: float = None) -> None:
+        if now is None:
+            now = time.monotonic()
+        total = self._source()
+        if self._samples:
+            last_time, last_total = self._samples[-1]
+            dt = now - last_time
+            if dt <= 0:
+                return
+            if total < last_total:
+                # the transfer started over
+                self.reset()
+            else:
+                self.rate = (total - last_total) / dt
+                alpha = 1 - math.exp(-dt / self.time_constant)
+                self.speed += alpha * (self.rate - self.speed)
+                if total > last_total:
+                    self.last_progress = now
+        else:
+            self.last_progress = now
+        self._samples.append((now, total))
+
+    def window_rate(self) -> float:
+        """
+        Average speed over the samples in the ring buffer.
+        """
+        if len(self._samples) < 2:
+            return 0.0
+        (first_time, first_total), (last_time, last_total) = self._samples[0], self._samples[-1]
+        if last_time <= first_time:
+            return 0.0
+        return (last_total - first_total) / (last_time - first_time)
+
+    def eta(self, total: int) -> Optional[float]:
+        """
+        Seconds until `total` bytes are transferred at the current speed, None if unknown.
+        """
+        if not self._samples or self.speed <= 0:
+            return None
+        return max(0, total - self._samples[-1][1]) / self.speed
+
+    def stalled_for(self) -> float:
+        """
+        Seconds since the byte counter last moved.
+        """
+        return time.monotonic() - self.last_progress
@@ -1,27 +1,65 @@
 from __future__ import annotations
 
 from abc import ABC, abstractmethod
+from enum import Enum
 import logging
 import os
 from pupadrive.helper.ddownload import DDLFileDownload
 import shutil
 from pathlib import Path
 import time
-from typing import Any, Optional, Union
+from typing import Any, Awaitable, Callable, Optional, Union
 import asyncio
+import itertools
 import libtorrent as lt
+from pyrogram.errors import FloodWait, RPCError
 from pyrogram.types import Message
 
-from .helper.drive import FileUpload, FolderUpload
-from .helper.utils import try_get_env, get_readable_filesize
+from .helper.download import HttpFileDownload
+from .helper.diskspace import DEFAULT_LOW_WATERMARK, DiskSpace, DiskSpaceError
+from .helper.drive import FileUpload, FolderUpload, IncrementalUpload, StreamUpload
+from .helper.metrics import (ACTIVE_JOBS, BYTES_DOWNLOADED, WORKER_LOOP_SECONDS,
+                             track, update_libtorrent_stats)
+from .helper.pipe import StreamPipe
+from .helper.ratelimit import TokenBucket
+from .helper.resume import DEFAULT_RESUME_DIR, ResumeStore
+from .helper.selection import file_priorities, select_files
+from .helper.scheduler import DEFAULT_STAGE_LIMITS, JobScheduler, parse_limits
+from .helper.telegram import TelegramFileDownload
+from .helper.throughput import ThroughputTracker
+from .helper.utils import try_get_env, get_readable_filesize, get_readable_time
 from .helper.rapidgator import RapidFileDownload
 from typing import TYPE_CHECKING
 
 if TYPE_CHECKING:
     from .pupadrive import Pupadrive
 
+FileDownload = Union[HttpFileDownload, TelegramFileDownload]
+
+STATUS_UPDATE_INTERVAL = 1.0
+BATCH_LOOKUP_CONCURRENCY = 8
+BATCH_SUMMARY_LIMIT = 3500
+FILE_LIST_LIMIT = 3500
+# asks for the file selection once the metadata arrived
+ASK_SELECTION = "?"
+SESSION_STATS_INTERVAL = 10.0
+RESUME_SAVE_INTERVAL = 60.0
+RESUME_SAVE_TIMEOUT = 10.0
+DEFAULT_STALL_TIMEOUT = 120.0
+# telegram allows about 30 messages per second overall, one per second in a private chat and
+# 20 per minute in a group
+GLOBAL_MESSAGE_RATE = 30.0
+PRIVATE_CHAT_RATE = 1.0
+GROUP_CHAT_RATE = 20 / 60
+CHAT_BURST = 3.0
+MIN_UPDATE_INTERVAL = 2.0
+MAX_UPDATE_INTERVAL = 30.0
+SCHEDULER_TICK = 0.5
+FLOOD_RETRIES = 3
+
 
 class Status(ABC):
+    throughput: Optional[ThroughputTracker] = None
 
     @abstractmethod
     def get_name(self) -> str:
@@ -31,18 +69,40 @@ class Status(ABC):
     def get_status_text(self) -> str:
         pass
 
+    def sample(self) -> None:
+        """
+        Take a throughput sample, called periodically by the file manager.
+        """
+        if self.throughput is not None:
+            self.throughput.sample()
+
+    def get_progress(self) -> tuple[int, int]:
+        """
+        Bytes done and total bytes of the current stage.
+        """
+        return 0, 0
+
+
+def get_readable_eta(throughput: ThroughputTracker, total: int) -> str:
+    eta = throughput.eta(total)
+    if eta is None:
+        return "-"
+    return get_readable_time(eta)
+
 
 class RapidgatorStatus(Status):
     def __init__(self, name: str, status: RapidFileDownload):
         self.name = name
         self.status = status
+        self.throughput = status.throughput
 
     def get_name(self) -> str:
         return self.name
 
+    def get_progress(self) -> tuple[int, int]:
+        return self.status.downloaded_bytes, self.status.total_bytes
+
     def get_status_text(self) -> str:
-        up_speed = self.status.downloaded_bytes / \
-            (time.time() - self.status.start_time)
         if self.status.total_bytes == 0:
             up_progress = 0.0
         else:
@@ -54,7 +114,7 @@ __downloading__ {up_progress:.1%}
 
 {get_readable_filesize(self.status.downloaded_bytes)} of {get_readable_filesize(self.status.total_bytes)} done.
 
-⬇️ {get_readable_filesize(int(up_speed))}/s
+⬇️ {get_readable_filesize(int(self.throughput.speed))}/s | ETA: {get_readable_eta(self.throughput, self.status.total_bytes)}
 """
 
 
@@ -62,13 +122,15 @@ class DdownloadStatus(Status):
     def __init__(self, name: str, status: DDLFileDownload):
         self.name = name
         self.status = status
+        self.throughput = status.throughput
 
     def get_name(self) -> str:
         return self.name
 
+    def get_progress(self) -> tuple[int, int]:
+        return self.status.downloaded_bytes, self.status.total_bytes
+
     def get_status_text(self) -> str:
-        up_speed = self.status.downloaded_bytes / \
-            (time.time() - self.status.start_time)
         if self.status.total_bytes == 0:
             up_progress = 0.0
         else:
@@ -80,20 +142,100 @@ __downloading__ {up_progress:.1%}
 
 {get_readable_filesize(self.status.downloaded_bytes)} of {get_readable_filesize(self.status.total_bytes)} done.
 
-⬇️ {get_readable_filesize(int(up_speed))}/s
+⬇️ {get_readable_filesize(int(self.throughput.speed))}/s | ETA: {get_readable_eta(self.throughput, self.status.total_bytes)}
+"""
+
+
+class TelegramStatus(Status):
+    def __init__(self, name: str, status: TelegramFileDownload):
+        self.name = name
+        self.status = status
+        self.throughput = status.throughput
+
+    def get_name(self) -> str:
+        return self.name
+
+    def get_progress(self) -> tuple[int, int]:
+        return self.status.downloaded_bytes, self.status.total_bytes
+
+    def get_status_text(self) -> str:
+        if self.status.total_bytes == 0:
+            up_progress = 0.0
+        else:
+            up_progress = float(self.status.downloaded_bytes) / \
+                float(self.status.total_bytes)
+        return f"""
+**{self.name[:80]}**
+__downloading__ {up_progress:.1%}
+
+{get_readable_filesize(self.status.downloaded_bytes)} of {get_readable_filesize(self.status.total_bytes)} done.
+
+⬇️ {get_readable_filesize(int(self.throughput.speed))}/s | ETA: {get_readable_eta(self.throughput, self.status.total_bytes)}
+"""
+
+
+class StreamStatus(Status):
+    def __init__(self, name: str, download: FileDownload, upload: StreamUpload) -> None:
+        self.name = name
+        self.download = download
+        self.upload = upload
+        self.throughput = upload.throughput
+
+    def get_name(self) -> str:
+        return self.name
+
+    def sample(self) -> None:
+        self.download.throughput.sample()
+        self.upload.throughput.sample()
+
+    def get_progress(self) -> tuple[int, int]:
+        return self.upload.total_uploaded(), self.download.total_bytes
+
+    def get_status_text(self) -> str:
+        if self.download.total_bytes == 0:
+            progress = 0.0
+        else:
+            progress = float(self.upload.total_uploaded()) / \
+                float(self.download.total_bytes)
+        return f"""
+**{self.name[:80]}**
+__streaming__ {progress:.1%}
+
+{get_readable_filesize(self.download.downloaded_bytes)} downloaded, {get_readable_filesize(self.upload.total_uploaded())} of {get_readable_filesize(self.download.total_bytes)} uploaded.
+
+⬇️ {get_readable_filesize(int(self.download.throughput.speed))}/s | ⬆️ {get_readable_filesize(int(self.upload.throughput.speed))}/s | ETA: {get_readable_eta(self.throughput, self.download.total_bytes)}
 """
 
 
 class TorrentStatus(Status):
     def __init__(self, torrent_handle) -> None:
         self.torrent_handle = torrent_handle
+        self.upload: Optional[IncrementalUpload] = None
+        self._status = None
+        self.throughput = ThroughputTracker(
+            lambda: self._get_status().total_wanted_done)
         super().__init__()
 
+    def update(self, status) -> None:
+        """
+        Use a status from a state_update_alert instead of asking the handle.
+        """
+        self._status = status
+
+    def _get_status(self):
+        if self._status is None:
+            self._status = self.torrent_handle.status()
+        return self._status
+
     def get_name(self) -> str:
-        return self.torrent_handle.status().name
+        return self._get_status().name
+
+    def get_progress(self) -> tuple[int, int]:
+        status = self._get_status()
+        return status.total_wanted_done, status.total_wanted
 
     def get_status_text(self) -> str:
-        status = self.torrent_handle.status()  # type: ignore
+        status = self._get_status()  # type: ignore
         state_str = ['queued', 'checking', 'downloading metadata',
                      'downloading', 'finished', 'seeding', '', 'checking fastresume']
         status_text = f"""
@@ -103,7 +245,11 @@ __{state_str[status.state]}__ {status.progress:.1%}
 {get_readable_filesize(status.total_done)} of {get_readable_filesize(status.total)} done.
 P: {status.num_peers} | S: {status.num_seeds}
 
-⬇️ {get_readable_filesize(status.download_rate)}/s | ⬆️ {get_readable_filesize(status.upload_rate)}/s
+⬇️ {get_readable_filesize(status.download_rate)}/s | ⬆️ {get_readable_filesize(status.upload_rate)}/s | ETA: {get_readable_eta(self.throughput, status.total_wanted)}
+"""
+        if self.upload is not None:
+            status_text += f"""
+{get_readable_filesize(self.upload.total_uploaded())} of {get_readable_filesize(self.upload.total_size)} uploaded.
 """
         return status_text
 
@@ -113,12 +259,15 @@ class DriveUploadStatus(Status):
         super().__init__()
         self.name = name
         self.status = status
+        self.throughput = status.throughput
 
     def get_name(self) -> str:
         return self.name
 
+    def get_progress(self) -> tuple[int, int]:
+        return self.status.total_uploaded(), self.status.total_size
+
     def get_status_text(self) -> str:
-        up_speed = self.status.total_uploaded() / (time.time() - self.status.start_time)
         total_uploaded = self.status.total_uploaded()
         if self.status.total_size == 0:
             up_progress = 0.0
@@ -130,179 +279,1098 @@ __uploading__ {up_progress:.1%}
 
 {get_readable_filesize(total_uploaded)} of {get_readable_filesize(self.status.total_size)} done.
 
-⬆️ {get_readable_filesize(int(up_speed))}/s
+⬆️ {get_readable_filesize(int(self.throughput.speed))}/s | ETA: {get_readable_eta(self.throughput, self.status.total_size)}
 """
         return status_text
 
 
+class PendingUploadStatus(Status):
+    """
+    Status of a finished torrent whose upload was restored after a restart.
+    """
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+
+    def get_name(self) -> str:
+        return self.name
+
+    def get_status_text(self) -> str:
+        return f"""
+**{self.name[:80]}**
+__waiting for upload__
+"""
+
+
+class BatchStatus(Status):
+    """
+    Combined status of the jobs of a bulk request. Jobs that are done leave `pending` and
+    add a line to `results`, the batch is done once all links were added and none is pending.
+    The size of finished jobs stays in the progress as `finished_bytes`.
+    """
+
+    def __init__(self, id: str, manager: StatusMessageManager, size: int) -> None:
+        self.id = id
+        self.size = size
+        self.pending: set[str] = set()
+        self.results: list[str] = []
+        self.finished_bytes = 0
+        self.ready = False
+        self._manager = manager
+
+    def get_name(self) -> str:
+        return f"Batch of {self.size} links"
+
+    def add_result(self, text: str) -> None:
+        self.results.append(" ".join(text.split()))
+
+    def get_progress(self) -> tuple[int, int]:
+        done = total = self.finished_bytes
+        for id in self.pending:
+            status = self._manager.statuses.get(id)
+            if status is not None:
+                status_done, status_total = status.get_progress()
+                done += status_done
+                total += status_total
+        return done, total
+
+    def get_speed(self) -> float:
+        speed = 0.0
+        for id in self.pending:
+            status = self._manager.statuses.get(id)
+            if status is not None and status.throughput is not None:
+                speed += status.throughput.speed
+        return speed
+
+    def get_status_text(self) -> str:
+        done, total = self.get_progress()
+        progress = float(done) / float(total) if total else 0.0
+        speed = self.get_speed()
+        eta = get_readable_time((total - done) / speed) if speed > 0 else "-"
+        return f"""
+**{self.get_name()}**
+__{len(self.pending)} running, {len(self.results)} done__ {progress:.1%}
+
+{get_readable_filesize(done)} of {get_readable_filesize(total)} done.
+
+⚡ {get_readable_filesize(int(speed))}/s | ETA: {eta}
+"""
+
+    def get_summary_text(self) -> str:
+        text = f"**{self.get_name()}**\n__finished__\n"
+        for i, result in enumerate(self.results):
+            if len(text) + len(result) > BATCH_SUMMARY_LIMIT:
+                text += f"\n... and {len(self.results) - i} more"
+                break
+            text += f"\n{result}"
+        return text
+
+
+class JobState(Enum):
+    METADATA = "metadata"
+    DOWNLOADING = "downloading"
+    UPLOADING = "uploading"
+    FINISHED = "finished"
+    FAILED = "failed"
+
+
 class FileManager:
+    """
+    Runs the mirror jobs. Nothing is polled: torrents move on through libtorrent alerts and
+    hoster downloads and drive uploads through the completion of their tasks.
+
+    Every stage of a job waits for a slot of the scheduler first, torrents are added paused
+    and only resumed once admitted. A streamed hoster download and the incremental upload of
+    a torrent run in the slot of the download.
+
+    Downloads to disk also wait until their size can be reserved, and running torrents are
+    paused while the free space is below the low watermark.
+    """
     _client: Pupadrive
     ongoing: dict[str, Any] = {}
     ongoing_lock = asyncio.Lock()
 
     def __init__(self, client: Pupadrive) -> None:
         self._client = client
+        # pipe hoster downloads straight into the drive upload instead of the disk
+        self.streaming = os.getenv(
+            "STREAMING_UPLOADS", "False").lower() in ("true", "1", "t")
+        # upload torrent files as soon as they completed instead of waiting for the torrent
+        self.incremental = os.getenv(
+            "INCREMENTAL_UPLOADS", "False").lower() in ("true", "1", "t")
+        self.incremental_uploads: dict[str, IncrementalUpload] = {}
+        self.states: dict[str, JobState] = {}
+        self.priorities: dict[str, int] = {}
+        # file patterns of torrents that only download some files, empty to ask for them
+        self.selections: dict[str, list[str]] = {}
+        self.selected_files: dict[str, set[int]] = {}
+        self._wanted: dict[str, int] = {}
+        self.awaiting_selection: set[str] = set()
+        self.scheduler = JobScheduler({
+            stage: int(os.getenv(f"{stage.upper()}_JOBS", limit))
+            for stage, limit in DEFAULT_STAGE_LIMITS.items()
+        }, parse_limits(os.getenv("SOURCE_JOB_LIMITS")))
+        self.disk = DiskSpace(low_watermark=int(
+            os.getenv("DISK_LOW_WATERMARK", DEFAULT_LOW_WATERMARK)))
+        self._paused_for_space: set[str] = set()
+        self._torrent_ids: dict[Any, str] = {}
+        # payload bytes of each torrent that were counted in the download metrics
+        self._torrent_downloaded: dict[str, int] = {}
+        # wanted bytes of each torrent that are on disk
+        self._torrent_written: dict[str, int] = {}
+        # files of finished torrents that wait for their upload
+        self._upload_paths: dict[str, Path] = {}
+        self._last_session_stats = 0.0
+        self._alerts_ready = asyncio.Event()
+        # hoster downloads without progress for this long are restarted
+        self.stall_timeout = float(
+            os.getenv("STALL_TIMEOUT", DEFAULT_STALL_TIMEOUT))
 
         PROXY_HOSTNAME = try_get_env("PROXY_HOSTNAME")
         PROXY_USERNAME = try_get_env("PROXY_USERNAME")
         PROXY_PASSWORD = try_get_env("PROXY_PASSWORD")
 
-        self._ses = lt.session({  # type: ignore
+        self.resume = ResumeStore(os.getenv("RESUME_DIR", DEFAULT_RESUME_DIR))
+        self._last_resume_save = time.monotonic()
+        # resume data requests of the shutdown that are not written yet
+        self._resume_pending = 0
+        self._resume_saved = asyncio.Event()
+        self._ses = self._create_session({  # type: ignore
             "proxy_hostname": PROXY_HOSTNAME,
             "proxy_username": PROXY_USERNAME,
             "proxy_password": PROXY_PASSWORD,
             "proxy_type": lt.proxy_type_t.socks5_pw,  # type: ignore
-            "proxy_port": 5080
+            "proxy_port": 5080,
+            "alert_mask": lt.alert.category_t.error_notification  # type: ignore
+            | lt.alert.category_t.status_notification  # type: ignore
+            | lt.alert.category_t.storage_notification  # type: ignore
+            | lt.alert.category_t.file_progress_notification  # type: ignore
         })
 
-    async def add_magnet(self, magnet: str, chat_id: int):
+    def _create_session(self, settings: dict):
+        """
+        Create the session from the saved session state, so the DHT doesn't bootstrap from
+        scratch, and apply `settings` over it.
+        """
+        state = self.resume.load_session()
+        if state is not None:
+            try:
+                ses = lt.session(lt.read_session_params(state))  # type: ignore
+                ses.apply_settings(settings)
+                return ses
+            except RuntimeError as e:
+                logging.warning(f"could not load the session state: {e}")
+        return lt.session(settings)  # type: ignore
+
+    def _save_resume_data(self, flags: int = 0) -> int:
+        """
+        Ask libtorrent for the resume data of every torrent, the save_resume_data_alerts are
+        written to disk by the worker. Returns the number of requests.
+        """
+        count = 0
+        for handle, id in self._torrent_ids.items():
+            if not handle.is_valid():
+                continue
+            handle.save_resume_data(flags | lt.torrent_handle.save_info_dict)  # type: ignore
+            self.resume.save_job(
+                id, sorted(self._client.status_manager.job_chats(id)), self.priorities.get(id, 0),
+                self.selections.get(id))
+            count += 1
+        return count
+
+    def _on_resume_data(self, alert) -> None:
+        if isinstance(alert, lt.save_resume_data_alert):  # type: ignore
+            id = self._torrent_ids.get(alert.handle)
+            # the torrent may have finished since the request
+            if id is not None:
+                self.resume.save(id, lt.write_resume_data_buf(alert.params))  # type: ignore
+        else:
+            # also posted for torrents that didn't change since the last save
+            logging.debug(alert.message())
+        if self._resume_pending > 0:
+            self._resume_pending -= 1
+            if self._resume_pending == 0:
+                self._resume_saved.set()
+
+    async def save_state(self, timeout: float = RESUME_SAVE_TIMEOUT) -> None:
+        """
+        Save the resume data of every torrent and the session state, called on shutdown.
+        """
+        self._resume_saved.clear()
+        self._resume_pending = self._save_resume_data(lt.torrent_handle.flush_disk_cache)  # type: ignore
+        if self._resume_pending:
+            try:
+                await asyncio.wait_for(self._resume_saved.wait(), timeout)
+            except asyncio.TimeoutError:
+                logging.warning(
+                    f"{self._resume_pending} torrents did not save their resume data in time")
+        self.resume.save_session(lt.write_session_params_buf(  # type: ignore
+            self._ses.session_state(lt.save_state_flags_t.save_dht_state)))  # type: ignore
+
+    async def restore(self) -> None:
+        """
+        Re-add the torrents that were running before the last shutdown from their resume data,
+        their files are not checked again. Torrents that had finished are uploaded again.
+        """
+        for id, data, job in self.resume.jobs():
+            if job.get("upload") is not None:
+                await self._restore_upload(id, job)
+                continue
+            if data is None:
+                self.resume.remove(id)
+                continue
+            try:
+                params = lt.read_resume_data(data)  # type: ignore
+            except RuntimeError as e:
+                logging.warning(f"dropping resume data of {id}: {e}")
+                self.resume.remove(id)
+                continue
+            params.flags = (params.flags | lt.torrent_flags.paused) & ~lt.torrent_flags.auto_managed  # type: ignore
+            has_metadata = params.ti is not None
+            async with self.ongoing_lock:
+                if id in self.states:
+                    continue
+                torrent_handle = self._ses.add_torrent(params)
+                self._add_torrent_job(
+                    id, torrent_handle, JobState.DOWNLOADING if has_metadata else JobState.METADATA)
+                self.priorities[id] = job.get("priority", 0)
+                if job.get("selection") is not None:
+                    self.selections[id] = job["selection"]
+                self._client.status_manager.set_status(id, TorrentStatus(torrent_handle))
+                for chat_id in job.get("chats", []):
+                    self._client.status_manager.chat_subscribe(chat_id, id)
+                if has_metadata:
+                    self._start_selected(id, torrent_handle)
+                else:
+                    self._spawn(id, self._resume_when_admitted(id, torrent_handle, "metadata"))
+            logging.info(f"restored {id} from its resume data")
+
+    async def _restore_upload(self, id: str, job: dict) -> None:
+        upload = job["upload"]
+        save_path = Path(upload["save_path"])
+        if not save_path.exists():
+            logging.warning(f"dropping {id}, its files are gone")
+            self.resume.remove(id)
+            return
+        files = upload.get("files")
+        selected = None if files is None else [Path(path) for path in files]
+        async with self.ongoing_lock:
+            if id in self.states:
+                return
+            # the same state a finished torrent has until its upload is admitted
+            self._transition(id, JobState.DOWNLOADING)
+            self.priorities[id] = job.get("priority", 0)
+            self._client.status_manager.set_status(id, PendingUploadStatus(upload["name"]))
+            for chat_id in job.get("chats", []):
+                self._client.status_manager.chat_subscribe(chat_id, id)
+            self._queue_torrent_upload(id, upload["name"], save_path, selected)
+        logging.info(f"restored the upload of {id}")
+
+    async def find_mirror(self, key: str, name: str = None) -> Optional[tuple[str, Optional[str]]]:
+        """
+        Look up a finished mirror in the local index, then by folder name on drive.
+        """
+        mirror = await self._client.index.get(key)
+        if mirror is not None:
+            return mirror
+        mirror = await self._client.drive.check_folder(name or key)
+        if mirror is not None:
+            await self._client.index.put(key, mirror[0], mirror[1])
+        return mirror
+
+    async def _reply(self, chat_id: int, text: str, batch: BatchStatus = None) -> None:
+        if batch is not None:
+            batch.add_result(text)
+        else:
+            await self._client.send_message(chat_id, text)
+
+    def _subscribe(self, chat_id: int, batch: Optional[BatchStatus], id: str) -> None:
+        if batch is not None:
+            self._client.status_manager.batch_add(batch, id)
+        else:
+            self._client.status_manager.chat_subscribe(chat_id, id)
+
+    async def add_link(self, link: str, chat_id: int, priority: int = 0, batch: BatchStatus = None) -> None:
+        if link.startswith("magnet:"):
+            await self.add_magnet(link, chat_id, priority, batch)
+        elif self._client.rapidgator.get_file_id(link) is not None:
+            await self.add_rapidgator(link, chat_id, priority, batch)
+        elif self._client.ddownload.get_file_id(link) is not None:
+            await self.add_ddownload(link, chat_id, priority, batch)
+        else:
+            await self._reply(chat_id, f"**{link[:80]}**\n__unsupported link__", batch)
+
+    async def add_batch(self, links: list[str], chat_id: int, priority: int = 0) -> None:
+        """
+        Mirror many links at once behind one aggregated status. Links to the same torrent or
+        hoster file are dropped and up to `BATCH_LOOKUP_CONCURRENCY` of them are looked up at
+        the same time.
+        """
+        unique: dict[str, str] = {}
+        for link in (link.strip() for link in links):
+            if link:
+                unique.setdefault(self._link_key(link), link)
+        links = list(unique.values())
+        batch = self._client.status_manager.create_batch(chat_id, len(links))
+        semaphore = asyncio.Semaphore(BATCH_LOOKUP_CONCURRENCY)
+
+        async def add(link: str) -> None:
+            async with semaphore:
+                try:
+                    await self.add_link(link, chat_id, priority, batch)
+                except Exception:
+                    logging.exception(f"could not add {link}")
+                    batch.add_result(f"**{link[:80]}**\n__failed__")
+
+        await asyncio.gather(*(add(link) for link in links))
+        self._client.status_manager.batch_ready(batch)
+
+    def _link_key(self, link: str) -> str:
+        """
+        What a link points to, the info hash of a magnet or the file id of a hoster link.
+        """
+        if link.startswith("magnet:"):
+            try:
+                return str(lt.parse_magnet_uri(link).info_hashes.get_best())  # type: ignore
+            except RuntimeError:
+                return link
+        for hoster in (self._client.rapidgator, self._client.ddownload):
+            file_id = hoster.get_file_id(link)
+            if file_id is not None:
+                return f"{hoster.name}_{file_id}"
+        return link
+
+    async def _send_indexed(self, key: str, chat_id: int, batch: BatchStatus = None) -> bool:
+        mirror = await self._client.index.get(key)
+        if mirror is None:
+            return False
+        logging.info(f"{key} already uploaded to drive as {mirror[0]}")
+        # the mirror is a folder or a single file, this link opens either
+        await self._reply(chat_id, f"**{mirror[1]}**\n__already uploaded__ \n\nDrive Link: https://drive.google.com/open?id={mirror[0]}", batch)
+        return True
+
+    async def add_magnet(
+            self,
+            magnet: str,
+            chat_id: int,
+            priority: int = 0,
+            batch: BatchStatus = None,
+            selection: Optional[list[str]] = None):
         info = lt.parse_magnet_uri(magnet)  # type: ignore
         info_hash = str(info.info_hashes.get_best())
 
         async with self.ongoing_lock:
-            if info_hash in self.ongoing:
+            if info_hash in self.states:
                 logging.info(
                     f"{info_hash} found, subscribing {chat_id} to existing status")
-                self._client.status_manager.chat_subscribe(chat_id, info_hash)
+                self._subscribe(chat_id, batch, info_hash)
                 return
 
-        drive_upload = await self._client.drive.check_folder(info_hash)
+        drive_upload = await self.find_mirror(info_hash)
         if drive_upload:
             logging.info(
                 f"{info_hash} already uploaded to drive folder {drive_upload[0]}")
-            await self._client.send_message(
-                chat_id, f"**{drive_upload[1]}**\n__already uploaded__ \n\nDrive Link: https://drive.google.com/drive/folders/{drive_upload[0]}")
+            await self._reply(chat_id, f"**{drive_upload[1]}**\n__already uploaded__ \n\nDrive Link: https://drive.google.com/drive/folders/{drive_upload[0]}", batch)
             return
 
-        logging.info(f"{info_hash} not found, new torrent by {chat_id}")
-        info.save_path = f"./download/{info_hash}"
-        torrent_handle = self._ses.add_torrent(info)
         async with self.ongoing_lock:
-            self.ongoing[info_hash] = torrent_handle
-
-        self._client.status_manager.set_status(
-            info_hash, TorrentStatus(torrent_handle))
-        self._client.status_manager.chat_subscribe(chat_id, info_hash)
-
-    async def add_torrent(self, torrent_file: str, chat_id: int):
+            # another request for the same torrent may have added it during the lookup
+            if info_hash in self.states:
+                logging.info(
+                    f"{info_hash} found, subscribing {chat_id} to existing status")
+                self._subscribe(chat_id, batch, info_hash)
+                return
+            logging.info(f"{info_hash} not found, new torrent by {chat_id}")
+            info.save_path = f"./download/{info_hash}"
+            # held back until the scheduler admits it
+            info.flags = (info.flags | lt.torrent_flags.paused) & ~lt.torrent_flags.auto_managed  # type: ignore
+            torrent_handle = self._ses.add_torrent(info)
+            # registered before yielding, so no alert of the torrent can be missed
+            self._add_torrent_job(info_hash, torrent_handle, JobState.METADATA)
+            self.priorities[info_hash] = priority
+            if selection is not None:
+                self.selections[info_hash] = selection
+
+            self._client.status_manager.set_status(
+                info_hash, TorrentStatus(torrent_handle))
+            self._subscribe(chat_id, batch, info_hash)
+            self._spawn(info_hash, self._resume_when_admitted(
+                info_hash, torrent_handle, "metadata"))
+
+    async def add_torrent(
+            self,
+            torrent_file: str,
+            chat_id: int,
+            priority: int = 0,
+            batch: BatchStatus = None,
+            selection: Optional[list[str]] = None):
         torrent_info = lt.torrent_info(torrent_file)  # type: ignore
         info_hash = str(torrent_info.info_hash())
 
         async with self.ongoing_lock:
-            if info_hash in self.ongoing:
+            if info_hash in self.states:
                 logging.info(
                     f"{info_hash} found, subscribing {chat_id} to existing status")
-                return self.ongoing[info_hash]
+                self._subscribe(chat_id, batch, info_hash)
+                return
 
         logging.info(f"{info_hash} not found, new torrent by {chat_id}")
-        torrent_handle = self._ses.add_torrent({  # type: ignore
-            "ti": torrent_info,
-            "save_path": f"./download/{info_hash}"
-        })
-
-        async with self.ongoing_lock:
-            self.ongoing[info_hash] = torrent_handle
+        params = lt.add_torrent_params()  # type: ignore
+        params.ti = torrent_info
+        params.save_path = f"./download/{info_hash}"
+        params.flags = (params.flags | lt.torrent_flags.paused) & ~lt.torrent_flags.auto_managed  # type: ignore
+        torrent_handle = self._ses.add_torrent(params)
+        self._add_torrent_job(info_hash, torrent_handle, JobState.DOWNLOADING)
+        self.priorities[info_hash] = priority
+        if selection is not None:
+            self.selections[info_hash] = selection
 
         self._client.status_manager.set_status(
             info_hash, TorrentStatus(torrent_handle))
-        self._client.status_manager.chat_subscribe(chat_id, info_hash)
+        self._subscribe(chat_id, batch, info_hash)
+        self._start_selected(info_hash, torrent_handle)
+
+        if self.incremental:
+            self._spawn(info_hash, self._start_incremental(info_hash, torrent_handle))
 
-    async def add_rapidgator(self, link: str, chat_id: int):
+    async def add_rapidgator(self, link: str, chat_id: int, priority: int = 0, batch: BatchStatus = None):
         file_id = self._client.rapidgator.get_file_id(link)
         if file_id is None:
-            await self._client.send_message(
-                chat_id, "**Rapidgator**\n__invalid url__")
+            await self._reply(chat_id, "**Rapidgator**\n__invalid url__", batch)
             return
         file_info = await self._client.rapidgator.get_file_info(file_id)
         if file_info is None:
-            await self._client.send_message(
-                chat_id, "**Rapidgator**\n__not found__")
+            await self._reply(chat_id, "**Rapidgator**\n__not found__", batch)
             return
 
         file_hash = str(file_info["hash"])
+        if await self._send_indexed(file_hash, chat_id, batch):
+            return
         if file_hash in self.ongoing:
             logging.info(
                 f"{file_hash} found, subscribing {chat_id} to existing status")
-            self._client.status_manager.chat_subscribe(chat_id, file_hash)
+            self._subscribe(chat_id, batch, file_hash)
             return
         logging.info(f"{file_hash} not found, new download by {chat_id}")
         file_download = self._client.rapidgator.create_download(
-            file_id, Path(f"./download/{file_info['name']}"))
-        self.ongoing[file_hash] = file_download
-        file_download.start()
-        self._client.status_manager.set_status(
-            file_hash, RapidgatorStatus(file_info["name"], file_download))
-        self._client.status_manager.chat_subscribe(chat_id, file_hash)
+            file_id, Path(f"./download/{file_info['name']}"),
+            StreamPipe() if self.streaming else None)
+        self._queue_download(file_hash, file_download, RapidgatorStatus(
+            file_info["name"], file_download), priority, int(file_info["size"]))
+        self._subscribe(chat_id, batch, file_hash)
 
-    async def add_ddownload(self, link: str, chat_id: int):
+    async def add_ddownload(self, link: str, chat_id: int, priority: int = 0, batch: BatchStatus = None):
         file_id = self._client.ddownload.get_file_id(link)
         if file_id is None:
-            await self._client.send_message(
-                chat_id, "**DDownload**\n__invalid url__")
+            await self._reply(chat_id, "**DDownload**\n__invalid url__", batch)
             return
         file_info = await self._client.ddownload.get_file_info(file_id)
         if file_info is None:
-            await self._client.send_message(
-                chat_id, "**DDownload**\n__not found__")
+            await self._reply(chat_id, "**DDownload**\n__not found__", batch)
             return
         file_hash = "ddownload_" + file_id
+        if await self._send_indexed(file_hash, chat_id, batch):
+            return
         if file_hash in self.ongoing:
             logging.info(
                 f"{file_hash} found, subscribing {chat_id} to existing status")
-            self._client.status_manager.chat_subscribe(chat_id, file_hash)
+            self._subscribe(chat_id, batch, file_hash)
             return
         logging.info(f"{file_hash} not found, new download by {chat_id}")
         file_download = await self._client.ddownload.create_download(
-            file_id, Path(f"./download/{file_info['name']}"))
-        self.ongoing[file_hash] = file_download
-        file_download.start()
+            file_id, Path(f"./download/{file_info['name']}"),
+            StreamPipe() if self.streaming else None)
         file_download.total_bytes = int(file_info["size"])
+        self._queue_download(file_hash, file_download, DdownloadStatus(
+            file_info["name"], file_download), priority, int(file_info["size"]))
+        self._subscribe(chat_id, batch, file_hash)
+
+    async def add_telegram(self, message: Message, chat_id: int, priority: int = 0, batch: BatchStatus = None):
+        """
+        Mirror the document of `message` into a drive folder named like the file.
+        """
+        file_name = message.document.file_name
+        async with self.ongoing_lock:
+            if file_name in self.ongoing:
+                logging.info(
+                    f"{file_name} found, subscribing {chat_id} to existing status")
+                self._subscribe(chat_id, batch, file_name)
+                return
+
+        mirror = await self.find_mirror(file_name)
+        if mirror is not None:
+            await self._reply(chat_id, f"**{file_name}**\n__already uploaded__ \n\nDrive Link: https://drive.google.com/drive/folders/{mirror[0]}", batch)
+            return
+        logging.info(f"{file_name} not found, new telegram download by {chat_id}")
+        file_download = TelegramFileDownload(
+            self._client, message, Path(f"./download/{file_name}"), StreamPipe())
+        self._queue_download(file_name, file_download, TelegramStatus(
+            file_name, file_download), priority, file_download.total_bytes)
+        self._subscribe(chat_id, batch, file_name)
+
+    def _transition(self, id: str, state: JobState, handle: Any = None) -> None:
+        """
+        Move a job to its next state, `handle` is the object that runs the new stage.
+        """
+        previous = self.states.get(id)
+        logging.info(
+            f"{id} {previous.value if previous else 'new'} -> {state.value}")
+        if state in (JobState.FINISHED, JobState.FAILED):
+            self.states.pop(id, None)
+            self.ongoing.pop(id, None)
+            self.priorities.pop(id, None)
+            self.selections.pop(id, None)
+            self.selected_files.pop(id, None)
+            self._wanted.pop(id, None)
+            self.awaiting_selection.discard(id)
+            self._upload_paths.pop(id, None)
+            self.scheduler.release(id)
+            self.disk.release(id)
+            self.resume.remove(id)
+        else:
+            self.states[id] = state
+            if handle is not None:
+                self.ongoing[id] = handle
+        for active in (JobState.METADATA, JobState.DOWNLOADING, JobState.UPLOADING):
+            ACTIVE_JOBS.labels(active.value).set(
+                sum(1 for s in self.states.values() if s is active))
+
+    def _add_torrent_job(self, id: str, handle, state: JobState) -> None:
+        self._torrent_ids[handle] = id
+        self._transition(id, state, handle)
+
+    def _remove_torrent(self, handle, delete_files: bool = False) -> None:
+        id = self._torrent_ids.pop(handle, None)
+        self._torrent_downloaded.pop(id, None)
+        self._torrent_written.pop(id, None)
+        self._paused_for_space.discard(id)
+        if delete_files:
+            # libtorrent deletes them in the background
+            self._ses.remove_torrent(handle, lt.session.delete_files)  # type: ignore
+        else:
+            self._ses.remove_torrent(handle)
+
+    def _update_progress(self, id: str, torrent_status) -> None:
+        downloaded = torrent_status.total_payload_download
+        BYTES_DOWNLOADED.labels("torrent").inc(
+            max(0, downloaded - self._torrent_downloaded.get(id, 0)))
+        self._torrent_downloaded[id] = downloaded
+        self._torrent_written[id] = torrent_status.total_wanted_done
+
+    def _wanted_size(self, id: str, handle) -> int:
+        # the status only catches up with new file priorities a bit later
+        wanted = self._wanted.get(id)
+        return wanted if wanted is not None else handle.status().total_wanted
+
+    def _try_reserve_torrent(self, id: str, handle) -> bool:
+        return self.disk.try_reserve(id, self._wanted_size(id, handle),
+                                     lambda: self._torrent_written.get(id, 0))
+
+    def _watch(self, id: str, handle: Any, task: asyncio.Task) -> None:
+        """
+        Continue the job when the task of its current stage is done.
+        """
+        def done(task: asyncio.Task):
+            asyncio.create_task(self._on_task_done(id, handle, task))
+        task.add_done_callback(done)
+
+    def _spawn(self, id: str, coro: Awaitable[None]) -> asyncio.Task:
+        """
+        Run a step of a job in the background, the job fails if the step raises.
+        """
+        task = asyncio.create_task(coro)
+
+        def done(task: asyncio.Task):
+            if task.cancelled() or task.exception() is None:
+                return
+            logging.error(f"{id} failed", exc_info=task.exception())
+            reason = "not enough disk space" if isinstance(task.exception(), DiskSpaceError) else None
+            asyncio.create_task(self._fail(id, reason))
+        task.add_done_callback(done)
+        return task
+
+    async def _fail(self, id: str, reason: str = None) -> None:
+        async with self.ongoing_lock:
+            self._fail_job(id, reason)
+
+    def _fail_job(self, id: str, reason: str = None) -> None:
+        """
+        Stop a job, delete what it left on disk and report it as failed with an optional
+        `reason`, the caller holds `ongoing_lock`.
+        """
+        if id not in self.states:
+            return
+        handle = self.ongoing.get(id)
+        if handle in self._torrent_ids:
+            self._remove_torrent(handle, delete_files=True)
+        elif isinstance(handle, HttpFileDownload):
+            handle.cancel()
+            # the journal is no use once the job is gone
+            asyncio.create_task(self._discard(
+                [Path(handle.save_path), handle.journal_path], getattr(handle, "_task", None)))
+        elif isinstance(handle, (FileUpload, FolderUpload)):
+            # cancelling a stream upload also aborts its pipe and download
+            handle.cancel()
+            asyncio.create_task(self._discard([handle.local_path], getattr(handle, "_task", None)))
+        elif id in self._upload_paths:
+            asyncio.create_task(self._discard([self._upload_paths[id]]))
+        drive_upload = self.incremental_uploads.pop(id, None)
+        if drive_upload is not None:
+            drive_upload.cancel()
+        self._transition(id, JobState.FAILED)
+        self._client.status_manager.send_failed(id, reason)
+
+    async def _resume_when_admitted(self, id: str, handle, stage: str) -> None:
+        await self.scheduler.admit(id, stage, "torrent", self.priorities.get(id, 0))
+        if stage == "download":
+            await self.disk.reserve(id, self._wanted_size(id, handle),
+                                    lambda: self._torrent_written.get(id, 0))
+        handle.resume()
+
+    def _queue_download(self, id: str, file_download: FileDownload, status: Status, priority: int, size: int) -> None:
+        self._transition(id, JobState.DOWNLOADING, file_download)
+        self.priorities[id] = priority
+        self._client.status_manager.set_status(id, status)
+        self._spawn(id, self._download_when_admitted(
+            id, file_download, status.get_name(), size))
+
+    async def _download_when_admitted(self, id: str, file_download: FileDownload, name: str, size: int) -> None:
+        await self.scheduler.admit(id, "download", file_download.source, self.priorities.get(id, 0))
+        if file_download.pipe is None:
+            await self.disk.reserve(id, size, file_download.disk_usage)
+        else:
+            drive_parent = await self._drive_parent(file_download)
+        async with self.ongoing_lock:
+            if self.ongoing.get(id) is not file_download:
+                return
+            if file_download.pipe is not None:
+                self._start_stream(id, name, file_download, file_download.pipe, drive_parent)
+            else:
+                self._watch(id, file_download, file_download.start())
+
+    async def _upload_when_admitted(
+            self,
+            id: str,
+            source: str,
+            name: str,
+            create: Callable[[], Awaitable[Union[FileUpload, FolderUpload]]]) -> None:
+        await self.scheduler.admit(id, "upload", source, self.priorities.get(id, 0))
+        if id not in self.states:
+            return
+        # drive calls don't hold up the other jobs
+        drive_upload = await create()
+        async with self.ongoing_lock:
+            if id not in self.states:
+                return
+            drive_upload.source = source
+            self._transition(id, JobState.UPLOADING, drive_upload)
+            self._client.status_manager.set_status(
+                id, DriveUploadStatus(name, drive_upload))
+            self._watch(id, drive_upload, drive_upload.start())
+
+    async def _on_task_done(self, id: str, handle: Any, task: asyncio.Task) -> None:
+        local_path = None
+        async with self.ongoing_lock:
+            # the job moved on, or the stage was restarted with a new task
+            if self.ongoing.get(id) is not handle or getattr(handle, "_task", task) is not task:
+                return
+            if task.cancelled() or task.exception() is not None:
+                logging.error(
+                    f"{id} failed while {self.states[id].value}", exc_info=None if task.cancelled() else task.exception())
+                self._fail_job(id)
+                return
+
+            if isinstance(handle, HttpFileDownload):
+                if not handle.is_finished:
+                    self._fail_job(id)
+                    return
+                # the file is on disk now, the free space accounts for it
+                self.disk.release(id)
+                save_path = Path(handle.save_path)
+
+                async def create() -> FileUpload:
+                    upload = self._client.drive.upload_file(
+                        save_path, await self._drive_parent(handle))
+                    upload.expected_md5 = handle.md5
+                    return upload
+                self._spawn(id, self._upload_when_admitted(
+                    id, handle.source, save_path.name, create))
+            elif isinstance(handle, FolderUpload) or isinstance(handle, FileUpload):
+                self._transition(id, JobState.FINISHED)
+                self._client.status_manager.send_finished(id, handle)
+                local_path = handle.local_path
+        if local_path is not None:
+            await asyncio.get_event_loop().run_in_executor(None, self._delete_local, local_path)
+            self.disk.changed()
+
+    async def _discard(self, paths: list[Path], task: asyncio.Task = None) -> None:
+        """
+        Delete the files of a failed job once its `task` stopped writing to them.
+        """
+        if task is not None:
+            await asyncio.wait([task])
+        loop = asyncio.get_event_loop()
+        for path in paths:
+            await loop.run_in_executor(None, self._delete_local, path)
+        self.disk.changed()
+
+    @staticmethod
+    def _delete_local(path: Path) -> None:
+        if path.is_dir():
+            shutil.rmtree(path)
+        elif path.exists():
+            os.remove(path)
+
+    async def _drive_parent(self, file_download: FileDownload) -> Optional[str]:
+        """
+        Create the drive folder of a download if it has one, None uploads into the root.
+        """
+        if file_download.drive_folder is None:
+            return None
+        return await self._client.drive.create_folder(file_download.drive_folder)
+
+    def _start_stream(
+            self,
+            id: str,
+            name: str,
+            file_download: FileDownload,
+            pipe: StreamPipe,
+            drive_parent: str = None) -> None:
+        file_upload = self._client.drive.upload_stream(file_download.save_path, pipe, drive_parent)
+        file_upload.source = file_download.source
+        self._transition(id, JobState.UPLOADING, file_upload)
+        download_task = file_download.start()
+        # a failed download aborts the pipe, the upload task reports it
+        download_task.add_done_callback(
+            lambda t: t.cancelled() or t.exception())
+        upload_task = file_upload.start()
+
+        def upload_done(task: asyncio.Task) -> None:
+            # nothing reads the pipe anymore, stop the download blocked on it
+            if task.cancelled() or task.exception() is not None:
+                pipe.abort(asyncio.CancelledError() if task.cancelled() else task.exception())
+                file_download.cancel()
+        upload_task.add_done_callback(upload_done)
+        self._watch(id, file_upload, upload_task)
         self._client.status_manager.set_status(
-            file_hash, DdownloadStatus(file_info["name"], file_download))
-        self._client.status_manager.chat_subscribe(chat_id, file_hash)
-        await file_download._task
+            id, StreamStatus(name, file_download, file_upload))
+
+    async def _start_incremental(self, id: str, handle) -> None:
+        """
+        Create the drive folder of a torrent and start uploading its files as they complete,
+        the folder is created without holding `ongoing_lock`.
+        """
+        torrent_status = handle.status()
+        drive_parent = await self._client.drive.create_folder(id, app_properties={"torrent_name": torrent_status.name})
+        async with self.ongoing_lock:
+            # the torrent finished or failed in the meantime
+            if handle not in self._torrent_ids or id in self.incremental_uploads:
+                return
+            self._register_incremental(id, handle, drive_parent)
+
+    def _register_incremental(self, id: str, handle, drive_parent: str) -> None:
+        drive_upload = self._client.drive.upload_incremental(
+            Path(handle.status().save_path), drive_parent, self._wanted_size(id, handle))
+        drive_upload.source = "torrent"
+        self.incremental_uploads[id] = drive_upload
+        status = self._client.status_manager.statuses.get(id)
+        if isinstance(status, TorrentStatus):
+            status.upload = drive_upload
+        self._watch_incremental(id, drive_upload, drive_upload.start())
+        self._add_completed_files(id, handle, drive_upload)
+
+    def _watch_incremental(self, id: str, drive_upload: IncrementalUpload, task: asyncio.Task) -> None:
+        """
+        Fail the job as soon as the upload fails while the torrent is still downloading, once
+        the torrent finished `_watch` takes over.
+        """
+        def done(task: asyncio.Task):
+            if task.cancelled() or task.exception() is None:
+                return
+            if self.incremental_uploads.get(id) is not drive_upload:
+                return
+            logging.error(f"{id} failed while uploading its completed files", exc_info=task.exception())
+            asyncio.create_task(self._fail(id))
+        task.add_done_callback(done)
+
+    def _add_completed_files(self, id: str, handle, drive_upload: IncrementalUpload) -> None:
+        files = handle.torrent_file().files()
+        save_path = Path(handle.status().save_path)
+        selected = self.selected_files.get(id)
+        for index, done in enumerate(handle.file_progress()):
+            if selected is not None and index not in selected:
+                continue
+            size = files.file_size(index)
+            if size and done == size:
+                drive_upload.add_file(save_path / files.file_path(index))
+
+    def _select(self, id: str, handle) -> bool:
+        """
+        Set the file priorities from the selection of the torrent, returns False if it still
+        has to be chosen.
+        """
+        patterns = self.selections.get(id)
+        if patterns is None:
+            return True
+        files = handle.torrent_file().files()
+        paths = [files.file_path(i) for i in range(files.num_files())]
+        selected = select_files(patterns, paths)
+        if not selected:
+            return False
+        handle.prioritize_files(file_priorities(selected, len(paths)))
+        self.selected_files[id] = selected
+        self._wanted[id] = sum(files.file_size(i) for i in selected)
+        return True
+
+    def _start_selected(self, id: str, handle) -> None:
+        """
+        Queue the download of a torrent with metadata, or ask for its files first.
+        """
+        if self._select(id, handle):
+            self._spawn(id, self._resume_when_admitted(id, handle, "download"))
+        else:
+            self._await_selection(id, handle)
+
+    def _await_selection(self, id: str, handle) -> None:
+        handle.pause()
+        # choosing can take a while, the slot goes to the next job meanwhile
+        self.scheduler.release(id)
+        self.awaiting_selection.add(id)
+        self._spawn(id, self._ask_selection(id, handle))
+
+    def _file_list(self, id: str, handle) -> str:
+        files = handle.torrent_file().files()
+        selected = self.selected_files.get(id)
+        text = f"**{handle.status().name[:80]}**\n__choose the files to download__\n"
+        for i in range(files.num_files()):
+            mark = "✅ " if selected is not None and i in selected else ""
+            line = f"\n{i + 1}. {mark}{files.file_path(i)} ({get_readable_filesize(files.file_size(i))})"
+            if len(text) + len(line) > FILE_LIST_LIMIT:
+                text += f"\n... and {files.num_files() - i} more"
+                break
+            text += line
+        return text + f"\n\nSend `/select {id} <numbers, ranges or globs>`"
+
+    async def _ask_selection(self, id: str, handle) -> None:
+        text = self._file_list(id, handle)
+        for chat_id in self._client.status_manager.job_chats(id):
+            await self._client.send_message(chat_id, text)
+
+    async def select(self, id: str, patterns: list[str]) -> str:
+        """
+        Choose the files of a torrent, returns the reply for the requester. Without patterns it
+        lists the files.
+        """
+        async with self.ongoing_lock:
+            handle = self.ongoing.get(id)
+            if handle not in self._torrent_ids:
+                return f"**{id}**\n__no running torrent__"
+            if not handle.status().has_metadata:
+                if patterns:
+                    self.selections[id] = patterns
+                    return f"**{id}**\n__files will be selected once the metadata arrived__"
+                return f"**{id}**\n__waiting for metadata__"
+            if not patterns:
+                return self._file_list(id, handle)
+            previous = self.selections.get(id)
+            self.selections[id] = patterns
+            if not self._select(id, handle):
+                if previous is None:
+                    self.selections.pop(id)
+                else:
+                    self.selections[id] = previous
+                return f"**{handle.status().name[:80]}**\n__no file matches__"
+            if id in self.awaiting_selection:
+                self.awaiting_selection.discard(id)
+                self._spawn(id, self._resume_when_admitted(id, handle, "download"))
+            else:
+                self.disk.resize(id, self._wanted[id])
+            return f"**{handle.status().name[:80]}**\n__{len(self.selected_files[id])} files selected__ ({get_readable_filesize(self._wanted[id])})"
+
+    async def _on_metadata_received(self, id: str, handle) -> None:
+        self._transition(id, JobState.DOWNLOADING)
+        if not self._select(id, handle):
+            self._await_selection(id, handle)
+        elif not (self.scheduler.try_admit(id, "download", "torrent", self.priorities.get(id, 0))
+                and self._try_reserve_torrent(id, handle)):
+            handle.pause()
+            self._spawn(id, self._resume_when_admitted(id, handle, "download"))
+        if self.incremental:
+            self._spawn(id, self._start_incremental(id, handle))
+
+    def _selected_paths(self, id: str, handle) -> Optional[list[Path]]:
+        selected = self.selected_files.get(id)
+        if selected is None:
+            return None
+        files = handle.torrent_file().files()
+        save_path = Path(handle.status().save_path)
+        return [save_path / files.file_path(i) for i in sorted(selected)]
+
+    def _on_file_completed(self, id: str, alert) -> None:
+        drive_upload = self.incremental_uploads.get(id)
+        if drive_upload is None:
+            return
+        selected = self.selected_files.get(id)
+        if selected is not None and alert.index not in selected:
+            return
+        files = alert.handle.torrent_file().files()
+        drive_upload.add_file(
+            Path(alert.handle.status().save_path) / files.file_path(alert.index))
+
+    async def _on_torrent_finished(self, id: str, handle) -> None:
+        torrent_status = handle.status()
+        self._update_progress(id, torrent_status)
+        self.disk.release(id)
+        drive_upload = self.incremental_uploads.pop(id, None)
+        selected = self._selected_paths(id, handle)
+        self._save_upload(id, torrent_status.name, Path(torrent_status.save_path), selected)
+        if drive_upload is None:
+            self._remove_torrent(handle)
+            self._queue_torrent_upload(
+                id, torrent_status.name, Path(torrent_status.save_path), selected)
+            return
+        self._add_completed_files(id, handle, drive_upload)
+        drive_upload.finish()
+        self._remove_torrent(handle)
+        # the upload is already running, it can only be counted
+        self.scheduler.occupy(id, "upload", "torrent")
+        self._transition(id, JobState.UPLOADING, drive_upload)
+        self._client.status_manager.set_status(
+            id, DriveUploadStatus(torrent_status.name, drive_upload))
+        self._watch(id, drive_upload, drive_upload._task)
+
+    def _save_upload(self, id: str, name: str, save_path: Path, selected: Optional[list[Path]]) -> None:
+        """
+        Record the files of a finished torrent, so a restart uploads them without the torrent.
+        """
+        self.resume.save_job(
+            id, sorted(self._client.status_manager.job_chats(id)), self.priorities.get(id, 0),
+            self.selections.get(id), {
+                "name": name,
+                "save_path": str(save_path),
+                "files": None if selected is None else [str(path) for path in selected],
+            })
+
+    def _queue_torrent_upload(self, id: str, name: str, save_path: Path, selected: Optional[list[Path]]) -> None:
+        self._upload_paths[id] = save_path
+
+        async def create() -> FolderUpload:
+            drive_parent = await self._client.drive.create_folder(id, app_properties={"torrent_name": name})
+            return self._client.drive.upload_folder(save_path, drive_parent, selected)
+        self._spawn(id, self._upload_when_admitted(id, "torrent", name, create))
+
+    def _on_state_update(self, alert) -> None:
+        for torrent_status in alert.status:
+            id = self._torrent_ids.get(torrent_status.handle)
+            if id is None:
+                continue
+            self._update_progress(id, torrent_status)
+            status = self._client.status_manager.statuses.get(id)
+            if isinstance(status, TorrentStatus):
+                status.update(torrent_status)
 
     def start_worker(self) -> None:
+        loop = asyncio.get_event_loop()
+        # called from a libtorrent thread, it must not call back into the session
+        self._ses.set_alert_notify(
+            lambda: loop.call_soon_threadsafe(self._alerts_ready.set))
         asyncio.create_task(self.worker())
+        asyncio.create_task(self.status_updates())
+
+    def _restart_stalled(self) -> None:
+        for id, handle in list(self.ongoing.items()):
+            if not isinstance(handle, HttpFileDownload) or handle.pipe is not None:
+                continue
+            if handle.is_started and not handle.is_finished \
+                    and handle.throughput.stalled_for() > self.stall_timeout:
+                logging.warning(
+                    f"{id} stalled for {handle.throughput.stalled_for():.0f}s, restarting")
+                handle.cancel()
+                handle.throughput.reset()
+                self._watch(id, handle, handle.start())
+
+    def _check_disk_space(self) -> None:
+        """
+        Pause the running torrents while the disk is almost full, resume them once uploads and
+        cleanup freed enough of it.
+        """
+        if self.disk.check():
+            for handle, id in self._torrent_ids.items():
+                if id in self._paused_for_space or self.states.get(id) is not JobState.DOWNLOADING:
+                    continue
+                if handle.flags() & lt.torrent_flags.paused:  # type: ignore
+                    continue
+                logging.warning(f"pausing {id}, disk space is low")
+                handle.pause()
+                self._paused_for_space.add(id)
+        elif self._paused_for_space:
+            for handle, id in self._torrent_ids.items():
+                if id in self._paused_for_space:
+                    logging.info(f"resuming {id}")
+                    handle.resume()
+            self._paused_for_space.clear()
+
+    async def status_updates(self) -> None:
+        """
+        Ask libtorrent for a state_update_alert with the statuses that changed, sample the
+        throughput of every transfer and restart stalled downloads.
+        """
+        while True:
+            if self._torrent_ids:
+                self._ses.post_torrent_updates()
+            if self._client.metrics_port is not None \
+                    and time.monotonic() - self._last_session_stats >= SESSION_STATS_INTERVAL:
+                self._last_session_stats = time.monotonic()
+                self._ses.post_session_stats()
+            if time.monotonic() - self._last_resume_save >= RESUME_SAVE_INTERVAL:
+                self._last_resume_save = time.monotonic()
+                self._save_resume_data(lt.torrent_handle.only_if_modified)  # type: ignore
+            for status in list(self._client.status_manager.statuses.values()):
+                status.sample()
+            self._restart_stalled()
+            self._check_disk_space()
+            await asyncio.sleep(STATUS_UPDATE_INTERVAL)
 
     async def worker(self) -> None:
         while True:
-            async with self.ongoing_lock:
-                for id, handle in list(self.ongoing.items()):
-                    if isinstance(handle, lt.torrent_handle):  # type: ignore
-                        torrent_status = handle.status()
-                        if torrent_status.is_seeding:
-                            drive_parent = await self._client.drive.create_folder(id, app_properties={"torrent_name": torrent_status.name})
-                            drive_upload = self._client.drive.upload_folder(
-                                Path(torrent_status.save_path), drive_parent)
-                            self.ongoing[id] = drive_upload
-                            self._client.status_manager.set_status(
-                                id, DriveUploadStatus(torrent_status.name, drive_upload))
-                            self._ses.remove_torrent(handle)
-                            drive_upload.start()
-                    elif isinstance(handle, FolderUpload) or isinstance(handle, FileUpload):
-                        if handle.is_finished:
-                            del self.ongoing[id]
-                            await self._client.status_manager.send_finished(id, handle)
-                            if handle.local_path.is_dir():
-                                shutil.rmtree(handle.local_path)
-                            else:
-                                os.remove(handle.local_path)
-                    elif isinstance(handle, RapidFileDownload) or isinstance(handle, DDLFileDownload):
-                        if handle.is_finished:
-                            file_upload = self._client.drive.upload_file(
-                                Path(handle.save_path))
-                            self.ongoing[id] = file_upload
-                            self._client.status_manager.set_status(
-                                id, DriveUploadStatus(handle.save_path.name, file_upload))
-                            file_upload.start()
-
+            await self._alerts_ready.wait()
+            self._alerts_ready.clear()
             alerts = self._ses.pop_alerts()
-            for a in alerts:
-                if a.category() & lt.alert.category_t.error_notification:  # type: ignore
-                    print(a)
-
-            await asyncio.sleep(0.2)
+            if not alerts:
+                continue
+            start = time.monotonic()
+            async with self.ongoing_lock:
+                for a in alerts:
+                    if isinstance(a, lt.state_update_alert):  # type: ignore
+                        self._on_state_update(a)
+                        continue
+                    if isinstance(a, lt.session_stats_alert):  # type: ignore
+                        update_libtorrent_stats(a.values)
+                        continue
+                    if isinstance(a, (lt.save_resume_data_alert, lt.save_resume_data_failed_alert)):  # type: ignore
+                        self._on_resume_data(a)
+                        continue
+                    if a.category() & lt.alert.category_t.error_notification:  # type: ignore
+                        logging.error(a.message())
+                    if not isinstance(a, lt.torrent_alert):  # type: ignore
+                        continue
+                    id = self._torrent_ids.get(a.handle)
+                    if id is None:
+                        continue
+                    # a failing alert fails its job, the worker keeps going for the others
+                    try:
+                        if isinstance(a, lt.metadata_received_alert):  # type: ignore
+                            await self._on_metadata_received(id, a.handle)
+                        elif isinstance(a, lt.file_completed_alert):  # type: ignore
+                            self._on_file_completed(id, a)
+                        elif isinstance(a, lt.torrent_finished_alert):  # type: ignore
+                            await self._on_torrent_finished(id, a.handle)
+                        elif isinstance(a, lt.torrent_error_alert):  # type: ignore
+                            self._fail_job(id)
+                    except Exception:
+                        logging.exception(f"{id} failed while handling {a.what()}")
+                        self._fail_job(id)
+            WORKER_LOOP_SECONDS.observe(time.monotonic() - start)
 
 
 class Chat:
@@ -312,12 +1380,22 @@ class Chat:
         self.last_message_text: Optional[str] = None
         self.subscribed: set[str] = set()
         self.should_resend = False
+        # group chat ids are negative
+        self.bucket = TokenBucket(
+            GROUP_CHAT_RATE if chat_id < 0 else PRIVATE_CHAT_RATE, CHAT_BURST)
+        self.interval = MIN_UPDATE_INTERVAL
+        self.next_update = 0.0
+        self.task: Optional[asyncio.Task] = None
 
 
 class StatusMessageManager:
     """
     Keeps track of the statuses of the torrents that are currently downloading and updates the
     status messages in the subscribed chats.
+
+    Chats are updated concurrently within Telegram's global and per chat limits. A chat whose
+    text keeps changing is updated every `MIN_UPDATE_INTERVAL` seconds, one whose text stays
+    the same backs off up to `MAX_UPDATE_INTERVAL`, and a FloodWait blocks only that chat.
     """
     client: Pupadrive
 
@@ -325,6 +1403,12 @@ class StatusMessageManager:
         self.client = client
         self.statuses: dict[str, Status] = {}
         self.chats: dict[int, Chat] = {}
+        # reverse of Chat.subscribed, id -> chat ids
+        self.subscribers: dict[str, set[int]] = {}
+        self._bucket = TokenBucket(GLOBAL_MESSAGE_RATE, GLOBAL_MESSAGE_RATE)
+        # member job id -> ids of the batches waiting for it
+        self._member_batches: dict[str, set[str]] = {}
+        self._batch_ids = itertools.count(1)
 
     def start_worker(self) -> None:
         asyncio.create_task(self.worker())
@@ -335,60 +1419,214 @@ class StatusMessageManager:
 
         logging.info(f"{chat_id} subscribed to {id}")
         self.chats[chat_id].subscribed.add(id)
+        self.subscribers.setdefault(id, set()).add(chat_id)
+
+    def job_chats(self, id: str) -> set[int]:
+        """
+        Chats following a job, directly or through a batch.
+        """
+        chat_ids = set(self.subscribers.get(id, ()))
+        for batch_id in self._member_batches.get(id, ()):
+            chat_ids |= self.subscribers.get(batch_id, set())
+        return chat_ids
 
     def chat_unsubscribe(self, chat_id: int, id: str) -> None:
         self.chats[chat_id].subscribed.remove(id)
+        chat_ids = self.subscribers.get(id)
+        if chat_ids is not None:
+            chat_ids.discard(chat_id)
+            if not chat_ids:
+                del self.subscribers[id]
 
     def set_status(self, id: str, status: Status) -> None:
         self.statuses[id] = status
 
-    async def send_finished(self, id: str, status: Union[FolderUpload, FileUpload]):
+    async def _call(self, chat: Chat, func: Callable[..., Awaitable[Any]], *args, retry: bool = False) -> Any:
+        """
+        Make a Telegram call for a chat within the rate limits. A FloodWait blocks the chat for
+        the requested time, the call is only repeated if `retry` is set.
+        """
+        for attempt in range(FLOOD_RETRIES + 1):
+            await chat.bucket.acquire()
+            await self._bucket.acquire()
+            try:
+                with track("telegram"):
+                    return await func(*args)
+            except FloodWait as e:
+                logging.warning(f"flood wait of {e.x}s in {chat.chat_id}")
+                chat.bucket.block(e.x)
+                chat.interval = min(MAX_UPDATE_INTERVAL,
+                                    max(chat.interval * 2, e.x))
+                if not retry or attempt == FLOOD_RETRIES:
+                    raise
+
+    def _notify(self, id: str, text: str) -> None:
+        """
+        Unsubscribe the chats following `id` and send them `text` in the background, so the
+        caller doesn't wait through the rate limits.
+        """
+        chats = [self.chats[chat_id]
+                 for chat_id in self.subscribers.pop(id, set())]
+        for chat in chats:
+            chat.subscribed.discard(id)
+        asyncio.create_task(self._send_all(chats, text))
+
+    async def _send_all(self, chats: list[Chat], text: str) -> None:
+        results = await asyncio.gather(
+            *(self._call(chat, self.client.send_message, chat.chat_id, text, retry=True)
+              for chat in chats),
+            return_exceptions=True)
+        for chat, result in zip(chats, results):
+            if isinstance(result, Exception):
+                logging.warning(f"could not notify {chat.chat_id}: {result}")
+
+    def send_finished(self, id: str, status: Union[FolderUpload, FileUpload]):
         """
         Send finished text to all subscribed chats and remove the status from the list.
         """
         s = self.statuses.pop(id)
-        for chat in self.chats.values():
-            if id in chat.subscribed:
-                status_text = f"""
+        if isinstance(status, FileUpload) and status.drive_parent == self.client.drive.root:
+            # a hoster download has no folder of its own, the file is the mirror
+            mirror_id = status.drive_id
+            link = f"https://drive.google.com/file/d/{status.drive_id}"
+        else:
+            mirror_id = status.drive_parent
+            link = f"https://drive.google.com/drive/folders/{status.drive_parent}"
+        asyncio.create_task(self.client.index.put(id, mirror_id, s.get_name()))
+        status_text = f"""
 **{s.get_name()[:80]}**
 __finished__ (Total: {get_readable_filesize(status.total_size)})
 
-Drive link: https://drive.google.com/drive/folders/{status.drive_parent}
+Drive link: {link}
+"""
+        self._notify(id, status_text)
+        self._batch_member_done(id, status_text, status.total_size)
+
+    def send_failed(self, id: str, reason: str = None):
+        """
+        Send failed text to all subscribed chats and remove the status from the list.
+        """
+        s = self.statuses.pop(id, None)
+        name = s.get_name() if s is not None else id
+        text = f"**{name[:80]}**\n__failed__"
+        if reason is not None:
+            text += f" ({reason})"
+        self._notify(id, text)
+        self._batch_member_done(id, text)
+
+    def create_batch(self, chat_id: int, size: int) -> BatchStatus:
+        batch = BatchStatus(f"batch_{next(self._batch_ids)}", self, size)
+        self.set_status(batch.id, batch)
+        self.chat_subscribe(chat_id, batch.id)
+        return batch
+
+    def batch_add(self, batch: BatchStatus, id: str) -> None:
+        batch.pending.add(id)
+        self._member_batches.setdefault(id, set()).add(batch.id)
+
+    def batch_ready(self, batch: BatchStatus) -> None:
+        """
+        Mark that all links of the batch were added.
+        """
+        batch.ready = True
+        self._finish_batch(batch)
+
+    def _batch_member_done(self, id: str, text: str, size: int = 0) -> None:
+        for batch_id in self._member_batches.pop(id, set()):
+            batch = self.statuses.get(batch_id)
+            if not isinstance(batch, BatchStatus):
+                continue
+            batch.pending.discard(id)
+            batch.finished_bytes += size
+            batch.add_result(text)
+            self._finish_batch(batch)
+
+    def _finish_batch(self, batch: BatchStatus) -> None:
+        if batch.ready and not batch.pending and self.statuses.pop(batch.id, None) is not None:
+            self._notify(batch.id, batch.get_summary_text())
+
+    def _render(self, id: str) -> str:
+        status = self.statuses[id]
+        queued = self.client.file_manager.scheduler.position(id)
+        needed = self.client.file_manager.disk.waiting.get(id)
+        if id in self.client.file_manager.awaiting_selection:
+            return f"""
+**{(status.get_name() or id)[:80]}**
+__waiting for file selection__
+"""
+        if needed is not None:
+            return f"""
+**{(status.get_name() or id)[:80]}**
+__waiting for disk space__ ({get_readable_filesize(needed)} needed)
+"""
+        if queued is None:
+            return status.get_status_text()
+        stage, position = queued
+        return f"""
+**{(status.get_name() or id)[:80]}**
+__queued for {stage}__ (position {position})
 """
-                chat.subscribed.remove(id)
-                await self.client.send_message(chat.chat_id, status_text)
 
     async def resend_status_message(self, chat_id):
         self.chats[chat_id].should_resend = True
+        self.chats[chat_id].next_update = 0.0
+
+    async def _delete_message(self, chat: Chat) -> None:
+        if chat.message:
+            message = chat.message
+            chat.message = None
+            chat.last_message_text = None
+            await self._call(chat, message.delete)
+
+    async def _update_chat(self, chat: Chat, rendered: dict[str, str]) -> None:
+        try:
+            if chat.should_resend:
+                chat.should_resend = False
+                await self._delete_message(chat)
+
+            if not chat.subscribed:
+                await self._delete_message(chat)
+                return
+
+            status_text = "".join(rendered[subscribed]
+                                  for subscribed in chat.subscribed if subscribed in rendered)
+
+            changed = chat.last_message_text != status_text
+            if chat.message:
+                if changed:
+                    await self._call(chat, chat.message.edit, status_text)
+            else:
+                chat.message = await self._call(chat, self.client.send_message, chat.chat_id, status_text)
+
+            chat.last_message_text = status_text
+            if changed:
+                chat.interval = max(MIN_UPDATE_INTERVAL, chat.interval / 2)
+            else:
+                chat.interval = min(MAX_UPDATE_INTERVAL, chat.interval * 1.5)
+        except FloodWait:
+            pass
+        except RPCError as e:
+            logging.warning(f"could not update status in {chat.chat_id}: {e}")
+        finally:
+            chat.next_update = time.monotonic() + chat.interval
 
     async def worker(self) -> None:
         while True:
-            for chat in self.chats.values():
-
-                if chat.should_resend:
-                    if chat.message:
-                        await chat.message.delete()
-                        chat.message = None
-                        chat.last_message_text = None
-                    chat.should_resend = False
-
-                if not chat.subscribed:
-                    if chat.message:
-                        await chat.message.delete()
-                        chat.message = None
-                        chat.last_message_text = None
-                    continue
-
-                status_text = ""
-                for subscribed in chat.subscribed:
-                    status_text += self.statuses[subscribed].get_status_text()
-
-                if chat.message:
-                    if chat.last_message_text != status_text:
-                        await chat.message.edit(status_text)
-                else:
-                    chat.message = await self.client.send_message(chat.chat_id, status_text)
-
-                chat.last_message_text = status_text
-
-            await asyncio.sleep(2)
+            now = time.monotonic()
+            due = [chat for chat in self.chats.values()
+                   if (chat.subscribed or chat.message)
+                   and (chat.task is None or chat.task.done())
+                   and now >= chat.next_update]
+
+            # every status is rendered once per tick and shared by all chats showing it
+            rendered: dict[str, str] = {}
+            for chat in due:
+                for id in chat.subscribed:
+                    if id not in rendered and id in self.statuses:
+                        rendered[id] = self._render(id)
+
+            for chat in due:
+                chat.task = asyncio.create_task(
+                    self._update_chat(chat, rendered))
+
+            await asyncio.sleep(SCHEDULER_TICK)
@@ -0,0 +1,39 @@
+from __future__ import annotations
+
+import os
+from typing import TYPE_CHECKING
+
+from pyrogram import filters
+
+from ..helper.tranlate import BOT_HANDLE
+from ..pupadrive import Pupadrive
+
+if TYPE_CHECKING:
+    from pyrogram.types import Message
+
+MAX_LINK_FILE_SIZE = 1024 * 1024
+
+
+@Pupadrive.on_message(filters.command(["bulk", f"bulk@{BOT_HANDLE}"]))
+async def mirror_bulk(client: Pupadrive, msg: Message):
+    text = (msg.text or msg.caption or "").split(maxsplit=1)
+    links = text[1].split() if len(text) > 1 else []
+
+    document = msg.document or (
+        msg.reply_to_message.document if msg.reply_to_message else None)
+    if document is not None:
+        if not (document.file_name or "").endswith(".txt") or document.file_size > MAX_LINK_FILE_SIZE:
+            await msg.reply("Only .txt files of up to 1 MiB are supported")
+            return
+        path = await client.download_media(document)
+        try:
+            with open(path, encoding="utf-8", errors="ignore") as f:
+                links += f.read().split()
+        finally:
+            os.remove(path)
+
+    if not links:
+        await msg.reply("No links found")
+        return
+    await client.file_manager.add_batch(links, msg.chat.id, client.job_priority(msg))
+    await client.status_manager.resend_status_message(msg.chat.id)
@@ -13,4 +13,4 @@ if TYPE_CHECKING:
 
 @Pupadrive.on_message(filters.command(["ddownload", f"ddownload@{BOT_HANDLE}"]))
 async def mirror_ddownload(client: Pupadrive, msg: Message):
-    await client.file_manager.add_ddownload(msg.command[1], msg.chat.id)
+    await client.file_manager.add_ddownload(msg.command[1], msg.chat.id, client.job_priority(msg))
@@ -5,6 +5,7 @@ from typing import TYPE_CHECKING
 from pyrogram import filters
 
 from ..helper.tranlate import BOT_HANDLE
+from ..manager import ASK_SELECTION
 from ..pupadrive import Pupadrive
 
 if TYPE_CHECKING:
@@ -13,6 +14,17 @@ if TYPE_CHECKING:
 
 @Pupadrive.on_message(filters.command(["mirror", f"mirror@{BOT_HANDLE}"]))
 async def mirror(client: Pupadrive, msg: Message):
-    magnet_link = msg.text.split(" ", 1)[1]
-    await client.file_manager.add_magnet(magnet_link, msg.chat.id)
+    # /mirror <magnet> [file numbers, ranges or globs, or ? to choose them later]
+    args = msg.text.split()
+    if len(args) < 2:
+        await msg.reply("Usage: /mirror <magnet> [files]")
+        return
+    magnet_link = args[1]
+    selection = None
+    if args[2:] == [ASK_SELECTION]:
+        selection = []
+    elif args[2:]:
+        selection = args[2:]
+    await client.file_manager.add_magnet(
+        magnet_link, msg.chat.id, client.job_priority(msg), selection=selection)
     await client.status_manager.resend_status_message(msg.chat.id)
@@ -13,4 +13,4 @@ if TYPE_CHECKING:
 
 @Pupadrive.on_message(filters.command(["rapidgator", f"rapidgator@{BOT_HANDLE}"]))
 async def mirror_rapidgator(client: Pupadrive, msg: Message):
-    await client.file_manager.add_rapidgator(msg.command[1], msg.chat.id)
+    await client.file_manager.add_rapidgator(msg.command[1], msg.chat.id, client.job_priority(msg))
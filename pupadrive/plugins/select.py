@@ -0,0 +1,27 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+
+from pyrogram import filters
+
+from ..helper.tranlate import BOT_HANDLE
+from ..pupadrive import Pupadrive
+
+if TYPE_CHECKING:
+    from pyrogram.types import Message
+
+
+@Pupadrive.on_message(filters.command(["select", f"select@{BOT_HANDLE}"]))
+async def select(client: Pupadrive, msg: Message):
+    # /select <info hash> [file numbers, ranges or globs], lists the files without them
+    args = msg.text.split()
+    if len(args) < 2:
+        await msg.reply("Usage: /select <info hash> [files]")
+        return
+    id = args[1]
+    # only chats following the torrent and the owner may change its files
+    is_owner = msg.from_user is not None and msg.from_user.id == client.owner_id
+    if not is_owner and msg.chat.id not in client.status_manager.job_chats(id):
+        await msg.reply(f"**{id}**\n__no running torrent__")
+        return
+    await msg.reply(await client.file_manager.select(id, args[2:]))
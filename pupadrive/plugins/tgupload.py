@@ -1,7 +1,5 @@
 from __future__ import annotations
 
-import os
-from pathlib import Path
 from typing import TYPE_CHECKING
 
 from pyrogram import filters
@@ -15,17 +13,9 @@ if TYPE_CHECKING:
 
 @Pupadrive.on_message(filters.command(["upload", f"upload@{BOT_HANDLE}"]))
 async def upload_file(client: Pupadrive, msg: Message):
-    filename = msg.reply_to_message.document.file_name
-    file_id = msg.reply_to_message.document.file_id
-    check = await client.drive.check_folder(filename)
-    if check is None:
-        await msg.reply(f"Mirroring {msg.reply_to_message.document.file_name}")
-        await client.download_media(file_id, msg.reply_to_message.document.file_name)
-        folder_id = await client.drive.create_folder(filename)
-        file_upload = client.drive.upload_file(Path(
-            f"pupadrive/downloads/{msg.reply_to_message.document.file_name}"), folder_id)
-        await file_upload.upload()
-        os.remove(
-            f"pupadrive/downloads/{msg.reply_to_message.document.file_name}")
-    else:
-        await msg.reply(f'File already exists\n\nhttps://drive.google.com/drive/folders/{check[0]}')
+    if msg.reply_to_message is None or msg.reply_to_message.document is None:
+        await msg.reply("Reply to a document to mirror it")
+        return
+    await client.file_manager.add_telegram(
+        msg.reply_to_message, msg.chat.id, client.job_priority(msg))
+    await client.status_manager.resend_status_message(msg.chat.id)
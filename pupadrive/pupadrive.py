@@ -9,8 +9,14 @@ from pyrogram.raw.types.bot_command import BotCommand
 from pyrogram.types import Message
 
 from . import __version__
+from .helper.aiodrive import AioDrive
 from .helper.ddownload import Ddownload
-from .helper.drive import Drive
+from .helper.download import DEFAULT_SEGMENT_SIZE, DEFAULT_SEGMENTS, DEFAULT_WRITE_BUFFERS
+from .helper.drive import SCOPES, Drive
+from .helper.drivepool import DEFAULT_DAILY_QUOTA, load_identities
+from .helper.http_methods import HttpMethods
+from .helper.index import DEFAULT_INDEX_TTL, MirrorIndex
+from .helper.metrics import start_metrics_server
 from .helper.rapidgator import Rapidgator
 from .helper.tranlate import BOT_HANDLE
 from .helper.utils import try_get_env
@@ -18,6 +24,9 @@ from .manager import FileManager, StatusMessageManager
 
 logger = logging.getLogger(__name__)
 
+DEFAULT_PRIORITY = 0
+OWNER_PRIORITY = 10
+
 
 class Pupadrive(Client):
     def __init__(self):
@@ -36,6 +45,12 @@ class Pupadrive(Client):
         DDL_PASSWORD = try_get_env("DDL_PASSWORD")
         DDL_API_KEY = try_get_env("DDL_API_KEY")
         PROXY = f"http://{PROXY_USERNAME}:{PROXY_PASSWORD}@{PROXY_HOSTNAME}:3128"
+        DOWNLOAD_SEGMENTS = int(os.getenv("DOWNLOAD_SEGMENTS", DEFAULT_SEGMENTS))
+        DOWNLOAD_SEGMENT_SIZE = int(
+            os.getenv("DOWNLOAD_SEGMENT_SIZE", DEFAULT_SEGMENT_SIZE))
+        # 4 MiB write buffers per download connection
+        DOWNLOAD_WRITE_BUFFERS = int(os.getenv("DOWNLOAD_WRITE_BUFFERS", DEFAULT_WRITE_BUFFERS))
+        UPLOAD_CONCURRENCY = int(os.getenv("UPLOAD_CONCURRENCY", 4))
 
         plugins = dict(root=f"{_name}.plugins")
 
@@ -49,12 +64,35 @@ class Pupadrive(Client):
         self.owner_id = OWNER_ID
         self.auth_users = [OWNER_ID]
         self.auth_chats = []
+        # prometheus metrics are served on this port if it is set
+        METRICS_PORT = os.getenv("METRICS_PORT")
+        self.metrics_port = int(METRICS_PORT) if METRICS_PORT else None
+        self.metrics_host = os.getenv("METRICS_HOST", "127.0.0.1")
+        self._metrics_runner = None
         self.file_manager = FileManager(self)
         self.status_manager = StatusMessageManager(self)
-        self.drive = Drive()
-        self.rapidgator = Rapidgator(RG_USERNAME, RG_PASSWORD)
+        # "aiohttp" runs drive calls on the event loop instead of googleapiclient threads
+        drive_backend = AioDrive if os.getenv(
+            "DRIVE_BACKEND", "googleapiclient").lower() == "aiohttp" else Drive
+        self.drive = drive_backend(
+            upload_concurrency=UPLOAD_CONCURRENCY,
+            upload_order=os.getenv("UPLOAD_ORDER"),
+            adaptive_chunks=os.getenv("ADAPTIVE_CHUNKS", "False").lower() in ("true", "1", "t"),
+            # a directory of OAuth tokens and service account keys to spread uploads over
+            identities=load_identities(os.getenv("DRIVE_CREDENTIALS_DIR"), SCOPES),
+            daily_quota=int(os.getenv("DRIVE_DAILY_QUOTA", DEFAULT_DAILY_QUOTA)),
+            # e.g. a local stand-in for the drive api
+            api_endpoint=os.getenv("DRIVE_API_ENDPOINT"),
+            upload_threads=self._upload_threads(UPLOAD_CONCURRENCY))
+        self.index = MirrorIndex(os.getenv("INDEX_PATH", f"{_name}.db"),
+                                 ttl=float(os.getenv("INDEX_TTL", DEFAULT_INDEX_TTL)))
+        self.drive.index = self.index
+        self.rapidgator = Rapidgator(
+            RG_USERNAME, RG_PASSWORD, segments=DOWNLOAD_SEGMENTS, segment_size=DOWNLOAD_SEGMENT_SIZE,
+            write_buffers=DOWNLOAD_WRITE_BUFFERS)
         self.ddownload = Ddownload(
-            DDL_USERNAME, DDL_PASSWORD, DDL_API_KEY, PROXY)
+            DDL_USERNAME, DDL_PASSWORD, DDL_API_KEY, PROXY, segments=DOWNLOAD_SEGMENTS, segment_size=DOWNLOAD_SEGMENT_SIZE,
+            write_buffers=DOWNLOAD_WRITE_BUFFERS)
 
         if PRIVATE:
 
@@ -80,11 +118,31 @@ class Pupadrive(Client):
         async def auth_public(client: Pupadrive, msg: Message):
             await msg.reply("Bot is already public")
 
+    def job_priority(self, msg: Message) -> int:
+        """
+        Jobs of the owner skip ahead of everyone else's in the scheduler.
+        """
+        if msg.from_user and msg.from_user.id == self.owner_id:
+            return OWNER_PRIORITY
+        return DEFAULT_PRIORITY
+
+    def _upload_threads(self, upload_concurrency: int) -> int:
+        """
+        Threads uploads can occupy at once: every upload job and every download, which may
+        stream or upload a torrent's files as they complete, runs up to `upload_concurrency`.
+        """
+        limits = self.file_manager.scheduler.limits
+        return upload_concurrency * (limits["upload"] + limits["download"])
+
     async def start(self):
         await super().start()
         await self.ddownload.setup()
         self.file_manager.start_worker()
         self.status_manager.start_worker()
+        await self.file_manager.restore()
+        self.index.start_worker(self.drive)
+        if self.metrics_port is not None:
+            self._metrics_runner = await start_metrics_server(self.metrics_port, self.metrics_host)
 
         me = await self.get_me()
 
@@ -110,5 +168,12 @@ class Pupadrive(Client):
             f"Pupadrive v{__version__} (Layer {layer}) started on @{me.username}.")
 
     async def stop(self, *args):
+        await self.file_manager.save_state()
         await super().stop()
+        await self.rapidgator.close()
+        await self.ddownload.close()
+        await HttpMethods.close_shared_connector()
+        await self.drive.close()
+        if self._metrics_runner is not None:
+            await self._metrics_runner.cleanup()
         logger.info("Pupadrive stopped.")
@@ -0,0 +1,43 @@
+from pupadrive.manager import BatchStatus
+
+
+class FakeStatus:
+    throughput = None
+
+    def __init__(self, done, total):
+        self.progress = (done, total)
+
+    def get_progress(self):
+        return self.progress
+
+
+class FakeManager:
+    def __init__(self):
+        self.statuses = {}
+
+
+def test_progress_of_pending_jobs():
+    manager = FakeManager()
+    batch = BatchStatus("batch_1", manager, 2)
+    manager.statuses = {"a": FakeStatus(10, 100), "b": FakeStatus(5, 50)}
+    batch.pending = {"a", "b"}
+    assert batch.get_progress() == (15, 150)
+
+
+def test_finished_jobs_stay_in_the_progress():
+    manager = FakeManager()
+    batch = BatchStatus("batch_1", manager, 2)
+    manager.statuses = {"b": FakeStatus(5, 50)}
+    batch.pending = {"b"}
+    batch.finished_bytes = 100
+    assert batch.get_progress() == (105, 150)
+
+
+def test_summary_is_cut_off():
+    batch = BatchStatus("batch_1", FakeManager(), 3)
+    for i in range(3):
+        batch.add_result(f"**file {i}**\n__finished__" + " x" * 750)
+    summary = batch.get_summary_text()
+    assert "file 1" in summary
+    assert "file 2" not in summary
+    assert "... and 1 more" in summary
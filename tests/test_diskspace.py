@@ -0,0 +1,76 @@
+import asyncio
+
+import pytest
+
+from pupadrive.helper.diskspace import DiskSpace, DiskSpaceError
+
+
+def disk(free, low_watermark=10):
+    space = DiskSpace(low_watermark=low_watermark)
+    space.free = lambda: free
+    return space
+
+
+def test_reservations_count_what_is_not_written_yet():
+    space = disk(100)
+    written = 0
+    assert space.try_reserve("a", 50, lambda: written)
+    assert space.available() == 40
+    written = 30
+    assert space.available() == 70
+    assert not space.try_reserve("b", 80)
+    assert space.try_reserve("b", 70)
+
+
+def test_release_frees_the_reservation():
+    space = disk(100)
+    assert space.try_reserve("a", 90)
+    assert not space.try_reserve("b", 10)
+    space.release("a")
+    assert space.try_reserve("b", 10)
+
+
+def test_resize_changes_the_reservation():
+    space = disk(100)
+    assert space.try_reserve("a", 90)
+    space.resize("a", 40)
+    assert space.available() == 50
+    # only existing reservations are resized
+    space.resize("b", 10)
+    assert space.reserved() == 40
+
+
+def test_reserve_waits_for_a_release():
+    async def run():
+        space = disk(100)
+        assert space.try_reserve("a", 60)
+        waiting = asyncio.create_task(space.reserve("b", 60))
+        await asyncio.sleep(0.01)
+        assert not waiting.done()
+        assert space.waiting == {"b": 60}
+        space.release("a")
+        await asyncio.wait_for(waiting, 1)
+        assert space.waiting == {}
+        assert space.reserved() == 60
+
+    asyncio.run(run())
+
+
+def test_reserve_fails_if_it_can_never_fit():
+    async def run():
+        space = disk(100)
+        assert space.try_reserve("a", 60)
+        with pytest.raises(DiskSpaceError):
+            await space.reserve("b", 200)
+        assert space.waiting == {}
+
+    asyncio.run(run())
+
+
+def test_check_keeps_the_low_state_until_twice_the_watermark():
+    space = disk(5)
+    assert space.check()
+    space.free = lambda: 15
+    assert space.check()
+    space.free = lambda: 25
+    assert not space.check()
@@ -0,0 +1,46 @@
+from pupadrive.helper.download import DownloadJournal
+
+
+def journal(done=None, total=100):
+    return DownloadJournal(None, total, done)
+
+
+def test_ranges_merge():
+    j = journal()
+    j.add(20, 30)
+    j.add(0, 10)
+    j.add(10, 20)
+    assert j.done == [[0, 30]]
+    assert j.done_bytes() == 30
+
+
+def test_overlapping_ranges_merge():
+    j = journal([[0, 10], [40, 50]])
+    j.add(5, 45)
+    assert j.done == [[0, 50]]
+
+
+def test_separate_ranges_stay_apart():
+    j = journal()
+    j.add(50, 60)
+    j.add(0, 10)
+    assert j.done == [[0, 10], [50, 60]]
+    assert j.done_bytes() == 20
+
+
+def test_missing():
+    assert journal().missing() == [(0, 100)]
+    assert journal([[0, 10], [50, 60]]).missing() == [(10, 50), (60, 100)]
+    assert journal([[0, 100]]).missing() == []
+
+
+def test_save_and_load(tmp_path):
+    path = tmp_path / "file.journal"
+    j = DownloadJournal(path, 100)
+    j.add(0, 40)
+    j.save(force=True)
+    assert DownloadJournal.load(path, 100).done == [[0, 40]]
+    # a journal of a file with another size doesn't apply
+    assert DownloadJournal.load(path, 200).done == []
+    j.delete()
+    assert not path.exists()
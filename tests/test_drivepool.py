@@ -0,0 +1,74 @@
+import datetime
+
+import pytest
+
+from pupadrive.helper import drivepool
+from pupadrive.helper.drivepool import (RATE_LIMIT_COOLDOWN, DriveIdentity, DrivePool,
+                                        QuotaExhausted, quota_reason)
+
+
+def pool(count=2, daily_quota=100):
+    return DrivePool([DriveIdentity(f"id{i}", None) for i in range(count)], daily_quota)
+
+
+def test_quota_reason():
+    content = '{"error": {"errors": [{"reason": "userRateLimitExceeded"}]}}'
+    assert quota_reason(403, content) == "userRateLimitExceeded"
+    assert quota_reason(500, content) is None
+    assert quota_reason(403, '{"error": {"errors": [{"reason": "forbidden"}]}}') is None
+    assert quota_reason(429, "not json") is None
+
+
+def test_uploads_go_to_the_least_loaded_identity():
+    p = pool()
+    first = p.acquire(60)
+    second = p.acquire(10)
+    assert first is not second
+    p.release(second, 10, 10)
+    # 60 pending on the first, 10 uploaded on the second
+    assert p.acquire(10) is second
+
+
+def test_uploads_continue_when_every_identity_is_over_the_quota():
+    p = pool(daily_quota=100)
+    a, b = p.identities
+    a.uploaded_today = 120
+    b.uploaded_today = 90
+    # drive decides whether it still takes the upload
+    assert p.acquire(50) is b
+
+
+def test_daily_quota_fails_over_until_the_next_day(monkeypatch):
+    p = pool()
+    a, b = p.identities
+    p.block(a, "dailyLimitExceeded")
+    assert not a.available()
+    assert p.acquire(10) is b
+    p.block(b, "uploadLimitExceeded")
+    with pytest.raises(QuotaExhausted):
+        p.acquire(10)
+    tomorrow = drivepool._next_day()
+    monkeypatch.setattr(drivepool.time, "time", lambda: tomorrow)
+    assert a.available() and b.available()
+
+
+def test_rate_limits_back_off(monkeypatch):
+    now = 1000.0
+    monkeypatch.setattr(drivepool.time, "time", lambda: now)
+    monkeypatch.setattr(drivepool, "_next_day", lambda: now + 24 * 60 * 60)
+    p = pool()
+    a, _ = p.identities
+    p.block(a, "rateLimitExceeded")
+    assert a.blocked_until == now + RATE_LIMIT_COOLDOWN
+    p.block(a, "rateLimitExceeded")
+    assert a.blocked_until == now + 2 * RATE_LIMIT_COOLDOWN
+
+
+def test_counters_reset_with_the_day(monkeypatch):
+    p = pool()
+    a, _ = p.identities
+    p.release(p.acquire(40), 40, 40)
+    a.strikes = 3
+    monkeypatch.setattr(drivepool, "_today", lambda: p._day + datetime.timedelta(days=1))
+    p.acquire(0)
+    assert all(i.uploaded_today == 0 and i.strikes == 0 for i in p.identities)
@@ -0,0 +1,74 @@
+import asyncio
+
+from pupadrive.helper import index as index_module
+from pupadrive.helper.index import MirrorIndex
+
+
+class FakeDrive:
+    def __init__(self, folders):
+        self.folders = folders
+
+    async def folder_exists(self, folder_id):
+        return folder_id in self.folders
+
+
+def test_put_get_remove(tmp_path):
+    async def run():
+        index = MirrorIndex(str(tmp_path / "index.db"))
+        assert await index.get("hash") is None
+        await index.put("hash", "folder", "name")
+        assert await index.get("hash") == ("folder", "name")
+        await index.remove("hash")
+        assert await index.get("hash") is None
+
+    asyncio.run(run())
+
+
+def test_entries_persist(tmp_path):
+    async def run():
+        await MirrorIndex(str(tmp_path / "index.db")).put("hash", "folder", None)
+        assert await MirrorIndex(str(tmp_path / "index.db")).get("hash") == ("folder", None)
+
+    asyncio.run(run())
+
+
+def test_expired_entries_are_not_trusted(tmp_path, monkeypatch):
+    async def run():
+        index = MirrorIndex(str(tmp_path / "index.db"), ttl=60)
+        await index.put("hash", "folder", "name")
+        monkeypatch.setattr(index_module.time, "time", lambda: now + 61)
+        assert await index.get("hash") is None
+
+    now = index_module.time.time()
+    asyncio.run(run())
+
+
+def test_contents(tmp_path):
+    async def run():
+        index = MirrorIndex(str(tmp_path / "index.db"))
+        assert not await index.has_size(10)
+        await index.put_content(10, "md5", "file")
+        assert await index.has_size(10)
+        assert await index.get_content(10, "md5") == "file"
+        assert await index.get_content(10, "other") is None
+        await index.remove_content(10, "md5")
+        assert not await index.has_size(10)
+
+    asyncio.run(run())
+
+
+def test_reconcile_refreshes_or_drops_expired_entries(tmp_path, monkeypatch):
+    async def run():
+        index = MirrorIndex(str(tmp_path / "index.db"), ttl=60)
+        await index.put("kept", "folder", "kept")
+        await index.put("gone", "deleted", "gone")
+        monkeypatch.setattr(index_module.time, "time", lambda: now + 61)
+        await index.reconcile(FakeDrive({"folder"}))
+        assert await index.get("kept") == ("folder", "kept")
+        assert await index._run("SELECT key FROM mirrors") == [("kept",)]
+        # nothing is left to check until the refreshed entry expires again
+        await index.reconcile(FakeDrive(set()))
+        assert await index.get("kept") == ("folder", "kept")
+
+    now = index_module.time.time()
+    asyncio.run(run())
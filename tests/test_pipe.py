@@ -0,0 +1,66 @@
+import asyncio
+
+import pytest
+
+from pupadrive.helper.pipe import PipeError, StreamPipe
+
+
+def test_read_returns_written_ranges():
+    async def run():
+        pipe = StreamPipe(capacity=16)
+        pipe.set_size(8)
+        await pipe.write(b"abcd")
+        await pipe.write(b"efgh")
+        pipe.close()
+        assert pipe.read(0, 4) == b"abcd"
+        # a range can be read again until the reader moves past it
+        assert pipe.read(0, 4) == b"abcd"
+        assert pipe.read(4, 4) == b"efgh"
+        with pytest.raises(PipeError):
+            pipe.read(0, 4)
+        assert pipe.md5 == "e8dc4081b13434b45189a720b77b6818"
+
+    asyncio.run(run())
+
+
+def test_write_waits_for_the_reader():
+    async def run():
+        pipe = StreamPipe(capacity=8)
+        await pipe.write(b"a" * 8)
+        blocked = asyncio.create_task(pipe.write(b"b" * 8))
+        await asyncio.sleep(0.01)
+        assert not blocked.done()
+        loop = asyncio.get_event_loop()
+        assert await loop.run_in_executor(None, pipe.read, 0, 8) == b"a" * 8
+        # reading past the first range frees its space
+        reader = loop.run_in_executor(None, pipe.read, 8, 8)
+        await asyncio.wait_for(blocked, 1)
+        assert await reader == b"b" * 8
+
+    asyncio.run(run())
+
+
+def test_abort_releases_a_blocked_writer():
+    async def run():
+        pipe = StreamPipe(capacity=8)
+        await pipe.write(b"a" * 8)
+        blocked = asyncio.create_task(pipe.write(b"b" * 8))
+        await asyncio.sleep(0.01)
+        pipe.abort(RuntimeError("upload failed"))
+        with pytest.raises(PipeError):
+            await asyncio.wait_for(blocked, 1)
+
+    asyncio.run(run())
+
+
+def test_abort_releases_a_blocked_reader():
+    async def run():
+        pipe = StreamPipe(capacity=8)
+        loop = asyncio.get_event_loop()
+        reader = loop.run_in_executor(None, pipe.read, 0, 4)
+        await asyncio.sleep(0.01)
+        pipe.abort(RuntimeError("download failed"))
+        with pytest.raises(PipeError):
+            await asyncio.wait_for(reader, 1)
+
+    asyncio.run(run())
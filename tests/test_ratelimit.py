@@ -0,0 +1,60 @@
+import pytest
+
+from pupadrive.helper import ratelimit
+from pupadrive.helper.ratelimit import TokenBucket
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(ratelimit.time, "monotonic", clock)
+    return clock
+
+
+def take(bucket):
+    assert bucket.delay() == 0
+    bucket._tokens -= 1
+
+
+def test_burst_up_to_capacity(clock):
+    bucket = TokenBucket(rate=2.0, capacity=3.0)
+    for _ in range(3):
+        take(bucket)
+    assert bucket.delay() == pytest.approx(0.5)
+
+
+def test_refills_at_rate(clock):
+    bucket = TokenBucket(rate=2.0, capacity=1.0)
+    take(bucket)
+    clock.now += 0.25
+    assert bucket.delay() == pytest.approx(0.25)
+    clock.now += 0.25
+    take(bucket)
+
+
+def test_refill_stops_at_capacity(clock):
+    bucket = TokenBucket(rate=1.0, capacity=2.0)
+    clock.now += 100
+    take(bucket)
+    take(bucket)
+    assert bucket.delay() == pytest.approx(1.0)
+
+
+def test_block(clock):
+    bucket = TokenBucket(rate=10.0, capacity=5.0)
+    bucket.block(30)
+    assert bucket.delay() == pytest.approx(30)
+    # a shorter block doesn't shorten the current one
+    bucket.block(5)
+    clock.now += 20
+    assert bucket.delay() == pytest.approx(10)
+    clock.now += 10
+    take(bucket)
@@ -0,0 +1,96 @@
+import asyncio
+
+from pupadrive.helper.scheduler import JobScheduler, parse_limits
+
+
+def test_parse_limits():
+    assert parse_limits("rapidgator=2, ddownload=1,broken") == {"rapidgator": 2, "ddownload": 1}
+    assert parse_limits(None) == {}
+
+
+def test_stage_limit():
+    scheduler = JobScheduler({"download": 2})
+    assert scheduler.try_admit("a", "download", "torrent")
+    assert scheduler.try_admit("b", "download", "torrent")
+    assert not scheduler.try_admit("c", "download", "torrent")
+    scheduler.release("a")
+    assert scheduler.try_admit("c", "download", "torrent")
+
+
+def test_source_limit():
+    scheduler = JobScheduler({"download": 3}, {"rapidgator": 1})
+    assert scheduler.try_admit("a", "download", "rapidgator")
+    assert not scheduler.try_admit("b", "download", "rapidgator")
+    assert scheduler.try_admit("c", "download", "torrent")
+
+
+def test_admission_moves_the_slot_to_the_new_stage():
+    scheduler = JobScheduler({"download": 1, "upload": 1})
+    assert scheduler.try_admit("a", "download", "torrent")
+    assert scheduler.try_admit("a", "upload", "torrent")
+    assert scheduler.try_admit("b", "download", "torrent")
+
+
+def test_waiters_are_admitted_by_priority_then_arrival():
+    async def run():
+        scheduler = JobScheduler({"download": 1})
+        assert scheduler.try_admit("running", "download", "torrent")
+        admitted = []
+
+        async def wait(id, priority):
+            await scheduler.admit(id, "download", "torrent", priority)
+            admitted.append(id)
+
+        tasks = [asyncio.create_task(wait("low", 0)),
+                 asyncio.create_task(wait("later", 0)),
+                 asyncio.create_task(wait("high", 10))]
+        await asyncio.sleep(0)
+        assert scheduler.position("high") == ("download", 1)
+        assert scheduler.position("low") == ("download", 2)
+        assert scheduler.position("running") is None
+        for id in ("running", "high", "low"):
+            scheduler.release(id)
+            await asyncio.sleep(0)
+        await asyncio.gather(*tasks)
+        assert admitted == ["high", "low", "later"]
+
+    asyncio.run(run())
+
+
+def test_waiting_jobs_keep_their_turn():
+    async def run():
+        scheduler = JobScheduler({"download": 1})
+        assert scheduler.try_admit("a", "download", "torrent")
+        waiter = asyncio.create_task(scheduler.admit("b", "download", "torrent"))
+        await asyncio.sleep(0)
+        scheduler.release("a")
+        # "b" got the slot before a new job could take it
+        assert not scheduler.try_admit("c", "download", "torrent")
+        await waiter
+
+    asyncio.run(run())
+
+
+def test_release_cancels_a_waiting_job():
+    async def run():
+        scheduler = JobScheduler({"download": 1})
+        assert scheduler.try_admit("a", "download", "torrent")
+        waiter = asyncio.create_task(scheduler.admit("b", "download", "torrent"))
+        await asyncio.sleep(0)
+        scheduler.release("b")
+        assert scheduler.position("b") is None
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            pass
+        assert waiter.cancelled()
+
+    asyncio.run(run())
+
+
+def test_occupy_counts_past_the_limit():
+    scheduler = JobScheduler({"upload": 1})
+    assert scheduler.try_admit("a", "upload", "torrent")
+    scheduler.occupy("b", "upload", "torrent")
+    scheduler.release("a")
+    assert not scheduler.try_admit("c", "upload", "torrent")
@@ -0,0 +1,34 @@
+from pupadrive.helper.selection import DEFAULT_FILE_PRIORITY, file_priorities, select_files
+
+PATHS = [
+    "Show/Season 1/E01.mkv",
+    "Show/Season 1/E02.mkv",
+    "Show/Season 1/E02.srt",
+    "Show/Extras/Making Of.MKV",
+    "Show/readme.txt",
+]
+
+
+def test_numbers_and_ranges():
+    assert select_files(["1", "3-4"], PATHS) == {0, 2, 3}
+
+
+def test_out_of_range_numbers_are_ignored():
+    assert select_files(["0", "5-9"], PATHS) == {4}
+
+
+def test_comma_separated():
+    assert select_files(["1,2", "*.txt"], PATHS) == {0, 1, 4}
+
+
+def test_globs_match_name_or_path_case_insensitively():
+    assert select_files(["*.mkv"], PATHS) == {0, 1, 3}
+    assert select_files(["show/season 1/*"], PATHS) == {0, 1, 2}
+
+
+def test_no_match():
+    assert select_files(["*.iso"], PATHS) == set()
+
+
+def test_file_priorities():
+    assert file_priorities({0, 2}, 3) == [DEFAULT_FILE_PRIORITY, 0, DEFAULT_FILE_PRIORITY]
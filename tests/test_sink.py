@@ -0,0 +1,70 @@
+import asyncio
+import hashlib
+
+from pupadrive.helper.sink import FileSink, file_md5
+
+DATA = bytes(range(256)) * 4
+
+
+async def write_segments(sink, segments):
+    for start, end in segments:
+        stream = sink.stream(start)
+        await stream.write(DATA[start:end])
+        stream.flush()
+        # let the writer thread take the segments in this order
+        await sink.flush()
+    await sink.close()
+
+
+def test_in_order_writes_are_hashed(tmp_path):
+    async def run():
+        sink = FileSink(tmp_path / "file", buffer_size=64, checksum=True)
+        await sink.open(len(DATA))
+        await write_segments(sink, [(0, 512), (512, 1024)])
+        return sink
+
+    sink = asyncio.run(run())
+    assert (tmp_path / "file").read_bytes() == DATA
+    assert sink.md5 == hashlib.md5(DATA).hexdigest()
+
+
+def test_out_of_order_writes_are_held_back(tmp_path):
+    async def run():
+        sink = FileSink(tmp_path / "file", buffer_size=64, checksum=True, hold_back=512)
+        await sink.open(len(DATA))
+        await write_segments(sink, [(512, 1024), (0, 512)])
+        return sink
+
+    sink = asyncio.run(run())
+    assert (tmp_path / "file").read_bytes() == DATA
+    assert sink.md5 == hashlib.md5(DATA).hexdigest()
+
+
+def test_checksum_is_given_up_past_the_hold_back(tmp_path):
+    async def run():
+        sink = FileSink(tmp_path / "file", buffer_size=64, checksum=True, hold_back=256)
+        await sink.open(len(DATA))
+        await write_segments(sink, [(512, 1024), (0, 512)])
+        return sink
+
+    sink = asyncio.run(run())
+    assert sink.md5 is None
+    # the complete file is hashed instead
+    assert file_md5(tmp_path / "file") == hashlib.md5(DATA).hexdigest()
+
+
+def test_resumed_ranges_are_read_back(tmp_path):
+    path = tmp_path / "file"
+
+    async def run():
+        first = FileSink(path, buffer_size=64)
+        await first.open(len(DATA))
+        await write_segments(first, [(256, 768)])
+        sink = FileSink(path, buffer_size=64, checksum=True)
+        await sink.open(len(DATA), keep=True, existing=[[256, 768]])
+        await write_segments(sink, [(0, 256), (768, 1024)])
+        return sink
+
+    sink = asyncio.run(run())
+    assert path.read_bytes() == DATA
+    assert sink.md5 == hashlib.md5(DATA).hexdigest()
@@ -0,0 +1,79 @@
+import math
+
+import pytest
+
+from pupadrive.helper.throughput import ThroughputTracker
+
+
+class Counter:
+    def __init__(self):
+        self.value = 0
+
+    def __call__(self):
+        return self.value
+
+
+def test_rate_and_speed():
+    counter = Counter()
+    tracker = ThroughputTracker(counter, time_constant=10.0)
+    tracker.sample(0.0)
+    counter.value = 1000
+    tracker.sample(1.0)
+    assert tracker.rate == pytest.approx(1000)
+    assert tracker.speed == pytest.approx(1000 * (1 - math.exp(-0.1)))
+
+
+def test_speed_converges_to_a_steady_rate():
+    counter = Counter()
+    tracker = ThroughputTracker(counter, time_constant=2.0)
+    for second in range(60):
+        counter.value = second * 500
+        tracker.sample(float(second))
+    assert tracker.speed == pytest.approx(500, rel=1e-3)
+    assert tracker.window_rate() == pytest.approx(500)
+
+
+def test_window_keeps_the_last_samples():
+    counter = Counter()
+    tracker = ThroughputTracker(counter, window=3)
+    for second, value in enumerate((0, 0, 100, 200)):
+        counter.value = value
+        tracker.sample(float(second))
+    assert tracker.window_rate() == pytest.approx(100)
+
+
+def test_restart_resets():
+    counter = Counter()
+    tracker = ThroughputTracker(counter)
+    tracker.sample(0.0)
+    counter.value = 1000
+    tracker.sample(1.0)
+    counter.value = 10
+    tracker.sample(2.0)
+    assert tracker.speed == 0
+    assert tracker.window_rate() == 0
+
+
+def test_eta():
+    counter = Counter()
+    tracker = ThroughputTracker(counter)
+    assert tracker.eta(1000) is None
+    tracker.sample(0.0)
+    counter.value = 100
+    tracker.sample(1.0)
+    assert tracker.eta(100 + 10 * tracker.speed) == pytest.approx(10)
+    assert tracker.eta(50) == 0
+
+
+def test_reset_restarts_the_stall_clock(monkeypatch):
+    from pupadrive.helper import throughput
+
+    now = [0.0]
+    monkeypatch.setattr(throughput.time, "monotonic", lambda: now[0])
+    tracker = ThroughputTracker(Counter())
+    tracker.sample()
+    now[0] = 600.0
+    tracker.sample()
+    assert tracker.stalled_for() == 600
+    tracker.reset()
+    assert tracker.stalled_for() == 0